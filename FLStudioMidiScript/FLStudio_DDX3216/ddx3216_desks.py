@@ -0,0 +1,201 @@
+"""
+ddx3216_desks.py
+
+Controller layer for more than one DDX3216 -- cascaded on one MIDI chain,
+or in separate rooms on links of their own.
+
+Each desk is reached through a ddx3216_transport.Transport and addressed
+by its device byte (device_byte_for_channel of its MIDI channel), so
+several desks may share one transport (each with its own MIDI channel;
+an omni desk needs a link to itself). DeskController keeps a shadow of
+every desk's parameters -- what it was last sent, or last reported
+itself -- and routes incoming frames to the right desk by device byte.
+
+recall(scene) sends a scene to some or all desks:
+
+  * each desk only gets the parameters that differ from its shadow;
+  * writes always go out as 0x20 frames, never 0x22, which would also
+    move the channels' mute groups;
+  * when every desk on a shared link needs exactly the same changes, they
+    go out once, addressed to DEVICE_BYTE_OMNI, instead of once per desk;
+  * frames are handed to every link before any link is flushed, so links
+    with their own writer (serial, UDP) transmit at the same time and a
+    recall takes as long as the slowest link, not the sum of them all.
+
+ping() sends a connection test to each desk; its answer marks the desk as
+caught up with everything sent before it (pending() lists the ones still
+outstanding), which is how a recall's completion is timed.
+"""
+
+import time
+from collections import Counter
+
+import ddx3216_protocol as proto
+
+DEVICE_BYTE_INDEX = 4    # F0, 3x manufacturer, device byte
+
+
+class Desk:
+    """One desk on a link: its address, shadow state and pending writes."""
+
+    def __init__(self, transport, midi_channel=None, name=None):
+        self.transport = transport
+        self.midi_channel = midi_channel
+        self.device_byte = proto.device_byte_for_channel(midi_channel)
+        self.name = name or ("ch%d" % midi_channel if midi_channel else transport.name)
+        self.shadow = {}                 # (module, param) -> raw
+        self.batch = proto.ParamChangeBatch(self.device_byte, allow_attenuation=False)
+        self.ping_sent = None            # clock() of the outstanding ping
+        self.round_trip = None           # seconds, for the last answered ping
+        self.stats = Counter()
+
+    def set(self, module, param, raw_value):
+        """Queues a write unless the desk already holds the value. Returns
+        True if queued."""
+        key = (module, param)
+        if self.shadow.get(key) == raw_value:
+            return False
+        self.shadow[key] = raw_value
+        self.batch.set(module, param, raw_value)
+        return True
+
+    def forget(self):
+        """Drops the shadow, so the next recall sends everything (e.g.
+        after the desk was power-cycled or edited offline)."""
+        self.shadow.clear()
+
+    def _apply_frame(self, frame, now):
+        function = proto.sysex_function(frame)
+        if function == proto.FUNC_PARAM_CHANGE:
+            for module, param, raw in proto.parse_param_change_sysex(frame):
+                self.shadow[(module, param)] = raw
+            self.stats["changes_in"] += 1
+        elif function == proto.FUNC_CHANNEL_ATTENUATION:
+            for channel, raw in proto.parse_attenuation_sysex(frame):
+                self.shadow[(proto.MODULE_CHANNEL_BASE + channel, proto.PARAM_VOLUME)] = raw
+            self.stats["changes_in"] += 1
+        elif function == proto.FUNC_CONNECTION_TEST and self.ping_sent is not None:
+            self.round_trip = now - self.ping_sent
+            self.ping_sent = None
+
+
+class DeskController:
+    """Desks keyed by name, grouped by the transport that reaches them.
+    The controller takes over each transport's on_frames."""
+
+    def __init__(self, clock=None):
+        self.clock = clock or time.perf_counter
+        self.desks = []
+        self._links = []                 # [(transport, {device_byte: Desk})]
+        self.stats = Counter()
+
+    def add(self, transport, midi_channel=None, name=None):
+        desk = Desk(transport, midi_channel, name)
+        for link, by_byte in self._links:
+            if link is transport:
+                # an omni desk would also take every other desk's writes
+                if (desk.device_byte in by_byte or proto.DEVICE_BYTE_OMNI in by_byte
+                        or desk.device_byte == proto.DEVICE_BYTE_OMNI):
+                    raise ValueError("desks sharing a link need distinct MIDI channels, none omni")
+                by_byte[desk.device_byte] = desk
+                break
+        else:
+            by_byte = {desk.device_byte: desk}
+            self._links.append((transport, by_byte))
+            transport.on_frames = lambda frames: self._on_frames(by_byte, frames)
+        self.desks.append(desk)
+        return desk
+
+    def desk(self, key):
+        """The desk named `key`, or the first with device byte `key`."""
+        for desk in self.desks:
+            if desk.name == key or desk.device_byte == key:
+                return desk
+        raise KeyError(key)
+
+    def _on_frames(self, by_byte, frames):
+        now = self.clock()
+        for frame in frames:
+            if frame[0] != 0xF0 or len(frame) <= DEVICE_BYTE_INDEX:
+                continue
+            desk = by_byte.get(frame[DEVICE_BYTE_INDEX])
+            if desk is None:
+                if len(by_byte) != 1:
+                    self.stats["unrouted"] += 1
+                    continue
+                desk = next(iter(by_byte.values()))
+            desk._apply_frame(frame, now)
+
+    # -- sending ------------------------------------------------------------
+
+    def set(self, module, param, raw_value, desks=None):
+        for desk in self._select(desks):
+            desk.set(module, param, raw_value)
+
+    def recall(self, scene, desks=None, flush_timeout=None):
+        """Sends `scene` -- (module, param, raw) tuples -- to `desks` (all
+        by default), then whatever else is pending for them. Returns the
+        number of bytes handed to the links."""
+        selected = self._select(desks)
+        for desk in selected:
+            for module, param, raw in scene:
+                desk.set(module, param, raw)
+        return self.send_pending(selected, flush_timeout)
+
+    def send_pending(self, desks=None, flush_timeout=None):
+        """Hands every selected desk's pending writes to its link, then
+        flushes the links. Returns the number of bytes sent."""
+        selected = set(self._select(desks))
+        sent = 0
+        used = []
+        for transport, by_byte in self._links:
+            on_link = [desk for desk in by_byte.values() if desk in selected and len(desk.batch)]
+            if not on_link:
+                continue
+            frames = self._link_frames(on_link, len(by_byte))
+            transport.send_frames(frames)
+            sent += sum(len(frame) for frame in frames)
+            used.append(transport)
+        for transport in used:
+            transport.flush(flush_timeout)
+        self.stats["bytes_out"] += sent
+        return sent
+
+    def _link_frames(self, on_link, desks_on_link):
+        changes = [desk.batch.take() for desk in on_link]
+        for desk in on_link:
+            desk.stats["recalls"] += 1
+        if len(on_link) > 1 and len(on_link) == desks_on_link:
+            first = sorted(changes[0])
+            if all(sorted(other) == first for other in changes[1:]):
+                self.stats["omni_recalls"] += 1
+                return proto.build_change_set_sysex(changes[0], proto.DEVICE_BYTE_OMNI,
+                                                    allow_attenuation=False)
+        frames = []
+        for desk, desk_changes in zip(on_link, changes):
+            frames.extend(proto.build_change_set_sysex(desk_changes, desk.device_byte,
+                                                       allow_attenuation=False))
+        return frames
+
+    def ping(self, desks=None):
+        """Sends a connection test to each selected desk, after anything
+        already sent to it."""
+        now = self.clock()
+        selected = self._select(desks)
+        for transport, _ in self._links:
+            on_link = [desk for desk in selected if desk.transport is transport]
+            if not on_link:
+                continue
+            for desk in on_link:
+                desk.ping_sent = now
+            transport.send_frames([proto.build_connection_test_sysex(desk.device_byte)
+                                   for desk in on_link])
+
+    def pending(self, desks=None):
+        """Desks whose last ping hasn't been answered yet."""
+        return [desk for desk in self._select(desks) if desk.ping_sent is not None]
+
+    def _select(self, desks):
+        if desks is None:
+            return self.desks
+        return [desk if isinstance(desk, Desk) else self.desk(desk) for desk in desks]
@@ -0,0 +1,258 @@
+"""
+ddx3216_meters.py
+
+Meter output engine shared by the FL Studio device scripts.
+
+The scripts used to push one meter message per column on every OnIdle tick
+whenever the level was non-zero, even if it hadn't moved since the last
+tick. MeterEngine keeps the last level sent for every slot, runs a simple
+peak-hold + linear-decay model over the levels fed to it, and only reports
+slots whose displayed level actually changed -- so meter traffic follows
+signal activity rather than the idle tick rate.
+
+Two output targets are supported:
+
+  * METER_TARGET_AFTERTOUCH -- Mackie-CU style channel aftertouch, one
+    message per changed column (what device_DDX3216_daw2.py sends today).
+  * METER_TARGET_SYSEX -- the DDX3216's own meter data function (0x04),
+    all changed slots packed into a single frame; see the INFERRED layout
+    note in ddx3216_protocol.py.
+
+MeterStream is the other direction: it requests and decodes the desk's own
+meter frames for every input, bus and master slot into preallocated arrays,
+runs peak-hold and attack/release ballistics over the whole frame at once
+(with NumPy when it's importable -- FL Studio's bundled Python doesn't ship
+it, so there's a plain-Python path as well) and hands the result to
+subscribers.
+"""
+
+from array import array
+
+try:
+    import numpy as _np
+except ImportError:
+    _np = None
+
+import ddx3216_protocol as proto
+
+METER_TARGET_AFTERTOUCH = 0
+METER_TARGET_SYSEX = 1
+
+
+class MeterEngine:
+    """Per-slot meter state. Call feed() as often as levels arrive (e.g.
+    from OnUpdateMeters), then tick() once per idle tick to get back the
+    (slot, level) pairs that need sending."""
+
+    def __init__(self, count, max_level=proto.METER_LEVEL_MAX, decay=1, hold_ticks=0):
+        self.count = count
+        self.max_level = max_level
+        self.decay = decay            # levels dropped per tick once hold expires
+        self.hold_ticks = hold_ticks  # ticks a new peak is held before decaying
+        self._incoming = [0] * count
+        self._shown = [0] * count
+        self._hold = [0] * count
+        self._sent = [-1] * count     # -1 = never sent / forced resend
+
+    def set_max_level(self, max_level):
+        """Change the level scale (e.g. on a meter mode switch). Clamps the
+        current display and forces every slot to be resent."""
+        self.max_level = max_level
+        for i in range(self.count):
+            self._shown[i] = min(self._shown[i], max_level)
+        self.invalidate()
+
+    def invalidate(self, index=None):
+        """Force slot `index` (or all slots) to be reported on the next
+        tick, whatever its level."""
+        if index is None:
+            self._sent = [-1] * self.count
+        else:
+            self._sent[index] = -1
+
+    def reset(self):
+        """Drop all levels to zero and force a full resend."""
+        self._incoming = [0] * self.count
+        self._shown = [0] * self.count
+        self._hold = [0] * self.count
+        self.invalidate()
+
+    def feed(self, index, level):
+        """Record a level for slot `index`. Several feeds between ticks
+        keep the highest."""
+        if level > self._incoming[index]:
+            self._incoming[index] = level
+
+    def level(self, index):
+        return self._shown[index]
+
+    def tick(self):
+        """Advances the hold/decay model by one tick and returns a list of
+        (slot, level) for every slot whose displayed level changed since it
+        was last sent."""
+        changes = []
+        max_level = self.max_level
+        incoming = self._incoming
+        shown = self._shown
+        hold = self._hold
+        sent = self._sent
+        for i in range(self.count):
+            new = incoming[i]
+            if new > max_level:
+                new = max_level
+            incoming[i] = 0
+
+            cur = shown[i]
+            if new >= cur:
+                if new > 0:
+                    hold[i] = self.hold_ticks
+                cur = new
+            elif hold[i] > 0:
+                hold[i] -= 1
+            else:
+                cur = max(new, cur - self.decay)
+            shown[i] = cur
+
+            if cur != sent[i]:
+                sent[i] = cur
+                changes.append((i, cur))
+        return changes
+
+    def build_sysex(self, changes, device_byte=proto.DEVICE_BYTE_OMNI, slot_base=0, whole=False):
+        """Packs the slots named in `changes` (as returned by tick()) into a
+        single meter data (0x04) frame, spanning the lowest to the highest
+        changed slot -- or every slot with whole=True, so that a frame still
+        waiting in an output queue can simply be replaced by a newer one.
+        slot_base offsets engine indices into the desk's slot numbering.
+        Returns None if there's nothing to send."""
+        if not changes:
+            return None
+        if whole:
+            lo, hi = 0, self.count - 1
+        else:
+            lo = changes[0][0]
+            hi = changes[-1][0]
+        return proto.build_meter_data_sysex(slot_base + lo, self._shown[lo:hi + 1], device_byte)
+
+
+class MeterStream:
+    """Decoder for the desk's meter data (function 0x04) stream.
+
+    All state lives in fixed-size arrays indexed by meter slot (see the
+    METER_SLOT_* constants in ddx3216_protocol.py), allocated once:
+
+      levels  -- last raw 7-bit level received per slot
+      display -- ballistics-smoothed level (attack/release are the fraction
+                 of the gap closed per frame when rising/falling)
+      peaks   -- peak-hold level, held for hold_frames frames then decayed
+                 by peak_decay per frame
+
+    Subscribers are called as callback(stream, start_slot, count) after
+    every decoded frame and read the arrays directly."""
+
+    def __init__(self, slot_count=proto.METER_SLOT_COUNT, attack=1.0, release=0.25,
+                 hold_frames=30, peak_decay=1.0, use_numpy=True):
+        self.slot_count = slot_count
+        self.attack = attack
+        self.release = release
+        self.hold_frames = hold_frames
+        self.peak_decay = peak_decay
+        self.frame_count = 0
+        self._subscribers = []
+        self._np = _np if use_numpy else None
+        if self._np is not None:
+            np = self._np
+            self.levels = np.zeros(slot_count, dtype=np.uint8)
+            self.display = np.zeros(slot_count, dtype=np.float32)
+            self.peaks = np.zeros(slot_count, dtype=np.float32)
+            self._peak_age = np.zeros(slot_count, dtype=np.int32)
+            self._raw = np.zeros(slot_count, dtype=np.float32)
+        else:
+            self.levels = array("B", bytes(slot_count))
+            self.display = array("f", [0.0]) * slot_count
+            self.peaks = array("f", [0.0]) * slot_count
+            self._peak_age = array("i", [0]) * slot_count
+
+    def subscribe(self, callback):
+        if callback not in self._subscribers:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def build_request(self, device_byte=proto.DEVICE_BYTE_OMNI):
+        return proto.build_meter_request_sysex(device_byte)
+
+    def reset(self):
+        for buf in (self.levels, self.display, self.peaks, self._peak_age):
+            for i in range(self.slot_count):
+                buf[i] = 0
+
+    def feed(self, data):
+        """Decodes one incoming SysEx message. Returns True if it was a
+        meter frame (and subscribers have been notified), else False."""
+        parsed = proto.parse_meter_data_sysex(data)
+        if parsed is None:
+            return False
+        start, count = parsed
+        if start >= self.slot_count:
+            return True
+        count = min(count, self.slot_count - start)
+        offset = proto.METER_DATA_OFFSET
+        if self._np is not None:
+            self._update_numpy(data, start, count, offset)
+        else:
+            self._update_python(data, start, count, offset)
+        self.frame_count += 1
+        for callback in self._subscribers:
+            callback(self, start, count)
+        return True
+
+    def _update_numpy(self, data, start, count, offset):
+        np = self._np
+        end = start + count
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            frame = np.frombuffer(data, dtype=np.uint8, count=count, offset=offset)
+        else:
+            frame = np.asarray(data[offset:offset + count], dtype=np.uint8)
+        levels = self.levels[start:end]
+        np.bitwise_and(frame, 0x7F, out=levels)
+
+        raw = self._raw[start:end]
+        raw[:] = levels
+        display = self.display[start:end]
+        coef = np.where(raw > display, self.attack, self.release)
+        display += (raw - display) * coef
+
+        peaks = self.peaks[start:end]
+        age = self._peak_age[start:end]
+        rising = raw >= peaks
+        age += 1
+        age[rising] = 0
+        peaks[rising] = raw[rising]
+        falling = age > self.hold_frames
+        if falling.any():
+            peaks[falling] = np.maximum(raw[falling], peaks[falling] - self.peak_decay)
+
+    def _update_python(self, data, start, count, offset):
+        attack = self.attack
+        release = self.release
+        hold_frames = self.hold_frames
+        peak_decay = self.peak_decay
+        levels = self.levels
+        display = self.display
+        peaks = self.peaks
+        age = self._peak_age
+        for i in range(start, start + count):
+            raw = data[offset + i - start] & 0x7F
+            levels[i] = raw
+            d = display[i]
+            display[i] = d + (raw - d) * (attack if raw > d else release)
+            if raw >= peaks[i]:
+                peaks[i] = raw
+                age[i] = 0
+            else:
+                age[i] += 1
+                if age[i] > hold_frames:
+                    peaks[i] = max(raw, peaks[i] - peak_decay)
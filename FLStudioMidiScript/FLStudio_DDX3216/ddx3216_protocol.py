@@ -22,6 +22,9 @@ Two control paths are implemented:
     see the project's docs/ROADMAP.md for the live status of that question.
 """
 
+import time
+from array import array
+
 # ---------------------------------------------------------------------------
 # MIDI CC map (from the original project's midi_definitions.py, confirmed by
 # observed traffic: a channel-2 fader move emitted CC2)
@@ -143,3 +146,538 @@ def parse_param_change_sysex(data):
         raw_value = (hi << 7) | lo
         results.append((module, param, raw_value))
     return results
+
+
+# ---------------------------------------------------------------------------
+# Batched writes: multi-parameter 0x20 frames and channel attenuation (0x22)
+#
+# Both functions carry up to 23 entries per frame behind one header. 0x20
+# entries are 4 bytes (module, param, hi, lo); 0x22 entries are 3 bytes
+# (channel, hi, lo) and attenuate every channel in that channel's mute group.
+# The attenuation value is taken to use the same 0-1472 scale as
+# PARAM_VOLUME (INFERRED -- the manual only says "1:1 mapping").
+# ---------------------------------------------------------------------------
+FUNC_CHANNEL_ATTENUATION = 0x22
+MAX_ENTRIES_PER_FRAME = 23
+FRAME_OVERHEAD = 9            # F0, 3x manufacturer, device, apparatus, function, nn, F7
+PARAM_CHANGE_ENTRY_SIZE = 4
+ATTENUATION_ENTRY_SIZE = 3
+
+
+def _batched_frames(function, entries, device_byte):
+    frames = []
+    for start in range(0, len(entries), MAX_ENTRIES_PER_FRAME):
+        chunk = entries[start:start + MAX_ENTRIES_PER_FRAME]
+        msg = _sysex_header(device_byte, function)
+        msg.append(len(chunk))
+        for entry in chunk:
+            raw_value = entry[-1]
+            msg.extend(entry[:-1])
+            msg.append((raw_value >> 7) & 0x7F)
+            msg.append(raw_value & 0x7F)
+        msg.append(0xF7)
+        frames.append(msg)
+    return frames
+
+
+def build_param_change_batch_sysex(changes, device_byte=DEVICE_BYTE_OMNI):
+    """changes: sequence of (module, param, raw_value). Returns a list of
+    0x20 frames (lists of ints), 23 changes per frame."""
+    entries = [(module & 0x7F, param & 0x7F, raw) for module, param, raw in changes]
+    return _batched_frames(FUNC_PARAM_CHANGE, entries, device_byte)
+
+
+def build_attenuation_sysex(changes, device_byte=DEVICE_BYTE_OMNI):
+    """changes: sequence of (channel_index, raw_value), channel 0 = Ch 1.
+    Returns a list of 0x22 frames (lists of ints), 23 channels per frame."""
+    entries = [(channel & 0x7F, raw) for channel, raw in changes]
+    return _batched_frames(FUNC_CHANNEL_ATTENUATION, entries, device_byte)
+
+
+def parse_attenuation_sysex(data):
+    """data: list/bytes of the full F0..F7 message. Returns a list of
+    (channel_index, raw_value) tuples, or [] if not an attenuation frame."""
+    if len(data) < 12 or data[0] != 0xF0 or data[-1] != 0xF7:
+        return []
+    if tuple(data[1:4]) != MANUFACTURER_ID:
+        return []
+    if data[5] != APPARATUS_ID or data[6] != FUNC_CHANNEL_ATTENUATION:
+        return []
+
+    nn = data[7]
+    results = []
+    for i in range(nn):
+        base = 8 + 3 * i
+        if base + 3 > len(data) - 1:
+            break
+        channel, hi, lo = data[base:base + 3]
+        results.append((channel, (hi << 7) | lo))
+    return results
+
+
+def batch_cost(count, entry_size):
+    """Bytes on the wire for `count` entries of entry_size, 23 per frame."""
+    if count <= 0:
+        return 0
+    frames = (count + MAX_ENTRIES_PER_FRAME - 1) // MAX_ENTRIES_PER_FRAME
+    return frames * FRAME_OVERHEAD + count * entry_size
+
+
+def is_attenuation_candidate(module, param):
+    """True for input-channel volume changes, which 0x22 can also carry."""
+    return param == PARAM_VOLUME and MODULE_CHANNEL_BASE <= module < MODULE_CHANNEL_BASE + 32
+
+
+def build_change_set_sysex(changes, device_byte=DEVICE_BYTE_OMNI, allow_attenuation=False):
+    """changes: sequence of (module, param, raw_value). Returns the frames
+    for the whole set: all 0x20 by default. With allow_attenuation=True,
+    input-channel volumes may be split off into 0x22 with the rest as 0x20,
+    whichever takes fewer bytes -- opt-in only, since 0x22 also moves the
+    channel's whole mute group and its scale is INFERRED."""
+    if not allow_attenuation:
+        return build_param_change_batch_sysex(changes, device_byte)
+
+    volumes = []
+    others = []
+    for change in changes:
+        if is_attenuation_candidate(change[0], change[1]):
+            volumes.append(change)
+        else:
+            others.append(change)
+
+    if not volumes:
+        return build_param_change_batch_sysex(others, device_byte)
+
+    all_0x20 = batch_cost(len(changes), PARAM_CHANGE_ENTRY_SIZE)
+    split = (batch_cost(len(others), PARAM_CHANGE_ENTRY_SIZE)
+             + batch_cost(len(volumes), ATTENUATION_ENTRY_SIZE))
+    if all_0x20 <= split:
+        return build_param_change_batch_sysex(changes, device_byte)
+
+    frames = build_param_change_batch_sysex(others, device_byte)
+    frames.extend(build_attenuation_sysex(
+        [(module - MODULE_CHANNEL_BASE, raw) for module, _, raw in volumes], device_byte))
+    return frames
+
+
+class ParamChangeBatch:
+    """Collects parameter writes between flushes, keeping only the latest
+    value per (module, param), and emits them as batched frames (see
+    build_change_set_sysex for allow_attenuation).
+
+        batch = ParamChangeBatch(device_byte)
+        batch.set(module, PARAM_VOLUME, raw)   # any number of times
+        for frame in batch.flush():
+            device.midiOutSysex(bytes(frame))
+    """
+
+    def __init__(self, device_byte=DEVICE_BYTE_OMNI, allow_attenuation=False):
+        self.device_byte = device_byte
+        self.allow_attenuation = allow_attenuation
+        self._pending = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def __contains__(self, module_param):
+        return module_param in self._pending
+
+    def set(self, module, param, raw_value):
+        self._pending[(module, param)] = raw_value
+
+    def discard(self, module, param):
+        self._pending.pop((module, param), None)
+
+    def clear(self):
+        self._pending.clear()
+
+    def flush(self, max_bytes=None):
+        """Returns the frames for everything pending (possibly []) and
+        empties the batch. With max_bytes, only the oldest changes that are
+        sure to fit (costed as 0x20) are taken and the rest stay pending;
+        at least one change is always taken."""
+        changes = self.take(max_bytes)
+        if not changes:
+            return []
+        return build_change_set_sysex(changes, self.device_byte, self.allow_attenuation)
+
+    def take(self, max_bytes=None):
+        """The (module, param, raw) changes flush() would send, removed
+        from the batch, without building frames."""
+        if not self._pending:
+            return []
+        if max_bytes is None:
+            changes = [(module, param, raw) for (module, param), raw in self._pending.items()]
+            self._pending.clear()
+        else:
+            count = 1
+            while (count < len(self._pending)
+                   and batch_cost(count + 1, PARAM_CHANGE_ENTRY_SIZE) <= max_bytes):
+                count += 1
+            changes = []
+            for key in list(self._pending)[:count]:
+                changes.append((key[0], key[1], self._pending.pop(key)))
+        return changes
+
+
+# ---------------------------------------------------------------------------
+# Meter data (function 0x04)
+#
+# The manual only lists function 0x04 as "Meter Data" without a frame layout.
+# The layout used here is INFERRED by analogy with functions 0x20/0x22: after
+# the function code comes the first meter slot (ss), a slot count (nn) and
+# then nn 7-bit levels, one byte per slot. Slots run inputs 1-32, then the
+# buses, then master L/R -- also INFERRED until checked against a real desk.
+# ---------------------------------------------------------------------------
+FUNC_METER_DATA = 0x04
+REQUEST_BIT = 0x40
+
+METER_INPUT_COUNT = 32
+METER_BUS_COUNT = 16
+METER_MASTER_COUNT = 2
+METER_SLOT_INPUT_BASE = 0
+METER_SLOT_BUS_BASE = METER_SLOT_INPUT_BASE + METER_INPUT_COUNT
+METER_SLOT_MASTER_BASE = METER_SLOT_BUS_BASE + METER_BUS_COUNT
+METER_SLOT_COUNT = METER_SLOT_MASTER_BASE + METER_MASTER_COUNT
+METER_LEVEL_MAX = 0x7F
+
+
+def _sysex_header(device_byte, function):
+    return [
+        0xF0,
+        MANUFACTURER_ID[0], MANUFACTURER_ID[1], MANUFACTURER_ID[2],
+        device_byte,
+        APPARATUS_ID,
+        function,
+    ]
+
+
+def build_meter_data_sysex(start_slot, levels, device_byte=DEVICE_BYTE_OMNI):
+    """Returns a list of ints for one meter-data frame carrying `levels`
+    (7-bit each) for consecutive slots starting at start_slot."""
+    msg = _sysex_header(device_byte, FUNC_METER_DATA)
+    msg.append(start_slot & 0x7F)
+    msg.append(len(levels) & 0x7F)
+    msg.extend(level & 0x7F for level in levels)
+    msg.append(0xF7)
+    return msg
+
+
+METER_DATA_OFFSET = 9   # index of the first level byte in a meter-data frame
+
+
+def build_meter_request_sysex(device_byte=DEVICE_BYTE_OMNI):
+    """Returns a list of ints asking the desk for one meter-data frame."""
+    msg = _sysex_header(device_byte, REQUEST_BIT | FUNC_METER_DATA)
+    msg.append(0xF7)
+    return msg
+
+
+def parse_meter_data_sysex(data):
+    """data: list/bytes/memoryview of the full F0..F7 message. Returns
+    (start_slot, count) if it is a meter-data frame, else None. The levels
+    themselves are data[METER_DATA_OFFSET:METER_DATA_OFFSET + count] --
+    left in place so callers can copy them straight into their own buffers."""
+    if len(data) < METER_DATA_OFFSET + 1 or data[0] != 0xF0 or data[-1] != 0xF7:
+        return None
+    if (data[1], data[2], data[3]) != MANUFACTURER_ID:
+        return None
+    if data[5] != APPARATUS_ID or data[6] != FUNC_METER_DATA:
+        return None
+
+    start = data[7]
+    count = min(data[8], len(data) - 1 - METER_DATA_OFFSET)
+    return start, count
+
+
+# ---------------------------------------------------------------------------
+# Connection test (function 0x00) and bulk dumps (functions 0x10-0x12)
+#
+# A connection test is just the header: the request (0x40) is answered by a
+# bare 0x00 frame. Bulk dumps follow the manual's block/ACK flow: requests
+# are REQUEST_BIT | 0x10/0x11/0x12 (0x50/0x51/0x52) followed by ww hh ll,
+# data blocks carry ww vv, the total and index of 1000-byte blocks (two
+# 7-bit bytes each), an encoded byte count, the 7/8-packed payload and a
+# checksum. The receiver acknowledges a block by requesting the next one and
+# asks for the same block again on a bad checksum. NOTE: DDX3216Protocol.h
+# labels 0x50-0x52 as the data functions; the manual's example and the
+# request bit used everywhere else say they are the requests, as here.
+#
+# The byte count field only has 7 bits, so like the JUCE code it is written
+# modulo 128 and parsers take the payload length from the frame length.
+# ---------------------------------------------------------------------------
+FUNC_CONNECTION_TEST = 0x00
+FUNC_DUMP_SETTINGS = 0x10
+FUNC_DUMP_FILE_LIST = 0x11
+FUNC_DUMP_FILE = 0x12
+DUMP_FUNCTIONS = (FUNC_DUMP_SETTINGS, FUNC_DUMP_FILE_LIST, FUNC_DUMP_FILE)
+
+DUMP_WHAT_UNKNOWN = 0x00     # the manual names F_ALL, F_SETUP, ... but gives no values
+DUMP_VERSION = 1
+DUMP_BLOCK_PAYLOAD = 1000    # decoded bytes per block
+DUMP_DATA_OFFSET = 14        # index of the first encoded payload byte
+DUMP_REQUEST_SIZE = 11
+
+
+def build_connection_test_sysex(device_byte=DEVICE_BYTE_OMNI, request=True):
+    """Returns a list of ints: the ping (request=True) or its answer."""
+    function = FUNC_CONNECTION_TEST | (REQUEST_BIT if request else 0)
+    msg = _sysex_header(device_byte, function)
+    msg.append(0xF7)
+    return msg
+
+
+def sysex_function(data):
+    """Function byte of a DDX3216 frame (request bit included), or None if
+    data isn't one."""
+    if len(data) < 8 or data[0] != 0xF0 or data[-1] != 0xF7:
+        return None
+    if (data[1], data[2], data[3]) != MANUFACTURER_ID or data[5] != APPARATUS_ID:
+        return None
+    return data[6]
+
+
+def dump_checksum(data):
+    return ~sum(data) & 0x7F
+
+
+def encode_7in8(raw):
+    """Packs 8-bit bytes into 7-bit-clean groups of 8 (7 low-7-bit bytes,
+    then their high bits, bit i = byte i). The last group is zero-padded."""
+    out = bytearray()
+    for start in range(0, len(raw), 7):
+        group = raw[start:start + 7]
+        high = 0
+        for i, b in enumerate(group):
+            out.append(b & 0x7F)
+            if b & 0x80:
+                high |= 1 << i
+        out.extend(bytes(7 - len(group)))
+        out.append(high)
+    return out
+
+
+def decode_7in8(encoded, length=None):
+    """Inverse of encode_7in8. length trims the zero padding of the last
+    group when the real payload size is known."""
+    out = bytearray()
+    for start in range(0, len(encoded) - 7, 8):
+        high = encoded[start + 7]
+        for i in range(7):
+            out.append((encoded[start + i] & 0x7F) | (((high >> i) & 1) << 7))
+    if length is not None:
+        del out[length:]
+    return out
+
+
+def build_dump_request_sysex(function, block, what=DUMP_WHAT_UNKNOWN, device_byte=DEVICE_BYTE_OMNI):
+    """Returns a list of ints requesting (or acknowledging up to) `block`
+    of dump `function` (0x10-0x12, with or without the request bit)."""
+    msg = _sysex_header(device_byte, REQUEST_BIT | function)
+    msg.append(what & 0x7F)
+    msg.append((block >> 7) & 0x7F)
+    msg.append(block & 0x7F)
+    msg.append(0xF7)
+    return msg
+
+
+def parse_dump_request_sysex(data):
+    """Returns (function, what, block) with the request bit stripped from
+    function, or None if data isn't a dump request."""
+    function = sysex_function(data)
+    if function is None or len(data) < DUMP_REQUEST_SIZE:
+        return None
+    if not function & REQUEST_BIT or function & ~REQUEST_BIT not in DUMP_FUNCTIONS:
+        return None
+    return function & ~REQUEST_BIT, data[7], (data[8] << 7) | data[9]
+
+
+def build_dump_block_sysex(function, total_blocks, block, payload, what=DUMP_WHAT_UNKNOWN,
+                           version=DUMP_VERSION, device_byte=DEVICE_BYTE_OMNI):
+    """Returns a list of ints carrying one block (up to DUMP_BLOCK_PAYLOAD
+    raw bytes) of dump `function` (0x10-0x12)."""
+    encoded = encode_7in8(payload)
+    body = [
+        what & 0x7F, version & 0x7F,
+        (total_blocks >> 7) & 0x7F, total_blocks & 0x7F,
+        (block >> 7) & 0x7F, block & 0x7F,
+        len(encoded) & 0x7F,
+    ]
+    body.extend(encoded)
+    body.append(dump_checksum(body))
+    msg = _sysex_header(device_byte, function & ~REQUEST_BIT)
+    msg.extend(body)
+    msg.append(0xF7)
+    return msg
+
+
+def parse_dump_block_sysex(data):
+    """Returns (function, what, version, total_blocks, block, payload,
+    checksum_ok) for a dump data block, else None. payload is the decoded
+    bytes including any zero padding of the last 7-byte group."""
+    function = sysex_function(data)
+    if function not in DUMP_FUNCTIONS or len(data) < DUMP_DATA_OFFSET + 2:
+        return None
+    end = len(data) - 2                 # checksum position
+    checksum_ok = dump_checksum(data[7:end]) == data[end]
+    payload = decode_7in8(data[DUMP_DATA_OFFSET:end])
+    return (function, data[7], data[8], (data[9] << 7) | data[10],
+            (data[11] << 7) | data[12], payload, checksum_ok)
+
+
+def dump_block_count(size):
+    return max(1, (size + DUMP_BLOCK_PAYLOAD - 1) // DUMP_BLOCK_PAYLOAD)
+
+
+def _message_size(status):
+    """Total size of a non-SysEx message from its status byte."""
+    kind = status & 0xF0
+    if kind in (0xC0, 0xD0) or status in (0xF1, 0xF3):
+        return 2
+    if kind < 0xF0 or status == 0xF2:
+        return 3
+    return 1
+
+
+class SysExAssembler:
+    """Splits a raw MIDI byte stream (serial port, pipe, socket) back into
+    messages: feed() returns the complete SysEx frames and short messages,
+    as bytes, in arrival order. Running status, realtime bytes inside a
+    frame and frames cut short by a new status byte are handled as on a
+    DIN link; frames longer than max_sysex are dropped and counted."""
+
+    def __init__(self, max_sysex=65536):
+        self.max_sysex = max_sysex
+        self.dropped = 0
+        self._sysex = None
+        self._short = bytearray()
+        self._status = 0
+
+    def feed(self, data):
+        out = []
+        for b in data:
+            if b >= 0xF8:
+                out.append(bytes((b,)))
+            elif self._sysex is not None and b < 0x80:
+                if len(self._sysex) < self.max_sysex:
+                    self._sysex.append(b)
+                else:
+                    self.dropped += 1
+                    self._sysex = None
+            elif self._sysex is not None and b == 0xF7:
+                self._sysex.append(b)
+                out.append(bytes(self._sysex))
+                self._sysex = None
+            elif b & 0x80:
+                if self._sysex is not None:
+                    self.dropped += 1
+                    self._sysex = None
+                self._status = 0
+                self._short = bytearray()
+                if b == 0xF0:
+                    self._sysex = bytearray((b,))
+                elif b != 0xF7:
+                    self._status = b if b < 0xF0 else 0
+                    self._short.append(b)
+                    if _message_size(b) == 1:
+                        out.append(bytes(self._short))
+                        self._short = bytearray()
+            elif self._short or self._status:
+                if not self._short:
+                    self._short.append(self._status)
+                self._short.append(b)
+                if len(self._short) == _message_size(self._short[0]):
+                    out.append(bytes(self._short))
+                    self._short = bytearray()
+        return out
+
+
+# ---------------------------------------------------------------------------
+# Latency instrumentation (opt-in)
+#
+# Paths are free-form names ("hw->fl", "fl->hw", ...). Each keeps its last
+# LATENCY_RING_SIZE samples in a preallocated ring, so memory stays fixed
+# however long a session runs; percentiles are only computed when a
+# summary is asked for. Callers are expected to guard their hooks with
+# `if tracker.enabled:` so the disabled cost is one attribute test.
+# ---------------------------------------------------------------------------
+LATENCY_RING_SIZE = 1024
+
+
+class LatencyRing:
+    """Fixed-size ring of latency samples in seconds."""
+
+    def __init__(self, size=LATENCY_RING_SIZE):
+        self.size = size
+        self.samples = array("d", [0.0]) * size
+        self.count = 0          # total samples ever added
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.samples[self.count % self.size] = seconds
+        self.count += 1
+        if seconds > self.max:
+            self.max = seconds
+
+    def reset(self):
+        self.count = 0
+        self.max = 0.0
+
+    def percentile(self, pct):
+        """pct in 0-100, over the samples currently held. None if empty."""
+        n = min(self.count, self.size)
+        if n == 0:
+            return None
+        ordered = sorted(self.samples[:n])
+        index = min(n - 1, int(round(pct / 100.0 * (n - 1))))
+        return ordered[index]
+
+
+class LatencyTracker:
+    """Per-path latency rings plus begin/end pairing by key, for paths
+    where the entry and exit points are in different callbacks."""
+
+    def __init__(self, ring_size=LATENCY_RING_SIZE, clock=time.perf_counter, enabled=False):
+        self.enabled = enabled
+        self.ring_size = ring_size
+        self.now = clock
+        self.paths = {}
+        self._open = {}
+
+    def ring(self, path):
+        ring = self.paths.get(path)
+        if ring is None:
+            ring = self.paths[path] = LatencyRing(self.ring_size)
+        return ring
+
+    def record(self, path, seconds):
+        self.ring(path).add(seconds)
+
+    def begin(self, path, key):
+        """Mark `key` as entering `path` now. If it is already in flight the
+        earlier timestamp is kept, so the sample covers the oldest change."""
+        self._open.setdefault((path, key), self.now())
+
+    def end(self, path, key):
+        """Close an in-flight `key` on `path`, recording its latency.
+        Keys that were never begun are ignored."""
+        t0 = self._open.pop((path, key), None)
+        if t0 is not None:
+            self.ring(path).add(self.now() - t0)
+
+    def reset(self):
+        self.paths.clear()
+        self._open.clear()
+
+    def summary_lines(self):
+        lines = []
+        for path in sorted(self.paths):
+            ring = self.paths[path]
+            if ring.count == 0:
+                continue
+            lines.append("%-14s n=%-7d p50=%8.3fms  p99=%8.3fms  max=%8.3fms" % (
+                path, ring.count,
+                ring.percentile(50) * 1000.0,
+                ring.percentile(99) * 1000.0,
+                ring.max * 1000.0))
+        return lines
@@ -0,0 +1,240 @@
+"""
+ddx3216_scheduler.py
+
+Prioritised output scheduler for the DDX3216's MIDI link.
+
+A DIN MIDI link runs at 31.25 kbaud -- 10 bits per byte on the wire, so
+about 3,125 bytes/s. The device scripts write from several places (fader
+and pan echoes, LCD text, meters, LEDs) and used to call
+device.midiOutSysex/midiOutMsg straight away, so under load everything
+queued up behind everything else inside the MIDI driver and fader motors
+could lag by seconds behind a burst of LCD text.
+
+OutputScheduler sits between the scripts and the device module instead:
+
+  * Every queued message has a priority class. Each tick() spends the byte
+    budget that the link could have carried since the previous tick,
+    highest priority first (fader motors > mutes > LEDs > LCD > meters).
+  * Messages are queued under a key; queueing again under the same key
+    replaces the older, still-unsent value in place, so a fader that moves
+    ten times between ticks costs one write, not ten.
+  * Parameter writes (function 0x20; 0x22 too with allow_attenuation) are
+    coalesced per priority in a ddx3216_protocol.ParamChangeBatch and go
+    out as batched frames that fit in what's left of the budget. The send time of each (module,
+    param) is kept, so a script can tell whether a change arriving from
+    the desk may have crossed one of its own writes on the wire.
+  * The value the desk holds for each (module, param) is kept too -- what
+    was last sent, or what the script says the desk reported -- and a
+    write of that same value is dropped, along with any write still queued
+    for the parameter. Moving one parameter of a track then doesn't resend
+    the others, and a fader that goes somewhere and back between ticks
+    costs nothing.
+
+The budget may go negative by at most one message, so a single frame larger
+than a tick's budget (a full LCD row, say) still goes out rather than
+starving -- the following ticks just pay it back.
+"""
+
+import time
+from collections import OrderedDict
+
+import ddx3216_protocol as proto
+
+MIDI_BYTES_PER_SECOND = 3125      # 31250 baud / 10 bits per byte
+DEFAULT_TICK_INTERVAL = 0.02      # seconds; roughly FL Studio's OnIdle rate
+MAX_REFILL_TICKS = 4
+
+PRIORITY_FADER = 0
+PRIORITY_MUTE = 1
+PRIORITY_LED = 2
+PRIORITY_LCD = 3
+PRIORITY_METER = 4
+PRIORITY_COUNT = 5
+
+PRIORITY_NAMES = ('fader', 'mute', 'led', 'lcd', 'meter')
+
+
+def short_message_size(msg):
+    """Wire size of a packed FL-style short message (status in the low
+    byte): program change / channel aftertouch are 2 bytes, the rest 3."""
+    status = msg & 0xF0
+    if status == 0xC0 or status == 0xD0:
+        return 2
+    return 3
+
+
+class OutputScheduler:
+    """Byte-budgeted, prioritised, superseding output queue.
+
+    send_sysex(bytes) and send_msg(int) are the actual sinks -- normally
+    device.midiOutSysex and device.midiOutMsg. clock() returns seconds and
+    defaults to time.perf_counter; tests and the desk emulator pass their
+    own."""
+
+    def __init__(self, send_sysex, send_msg=None, bytes_per_second=MIDI_BYTES_PER_SECOND,
+                 tick_interval=DEFAULT_TICK_INTERVAL, device_byte=proto.DEVICE_BYTE_OMNI,
+                 allow_attenuation=False, clock=None):
+        self.send_sysex = send_sysex
+        self.send_msg = send_msg
+        self.bytes_per_second = bytes_per_second
+        self.tick_interval = tick_interval
+        self.bytes_per_tick = max(1, int(bytes_per_second * tick_interval))
+        self.clock = clock or time.perf_counter
+        self._queues = [OrderedDict() for _ in range(PRIORITY_COUNT)]
+        self._params = [proto.ParamChangeBatch(device_byte, allow_attenuation)
+                        for _ in range(PRIORITY_COUNT)]
+        self._budget = float(self.bytes_per_tick)
+        self._last_tick = None
+        self._param_sent_at = {}    # (module, param) -> clock() when last sent
+        self._param_values = {}     # (module, param) -> raw the desk holds, as far as we know
+        self._serial = 0
+
+        self.sent_bytes = [0] * PRIORITY_COUNT
+        self.sent_messages = [0] * PRIORITY_COUNT
+        self.superseded = [0] * PRIORITY_COUNT
+
+    # -- queueing ---------------------------------------------------------
+
+    def queue_sysex(self, priority, key, data):
+        """Queue a complete SysEx message (bytes or list of ints). key=None
+        never supersedes anything."""
+        self._queue(priority, key, bytes(data))
+
+    def queue_msg(self, priority, key, msg):
+        """Queue a packed short MIDI message (as for device.midiOutMsg)."""
+        self._queue(priority, key, msg)
+
+    def queue_param(self, priority, module, param, raw_value):
+        """Queue a direct parameter change; the latest value per (module,
+        param) wins and changes are sent batched. A value the desk already
+        holds isn't sent, and cancels a write still queued for it."""
+        key = (module, param)
+        batch = self._params[priority]
+        if key in batch:
+            self.superseded[priority] += 1
+        if self._param_values.get(key) == raw_value:
+            for queued in self._params:
+                queued.discard(module, param)
+            return
+        batch.set(module, param, raw_value)
+
+    def param_reported(self, module, param, raw_value):
+        """Records the value the desk reported for (module, param). None
+        means it's unknown what the desk ends up holding (the report may
+        have crossed a write of ours), so the next write always goes out."""
+        self._param_values[(module, param)] = raw_value
+
+    def forget_params(self):
+        """Forgets every value the desk holds, e.g. when it may have been
+        changed behind our back, so everything queued from now on is sent."""
+        self._param_values.clear()
+
+    def _queue(self, priority, key, payload):
+        queue = self._queues[priority]
+        if key is None:
+            self._serial += 1
+            key = ('#', self._serial)
+        elif key in queue:
+            self.superseded[priority] += 1
+        queue[key] = payload   # keeps the original queue position
+
+    def sent_within(self, module, param, seconds):
+        """True if a write to (module, param) went out in the last
+        `seconds`."""
+        sent_at = self._param_sent_at.get((module, param))
+        return sent_at is not None and self.clock() - sent_at <= seconds
+
+    def param_pending(self, module, param):
+        """True if a write to (module, param) is queued but not sent yet."""
+        key = (module, param)
+        return any(key in batch for batch in self._params)
+
+    def pending(self, priority=None):
+        if priority is not None:
+            return len(self._queues[priority]) + len(self._params[priority])
+        return sum(len(q) for q in self._queues) + sum(len(b) for b in self._params)
+
+    def clear(self):
+        for queue in self._queues:
+            queue.clear()
+        for batch in self._params:
+            batch.clear()
+
+    # -- sending ----------------------------------------------------------
+
+    def tick(self):
+        """Refill the budget for the time since the last tick and send as
+        much as it allows, highest priority first. Returns bytes sent."""
+        now = self.clock()
+        if self._last_tick is not None:
+            # Idle ticks don't bank more than a few ticks' worth of budget,
+            # otherwise a quiet spell would allow a burst the link can't carry.
+            elapsed = min(now - self._last_tick, MAX_REFILL_TICKS * self.tick_interval)
+            refill = elapsed * self.bytes_per_second
+            self._budget = min(self._budget + refill, max(self.bytes_per_tick, refill))
+        self._last_tick = now
+
+        sent = 0
+        for priority in range(PRIORITY_COUNT):
+            if self._budget <= 0:
+                break
+            sent += self._drain(priority, self._budget)
+        return sent
+
+    def flush_all(self):
+        """Send everything queued regardless of budget (e.g. from
+        OnDeInit, where there is no next tick). Returns bytes sent."""
+        sent = 0
+        for priority in range(PRIORITY_COUNT):
+            sent += self._drain(priority, None)
+        return sent
+
+    def _drain(self, priority, budget):
+        sent = 0
+        batch = self._params[priority]
+        if len(batch):
+            changes = batch.take(None if budget is None else max(1, int(budget - sent)))
+            now = self.clock()
+            for module, param, raw in changes:
+                self._param_sent_at[(module, param)] = now
+                self._param_values[(module, param)] = raw
+            for frame in proto.build_change_set_sysex(changes, batch.device_byte, batch.allow_attenuation):
+                sent += self._emit_sysex(priority, bytes(frame))
+
+        queue = self._queues[priority]
+        while queue and (budget is None or sent < budget):
+            _, payload = queue.popitem(last=False)
+            if isinstance(payload, bytes):
+                sent += self._emit_sysex(priority, payload)
+            else:
+                sent += self._emit_msg(priority, payload)
+
+        if budget is not None:
+            self._budget -= sent
+        return sent
+
+    def _emit_sysex(self, priority, data):
+        self.send_sysex(data)
+        self.sent_bytes[priority] += len(data)
+        self.sent_messages[priority] += 1
+        return len(data)
+
+    def _emit_msg(self, priority, msg):
+        self.send_msg(msg)
+        size = short_message_size(msg)
+        self.sent_bytes[priority] += size
+        self.sent_messages[priority] += 1
+        return size
+
+    def stats(self):
+        """Per-priority counters as a list of dicts, for printing."""
+        return [
+            {
+                'priority': PRIORITY_NAMES[p],
+                'pending': self.pending(p),
+                'sent_messages': self.sent_messages[p],
+                'sent_bytes': self.sent_bytes[p],
+                'superseded': self.superseded[p],
+            }
+            for p in range(PRIORITY_COUNT)
+        ]
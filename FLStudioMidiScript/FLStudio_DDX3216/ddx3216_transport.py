@@ -0,0 +1,135 @@
+"""
+ddx3216_transport.py
+
+Link-independent transport interface, so protocol engines (bulk dumps,
+state sync, meter polling) are written once and run -- or get
+benchmarked -- on any link:
+
+    transport.on_frames = handle     # handle(list of bytes), per batch received
+    transport.send_frames(frames)    # complete messages, sent in order
+    transport.flush()                # push anything still queued to the wire
+
+Frames are complete messages (F0 ... F7 SysEx, or a short message of 1-3
+bytes) as bytes, bytearrays or the lists of ints ddx3216_protocol's
+builders return, and are passed through as they are: backends hand the
+same objects to the driver, socket or peer instead of copying them into
+their own buffers first.
+
+Backends here can run inside FL Studio:
+
+  * FLDeviceTransport -- FL's `device` module: midiOutSysex/midiOutMsg out,
+    and the script's OnMidiMsg feeds dispatch(event) in;
+  * LoopbackTransport.pair() -- two in-process ends; what one sends, the
+    other receives synchronously. Useful for tests and benchmarks.
+
+The desktop tools add SerialLink (ddx3216_serial.py, RS232 or a pty) and
+UdpTransport (ddx3216_udp.py).
+"""
+
+from collections import Counter, deque
+
+
+def pack_short(frame):
+    """A 1-3 byte short message packed the way device.midiOutMsg wants it
+    (status in the low byte)."""
+    msg = 0
+    for shift, b in enumerate(frame):
+        msg |= b << (8 * shift)
+    return msg
+
+
+class Transport:
+    """Base class. Subclasses implement send_frames() and call _deliver()
+    with what they receive; received frames go to on_frames, or into
+    `received` while no handler is set."""
+
+    name = "transport"
+    bytes_per_second = None      # nominal link rate, if the link has one
+
+    def __init__(self, on_frames=None):
+        self.on_frames = on_frames
+        self.received = deque()
+        self.stats = Counter()
+
+    def send_frames(self, frames):
+        raise NotImplementedError
+
+    def send(self, frame):
+        self.send_frames((frame,))
+
+    def flush(self, timeout=None):
+        """Returns once everything queued has been handed to the link;
+        False if it couldn't be within `timeout` seconds."""
+        return True
+
+    def close(self):
+        pass
+
+    def _count_out(self, frames):
+        self.stats["frames_out"] += len(frames)
+        self.stats["bytes_out"] += sum(len(frame) for frame in frames)
+
+    def _deliver(self, frames):
+        if not frames:
+            return
+        self.stats["frames_in"] += len(frames)
+        self.stats["bytes_in"] += sum(len(frame) for frame in frames)
+        if self.on_frames is not None:
+            self.on_frames(frames)
+        else:
+            self.received.extend(frames)
+
+
+class FLDeviceTransport(Transport):
+    """Sends through FL's `device` module (passed in, so this file also
+    imports outside FL). Unsent output is FL's business, so flush() has
+    nothing to do."""
+
+    name = "fl"
+
+    def __init__(self, device, on_frames=None, bytes_per_second=3125):
+        Transport.__init__(self, on_frames)
+        self.device = device
+        self.bytes_per_second = bytes_per_second
+
+    def send_frames(self, frames):
+        frames = frames if isinstance(frames, (list, tuple)) else list(frames)
+        for frame in frames:
+            if frame[0] == 0xF0:
+                self.device.midiOutSysex(frame if isinstance(frame, bytes) else bytes(frame))
+            else:
+                self.device.midiOutMsg(pack_short(frame))
+        self._count_out(frames)
+
+    def dispatch(self, event):
+        """Call from OnMidiMsg to deliver the event's message."""
+        if event.sysex:
+            frame = bytes(event.sysex)
+        else:
+            frame = bytes((event.status, event.data1, event.data2))
+            if event.status & 0xF0 in (0xC0, 0xD0):
+                frame = frame[:2]
+        self._deliver([frame])
+
+
+class LoopbackTransport(Transport):
+    """One end of an in-process link; see pair()."""
+
+    name = "loopback"
+
+    def __init__(self, on_frames=None):
+        Transport.__init__(self, on_frames)
+        self.peer = None
+
+    @classmethod
+    def pair(cls):
+        a = cls()
+        b = cls()
+        a.peer = b
+        b.peer = a
+        return a, b
+
+    def send_frames(self, frames):
+        frames = frames if isinstance(frames, list) else list(frames)
+        self._count_out(frames)
+        self.peer._deliver(frames)
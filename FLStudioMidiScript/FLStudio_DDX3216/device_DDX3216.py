@@ -29,12 +29,28 @@ STATUS / KNOWN LIMITATIONS (read this before assuming something's broken):
     ddx3216_protocol.py but not sent by this script yet.
   * Channel mapping is a straight 1:1 -- DDX3216 channel N <-> FL Studio
     mixer track N (1-indexed in the UI, 0-indexed internally). Change
-    CHANNEL_OFFSET below if you want it to start elsewhere.
+    CHANNEL_OFFSET below if you want it to start elsewhere. The desk's
+    stereo-linked main fader (master modules 64/65) <-> FL's master track
+    (SysEx only).
   * The dB<->FL-volume conversion below is a first-pass approximation, not
     calibrated against FL's actual internal volume curve. Expect fader
     positions to be in the right ballpark but not pixel/dB-perfect; tune
     VOLUME_MIN_DB/VOLUME_MAX_DB or the conversion function by ear/eye if
     that matters to you.
+  * Desk metering (SysEx function 0x04) is decoded by ddx3216_meters.py
+    (copy it alongside) but polling is off by default -- the frame layout
+    is INFERRED, see ddx3216_protocol.py. Set METER_STREAM_ENABLED to try it.
+  * Set LATENCY_INSTRUMENTATION to time both directions: hardware message
+    in -> FL mixer updated, and FL mixer change -> frame handed to the MIDI
+    driver. p50/p99 are printed at unload, or call print_latency_report()
+    from FL's script output console at any time.
+  * The FL callbacks are wrapped by ddx3216_profiler.py (copy it
+    alongside) while CALLBACK_PROFILER is set. Holding every button in
+    PROFILE_TOGGLE_COMBO turns per-callback timing on and off, and
+    switching it off prints the report. The desk itself only sends
+    fader/pan/mute CCs, so the default combo is Shift+Esc+Enter on a
+    CU-style surface sharing the port. toggle_profiling() and
+    print_profile_report() can also be called from the console.
 """
 
 import midi
@@ -44,11 +60,29 @@ import transport
 import ui
 
 import ddx3216_protocol as proto
+import ddx3216_meters
+import ddx3216_scheduler
+import ddx3216_profiler
 
 CHANNEL_OFFSET = 1       # DDX3216 channel 1 (index 0) -> FL mixer track 0 + this
 NUM_CHANNELS = 32
+MASTER_TRACK = 0         # FL master track <-> desk master L/R, moved together
+MASTER_MODULES = (proto.MODULE_MASTER_LEFT, proto.MODULE_MASTER_RIGHT)
+MASTER_ECHO_KEY = "master"  # _suppress_echo entry for the master (channels are ints)
 DEVICE_MIDI_CHANNEL = 2  # matches this project's sniffed hardware traffic;
                           # set to None for omni if your unit responds to that instead
+METER_STREAM_ENABLED = False  # poll the desk's meter data (function 0x04) from OnIdle
+CROSSING_WINDOW = 0.25  # s; a desk change this soon after our own write to the same
+                        # parameter may have crossed it on the wire (see _apply_from_hardware)
+ALLOW_ATTENUATION_FRAMES = False  # opt in to sending volume batches as function 0x22 when
+                                  # cheaper; 0x22 also moves the channel's whole mute group
+LATENCY_INSTRUMENTATION = False  # see the module docstring
+CALLBACK_PROFILER = True  # wrap the FL callbacks so profiling can be toggled; see the module docstring
+PROFILE_TOGGLE_COMBO = ((midi.MIDI_NOTEON, 0x54), (midi.MIDI_NOTEON, 0x52), (midi.MIDI_NOTEON, 0x53))
+
+LATENCY_PATH_HW_CC = "hw->fl cc"
+LATENCY_PATH_HW_SYSEX = "hw->fl sysex"
+LATENCY_PATH_FL_TO_HW = "fl->hw"
 
 # FL Studio mixer volume is roughly 0.0-1.0 internally (not a direct dB
 # scale). This is a simple linear approximation over the DDX3216's -80..+12dB
@@ -91,12 +125,57 @@ def OnInit():
     global _suppress_echo
     _suppress_echo = set()
 
+    # Desk meters (all inputs/buses/masters) decoded into preallocated
+    # arrays; anything that wants to draw them calls
+    # _meter_stream.subscribe(callback).
+    global _meter_stream
+    _meter_stream = ddx3216_meters.MeterStream()
+
+    # Everything outgoing goes through one prioritised scheduler, drained
+    # from OnIdle within the MIDI link's byte budget: fader/pan writes are
+    # coalesced per (module, param) and sent as batched 0x20 frames (0x22
+    # only with ALLOW_ATTENUATION_FRAMES), ahead of meter polling.
+    global _latency
+    _latency = proto.LatencyTracker(enabled=LATENCY_INSTRUMENTATION)
+
+    global _scheduler
+    _scheduler = ddx3216_scheduler.OutputScheduler(
+        _send_sysex_timed if _latency.enabled else device.midiOutSysex, device.midiOutMsg,
+        device_byte=proto.device_byte_for_channel(DEVICE_MIDI_CHANNEL),
+        allow_attenuation=ALLOW_ATTENUATION_FRAMES,
+    )
+
 
 def OnDeInit():
+    _scheduler.flush_all()
+    if _latency.enabled:
+        print_latency_report()
+    if _profiler.enabled:
+        _profiler.print_report()
     print("DDX3216 control surface script unloaded")
 
 
+def OnIdle():
+    if METER_STREAM_ENABLED:
+        device_byte = proto.device_byte_for_channel(DEVICE_MIDI_CHANNEL)
+        _scheduler.queue_sysex(ddx3216_scheduler.PRIORITY_METER, 'meter_request',
+                               _meter_stream.build_request(device_byte))
+    _scheduler.tick()
+
+
 def OnMidiMsg(event):
+    if _latency.enabled:
+        t0 = _latency.now()
+        _dispatch_midi(event)
+        if event.handled:
+            path = LATENCY_PATH_HW_SYSEX if event.sysex else LATENCY_PATH_HW_CC
+            _latency.record(path, _latency.now() - t0)
+        return
+
+    _dispatch_midi(event)
+
+
+def _dispatch_midi(event):
     if event.sysex:
         _handle_incoming_sysex(event)
         return
@@ -110,7 +189,27 @@ def OnDirtyMixerTrack(index):
     ANY reason (mouse, automation, another controller, or our own incoming
     CC handling below). We use this to push the new value back out to the
     hardware -- this is the half of the round-trip that's unconfirmed on
-    real hardware; see the module docstring."""
+    real hardware; see the module docstring. index == -1 means every track
+    may have changed (e.g. project load), which goes out batched -- all of
+    it, in case the desk was changed while we weren't looking."""
+    if index == -1:
+        _scheduler.forget_params()
+        for channel in range(NUM_CHANNELS):
+            track = fl_track_for_channel(channel)
+            if track < mixer.trackCount():
+                if _latency.enabled:
+                    _latency.begin(LATENCY_PATH_FL_TO_HW, channel)
+                _queue_track_to_hardware(channel, track)
+        _queue_master_to_hardware()
+        return
+
+    if index == MASTER_TRACK:
+        if MASTER_ECHO_KEY in _suppress_echo:
+            _suppress_echo.discard(MASTER_ECHO_KEY)
+        else:
+            _queue_master_to_hardware()
+        return
+
     channel = channel_for_fl_track(index)
     if channel is None:
         return
@@ -119,8 +218,9 @@ def OnDirtyMixerTrack(index):
         _suppress_echo.discard(channel)
         return
 
-    _send_volume_to_hardware(channel, mixer.getTrackVolume(index))
-    _send_pan_to_hardware(channel, mixer.getTrackPan(index))
+    if _latency.enabled:
+        _latency.begin(LATENCY_PATH_FL_TO_HW, channel)
+    _queue_track_to_hardware(channel, index)
 
 
 # ---------------------------------------------------------------------------
@@ -136,8 +236,8 @@ def _handle_incoming_cc(event):
         track = fl_track_for_channel(channel)
         if track < mixer.trackCount():
             fl_vol = value7bit / 127.0  # simple linear 0-127 -> 0.0-1.0
-            _suppress_echo.add(channel)
-            mixer.setTrackVolume(track, fl_vol)
+            _apply_from_hardware(channel, proto.MODULE_CHANNEL_BASE + channel, proto.PARAM_VOLUME,
+                                 track, fl_vol)
         event.handled = True
 
     elif proto.is_pan_cc(cc):
@@ -145,8 +245,8 @@ def _handle_incoming_cc(event):
         track = fl_track_for_channel(channel)
         if track < mixer.trackCount():
             fl_pan = (value7bit / 127.0) * 2.0 - 1.0  # 0-127 -> -1.0..+1.0
-            _suppress_echo.add(channel)
-            mixer.setTrackPan(track, fl_pan)
+            _apply_from_hardware(channel, proto.MODULE_CHANNEL_BASE + channel, proto.PARAM_PAN,
+                                 track, fl_pan)
         event.handled = True
 
     elif cc == proto.MUTE_ON_CC:
@@ -165,8 +265,17 @@ def _handle_incoming_cc(event):
 
 
 def _handle_incoming_sysex(event):
+    if _meter_stream.feed(event.sysex):
+        event.handled = True
+        return
+
     changes = proto.parse_param_change_sysex(list(event.sysex))
     for module, param, raw in changes:
+        if module in MASTER_MODULES:
+            if param == proto.PARAM_VOLUME:
+                _apply_from_hardware(MASTER_ECHO_KEY, module, param, MASTER_TRACK,
+                                     db_to_fl_volume(proto.volume_raw_to_db(raw)))
+            continue
         if not (proto.MODULE_CHANNEL_BASE <= module < proto.MODULE_CHANNEL_BASE + NUM_CHANNELS):
             continue  # bus/aux/FX modules -- addresses still unconfirmed, ignore for now
 
@@ -177,35 +286,104 @@ def _handle_incoming_sysex(event):
 
         if param == proto.PARAM_VOLUME:
             db = proto.volume_raw_to_db(raw)
-            _suppress_echo.add(channel)
-            mixer.setTrackVolume(track, db_to_fl_volume(db))
+            _apply_from_hardware(channel, module, param, track, db_to_fl_volume(db))
         elif param == proto.PARAM_PAN:
             pos = proto.pan_raw_to_position(raw)  # -30..+30
-            _suppress_echo.add(channel)
-            mixer.setTrackPan(track, pos / 30.0)  # -> -1.0..+1.0
+            _apply_from_hardware(channel, module, param, track, pos / 30.0)  # -> -1.0..+1.0
 
     event.handled = True
 
 
+def _apply_from_hardware(echo_key, module, param, track, value):
+    """Sets an FL mixer volume/pan that came from the desk, tells the
+    scheduler the desk holds it, and suppresses the echo FL's
+    OnDirtyMixerTrack would send back -- except when:
+      * the value doesn't change: FL won't call OnDirtyMixerTrack, and the
+        leftover suppression would swallow the next real change;
+      * we wrote this parameter within CROSSING_WINDOW: our write and the
+        desk's crossed on the wire, so the desk now holds our older value
+        and the echo is what brings it back in line;
+      * a write of ours to it is still queued in the scheduler: it would
+        go out later with FL's old value, and the echo replaces it in the
+        queue with the desk's."""
+    if param == proto.PARAM_VOLUME:
+        get_value, set_value = mixer.getTrackVolume, mixer.setTrackVolume
+    else:
+        get_value, set_value = mixer.getTrackPan, mixer.setTrackPan
+    crossed = (_scheduler.sent_within(module, param, CROSSING_WINDOW)
+               or _scheduler.param_pending(module, param))
+    _scheduler.param_reported(module, param, None if crossed else _to_raw(param, value))
+    if get_value(track) == value:
+        return
+    if not crossed:
+        _suppress_echo.add(echo_key)
+    set_value(track, value)
+
+
 # ---------------------------------------------------------------------------
 # Outgoing (FL Studio -> hardware)
 # ---------------------------------------------------------------------------
 
-def _send_volume_to_hardware(channel, fl_volume):
-    db = fl_volume_to_db(fl_volume)
-    raw = proto.volume_db_to_raw(db)
-    device_byte = proto.device_byte_for_channel(DEVICE_MIDI_CHANNEL)
-    msg = proto.build_param_change_sysex(
-        proto.MODULE_CHANNEL_BASE + channel, proto.PARAM_VOLUME, raw, device_byte
-    )
-    device.midiOutSysex(bytes(msg))
+def _queue_track_to_hardware(channel, track):
+    _queue_volume_to_hardware(channel, mixer.getTrackVolume(track))
+    _queue_pan_to_hardware(channel, mixer.getTrackPan(track))
 
 
-def _send_pan_to_hardware(channel, fl_pan):
-    position = fl_pan * 30.0  # -1.0..+1.0 -> -30..+30
-    raw = proto.pan_position_to_raw(position)
-    device_byte = proto.device_byte_for_channel(DEVICE_MIDI_CHANNEL)
-    msg = proto.build_param_change_sysex(
-        proto.MODULE_CHANNEL_BASE + channel, proto.PARAM_PAN, raw, device_byte
-    )
-    device.midiOutSysex(bytes(msg))
+def _queue_volume_to_hardware(channel, fl_volume):
+    _scheduler.queue_param(ddx3216_scheduler.PRIORITY_FADER, proto.MODULE_CHANNEL_BASE + channel,
+                           proto.PARAM_VOLUME, _to_raw(proto.PARAM_VOLUME, fl_volume))
+
+
+def _queue_master_to_hardware():
+    raw = _to_raw(proto.PARAM_VOLUME, mixer.getTrackVolume(MASTER_TRACK))
+    for module in MASTER_MODULES:
+        _scheduler.queue_param(ddx3216_scheduler.PRIORITY_FADER, module, proto.PARAM_VOLUME, raw)
+
+
+def _queue_pan_to_hardware(channel, fl_pan):
+    _scheduler.queue_param(ddx3216_scheduler.PRIORITY_FADER, proto.MODULE_CHANNEL_BASE + channel,
+                           proto.PARAM_PAN, _to_raw(proto.PARAM_PAN, fl_pan))
+
+
+def _to_raw(param, fl_value):
+    """The raw desk value for an FL volume (0.0..1.0) or pan (-1.0..+1.0)."""
+    if param == proto.PARAM_VOLUME:
+        return proto.volume_db_to_raw(fl_volume_to_db(fl_value))
+    return proto.pan_position_to_raw(fl_value * 30.0)  # -> -30..+30
+
+
+def _send_sysex_timed(data):
+    """Scheduler sink used when LATENCY_INSTRUMENTATION is on: sends, then
+    closes the fl->hw timing for every channel the frame carried."""
+    device.midiOutSysex(data)
+    for module, _, _ in proto.parse_param_change_sysex(data):
+        _latency.end(LATENCY_PATH_FL_TO_HW, module - proto.MODULE_CHANNEL_BASE)
+    for channel, _ in proto.parse_attenuation_sysex(data):
+        _latency.end(LATENCY_PATH_FL_TO_HW, channel)
+
+
+def print_latency_report():
+    lines = _latency.summary_lines()
+    if not lines:
+        print("DDX3216 latency: no samples")
+        return
+    print("DDX3216 latency (last %d samples per path):" % _latency.ring_size)
+    for line in lines:
+        print("  " + line)
+
+
+# ---------------------------------------------------------------------------
+# Callback profiler (opt-in, see the module docstring)
+# ---------------------------------------------------------------------------
+
+_profiler = ddx3216_profiler.CallbackProfiler()
+if CALLBACK_PROFILER:
+    _profiler.install(globals(), combo=ddx3216_profiler.ButtonCombo(PROFILE_TOGGLE_COMBO))
+
+
+def toggle_profiling():
+    return _profiler.toggle()
+
+
+def print_profile_report():
+    _profiler.print_report()
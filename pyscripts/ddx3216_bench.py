@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+"""
+ddx3216_bench.py
+
+Micro-benchmarks for the hot paths of the DDX3216 scripts and tools, with a
+JSON history so a change can be shown to be faster (or caught being
+slower):
+
+  * protocol: building/parsing 0x20 frames, batch frame sets, dB/pan
+    conversions (ddx3216_protocol.py);
+  * daw2: TDDX3216CU.OnMidiMsg for fader (pitch bend), knob and jog
+    messages, UpdateColT, OnIdle after OnUpdateMeters -- run on the FL API
+    stubs via ddx3216_fl_harness.py, so stub overhead is included but is
+    the same from run to run;
+  * transport: a full state sync (64 parameter changes) plus a ping round
+    trip to an emulated desk with no link-rate limit, over each
+    ddx3216_transport backend -- in-process loopback, a pty (the serial
+    path) and UDP on localhost -- so the links' own overhead is compared
+    with the same engine code;
+  * firmware: entropy, block entropies, string scan and diff from
+    ddx3216_fw_analyze.py on a deterministic synthetic image.
+
+Timing is pyperf-style: each benchmark is calibrated to a loop count that
+takes at least --min-time per sample, then --samples samples are taken;
+the median per-call time is what gets compared. Every run is appended to
+the history file, and each benchmark is checked against its latest result
+there (from runs labelled LABEL only, with --baseline LABEL): a median
+slower by more than --threshold percent is flagged and the exit status
+is 2.
+
+Usage:
+    python3 ddx3216_bench.py [--filter TEXT] [--samples N] [--min-time S]
+        [--threshold PCT] [--history FILE] [--label NAME] [--baseline NAME]
+        [--no-record] [--list]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import platform
+import statistics
+import subprocess
+
+import ddx3216_cli as cli
+import ddx3216_desk_emulator as emulator
+import ddx3216_fl_harness as harness
+import ddx3216_fw_analyze as fwa
+import ddx3216_protocol as proto
+import ddx3216_serial
+import ddx3216_udp
+import midi
+from ddx3216_transport import LoopbackTransport
+
+DAW2_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "device_DDX3216_daw2.py")
+DEFAULT_HISTORY = os.path.join(os.path.expanduser("~"), ".cache", "ddx3216_bench", "history.json")
+DEFAULT_SAMPLES = 7
+DEFAULT_MIN_TIME = 0.05        # seconds per sample
+DEFAULT_THRESHOLD = 10.0       # percent
+SYNTHETIC_IMAGE_SIZE = 256 * 1024
+
+BENCHMARKS = []                # (name, setup) -- setup() returns the callable to time
+
+
+def bench(name):
+    def register(setup):
+        BENCHMARKS.append((name, setup))
+        return setup
+    return register
+
+
+# ---------------------------------------------------------------------------
+# protocol
+# ---------------------------------------------------------------------------
+
+@bench("protocol.build_param_change_sysex")
+def _build_param_change():
+    build = proto.build_param_change_sysex
+    return lambda: build(5, proto.PARAM_VOLUME, 1234, 0x41)
+
+
+@bench("protocol.parse_param_change_sysex[1]")
+def _parse_param_change_one():
+    frame = proto.build_param_change_sysex(5, proto.PARAM_VOLUME, 1234)
+    parse = proto.parse_param_change_sysex
+    return lambda: parse(frame)
+
+
+@bench("protocol.parse_param_change_sysex[23]")
+def _parse_param_change_batch():
+    frame = proto.build_param_change_batch_sysex(
+        [(ch, proto.PARAM_VOLUME, ch * 60) for ch in range(proto.MAX_ENTRIES_PER_FRAME)])[0]
+    parse = proto.parse_param_change_sysex
+    return lambda: parse(frame)
+
+
+@bench("protocol.build_change_set_sysex[32]")
+def _build_change_set():
+    changes = [(ch, proto.PARAM_VOLUME, ch * 40) for ch in range(32)]
+    build = proto.build_change_set_sysex
+    return lambda: build(changes, allow_attenuation=True)
+
+
+@bench("protocol.volume_db_to_raw+raw_to_db")
+def _volume_conversions():
+    to_raw = proto.volume_db_to_raw
+    to_db = proto.volume_raw_to_db
+    return lambda: to_db(to_raw(-12.5))
+
+
+@bench("protocol.pan_position_to_raw+raw_to_position")
+def _pan_conversions():
+    to_raw = proto.pan_position_to_raw
+    to_pos = proto.pan_raw_to_position
+    return lambda: to_pos(to_raw(-7.0))
+
+
+# ---------------------------------------------------------------------------
+# daw2 script callbacks
+# ---------------------------------------------------------------------------
+
+_daw2 = []
+
+
+def _daw2_surface():
+    if not _daw2:
+        script = harness.load_script(DAW2_SCRIPT)
+        script.OnInit()
+        _daw2.append(script.DDX3216CU)
+    return _daw2[0]
+
+
+def _on_midi(status, data1, data2):
+    surface = _daw2_surface()
+
+    def run():
+        surface.OnMidiMsg(harness.FlMidiMsg(status, data1, data2))
+    return run
+
+
+@bench("daw2.OnMidiMsg[fader]")
+def _daw2_fader():
+    return _on_midi(midi.MIDI_PITCHBEND + 1, 0x00, 0x40)
+
+
+@bench("daw2.OnMidiMsg[knob]")
+def _daw2_knob():
+    return _on_midi(midi.MIDI_CONTROLCHANGE, 0x12, 0x01)
+
+
+@bench("daw2.OnMidiMsg[jog]")
+def _daw2_jog():
+    return _on_midi(midi.MIDI_CONTROLCHANGE, 0x3C, 0x41)
+
+
+@bench("daw2.UpdateColT")
+def _daw2_update_col_t():
+    return _daw2_surface().UpdateColT
+
+
+@bench("daw2.OnUpdateMeters+OnIdle")
+def _daw2_idle_meters():
+    surface = _daw2_surface()
+
+    def run():
+        surface.OnUpdateMeters()
+        surface.OnIdle()
+    return run
+
+
+# ---------------------------------------------------------------------------
+# transports
+# ---------------------------------------------------------------------------
+
+def _bench_desk():
+    return emulator.VirtualDesk(bytes_per_second=0, processing_delay=0.0)
+
+
+def _state_sync(client):
+    frames = proto.build_param_change_batch_sysex(
+        [(ch, param, ch * 40) for ch in range(32) for param in (proto.PARAM_VOLUME, proto.PARAM_PAN)])
+    ping = proto.build_connection_test_sysex()
+
+    def run():
+        client.send_frames(frames)
+        client.request(ping)
+    return run
+
+
+@bench("transport.state_sync+ping[loopback]")
+def _transport_loopback():
+    host, far = LoopbackTransport.pair()
+    emulator.TransportEndpoint(_bench_desk(), far).start()
+    return _state_sync(emulator.TransportClient(host))
+
+
+@bench("transport.state_sync+ping[pty]")
+def _transport_pty():
+    path, _, _ = ddx3216_serial.serve_desk_on_pty(_bench_desk())
+    return _state_sync(emulator.TransportClient(ddx3216_serial.SerialLink.open(path)))
+
+
+@bench("transport.state_sync+ping[udp]")
+def _transport_udp():
+    address, _, _ = ddx3216_udp.serve_desk_on_udp(_bench_desk())
+    return _state_sync(emulator.TransportClient(ddx3216_udp.UdpTransport.connect(address)))
+
+
+# ---------------------------------------------------------------------------
+# firmware analyzer
+# ---------------------------------------------------------------------------
+
+def synthetic_image(size=SYNTHETIC_IMAGE_SIZE, seed=0x3216):
+    """Random code-like bytes with erased (0xFF) runs and embedded strings,
+    the same every time."""
+    rng = random.Random(seed)
+    words = [b"CHANNEL", b"MASTER", b"DYNAMICS", b"SNAPSHOT", b"EQ LIB", b"FX RETURN"]
+    out = bytearray()
+    while len(out) < size:
+        kind = rng.random()
+        if kind < 0.6:
+            out.extend(rng.getrandbits(8) for _ in range(rng.randrange(64, 512)))
+        elif kind < 0.8:
+            out.extend(b"\xff" * rng.randrange(64, 1024))
+        else:
+            out.extend(rng.choice(words) + b" %02d\x00" % rng.randrange(100))
+    return bytes(out[:size])
+
+
+def _edited(data, seed=0x3217):
+    rng = random.Random(seed)
+    out = bytearray(data)
+    for _ in range(64):
+        pos = rng.randrange(len(out) - 16)
+        out[pos:pos + 16] = bytes(rng.getrandbits(8) for _ in range(16))
+    return bytes(out)
+
+
+@bench("fw.entropy[64K]")
+def _fw_entropy():
+    data = synthetic_image(64 * 1024)
+    return lambda: fwa.entropy(data)
+
+
+@bench("fw.block_entropies[256K]")
+def _fw_block_entropies():
+    data = synthetic_image()
+    return lambda: fwa.block_entropies(data, 4096, 1024)
+
+
+@bench("fw.scan_strings[256K]")
+def _fw_strings():
+    data = synthetic_image()
+    return lambda: sum(1 for _ in fwa.scan_strings(data))
+
+
+@bench("fw.diff_data[256K]")
+def _fw_diff():
+    a = synthetic_image()
+    b = _edited(a)
+    return lambda: fwa.diff_data(a, b)
+
+
+# ---------------------------------------------------------------------------
+# runner and history
+# ---------------------------------------------------------------------------
+
+def _time_loops(fn, loops: int) -> float:
+    timer = time.perf_counter
+    t0 = timer()
+    for _ in range(loops):
+        fn()
+    return timer() - t0
+
+
+def measure(fn, samples: int = DEFAULT_SAMPLES, min_time: float = DEFAULT_MIN_TIME) -> dict:
+    """Calibrates a loop count (this doubles as warm-up), then returns
+    per-call statistics over `samples` timed samples."""
+    loops = 1
+    while True:
+        elapsed = _time_loops(fn, loops)
+        if elapsed >= min_time:
+            break
+        loops = max(loops * 2, int(loops * min_time / max(elapsed, 1e-9) * 1.1))
+    times = [_time_loops(fn, loops) / loops for _ in range(samples)]
+    return {
+        "median": statistics.median(times),
+        "min": min(times),
+        "stdev": statistics.stdev(times) if len(times) > 1 else 0.0,
+        "loops": loops,
+    }
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+
+def load_history(path: str) -> list:
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_history(path: str, history: list):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(history, f, indent=1)
+    os.replace(tmp, path)
+
+
+def find_baseline(history: list, label: str = None) -> dict:
+    """Per benchmark, the result from the most recent run that has it
+    (only runs labelled `label` if given), so a filtered run doesn't hide
+    older results for everything it skipped. name -> (result, run)."""
+    base = {}
+    for run in reversed(history):
+        if label is not None and run.get("label") != label:
+            continue
+        for name, result in run["results"].items():
+            base.setdefault(name, (result, run))
+    return base
+
+
+def _format_time(seconds: float) -> str:
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:8.2f} ms"
+    if seconds >= 1e-6:
+        return f"{seconds * 1e6:8.2f} us"
+    return f"{seconds * 1e9:8.1f} ns"
+
+
+def run_benchmarks(selected, samples: int, min_time: float, baseline: dict, threshold: float):
+    """Runs and prints each benchmark. Returns (results, regressions)."""
+    results = {}
+    regressions = []
+    print(f"=== DDX3216 benchmarks ({len(selected)}) ===")
+    for name, setup in selected:
+        stats = measure(setup(), samples, min_time)
+        results[name] = stats
+        line = (f"  {name:44} {_format_time(stats['median'])}  min {_format_time(stats['min'])}  "
+                f"+-{stats['stdev'] / stats['median'] * 100.0 if stats['median'] else 0.0:4.1f}%")
+        old = baseline.get(name)
+        if old:
+            change = (stats["median"] / old[0]["median"] - 1.0) * 100.0
+            line += f"  {change:+6.1f}%  vs {old[1].get('label') or old[1].get('revision') or old[1]['timestamp']}"
+            if change > threshold:
+                line += "  REGRESSION"
+                regressions.append((name, change))
+        print(line)
+    return results, regressions
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    name_filter = None
+    samples = DEFAULT_SAMPLES
+    min_time = DEFAULT_MIN_TIME
+    threshold = DEFAULT_THRESHOLD
+    history_path = DEFAULT_HISTORY
+    label = None
+    baseline_label = None
+    record = True
+    list_only = False
+    it = iter(args)
+    for a in it:
+        if a == "--filter":
+            name_filter = cli.option_value(it, a, __doc__)
+        elif a == "--samples":
+            samples = cli.int_option(it, a, __doc__)
+        elif a == "--min-time":
+            min_time = cli.float_option(it, a, __doc__)
+        elif a == "--threshold":
+            threshold = cli.float_option(it, a, __doc__)
+        elif a == "--history":
+            history_path = cli.option_value(it, a, __doc__)
+        elif a == "--label":
+            label = cli.option_value(it, a, __doc__)
+        elif a == "--baseline":
+            baseline_label = cli.option_value(it, a, __doc__)
+        elif a == "--no-record":
+            record = False
+        elif a == "--list":
+            list_only = True
+        else:
+            print(__doc__)
+            sys.exit(1)
+
+    selected = [(name, setup) for name, setup in BENCHMARKS if not name_filter or name_filter in name]
+    if list_only:
+        for name, _ in selected:
+            print(name)
+        sys.exit(0)
+
+    history = load_history(history_path)
+    baseline = find_baseline(history, baseline_label)
+    results, regressions = run_benchmarks(selected, samples, min_time, baseline, threshold)
+    if record:
+        history.append({
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "label": label,
+            "revision": _git_revision(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "results": results,
+        })
+        save_history(history_path, history)
+    if regressions:
+        print(f"{len(regressions)} regression(s) beyond {threshold:.0f}%: "
+              + ", ".join(f"{name} {change:+.1f}%" for name, change in regressions))
+        sys.exit(2)
@@ -0,0 +1,653 @@
+#!/usr/bin/env python3
+"""
+ddx3216_capture.py
+
+Records timestamped MIDI traffic between a host and the desk in both
+directions, and replays it deterministically -- for reproducing fader
+storms and echo loops seen live, and for comparing message counts before
+and after a change.
+
+Capture format (append-only, so a crash loses at most the last record):
+
+    header   b"DDXCAP1\\0", version u16, reserved u16, start time f64
+             (Unix seconds) -- 20 bytes
+    record   varint time since the previous record (microseconds),
+             varint (length << 1 | direction), then the raw bytes
+
+direction 0 is desk -> host (IN), 1 is host -> desk (OUT). A CC costs 5
+bytes on disk. A sidecar FILE.idx holds one (time_us, offset) pair per
+second of capture, so replay can start anywhere without reading from the
+top; it is rebuilt by a scan if missing. An entry is only written once its
+record has been flushed, and reopening a capture whose tail was cut off
+drops the index entries past the last complete record.
+
+Recording:
+    --record-tcp LISTEN TARGET   proxy HOST:PORT -> HOST:PORT (e.g. in front
+                                 of ddx3216_desk_emulator.py --tcp)
+    --record-midi IN OUT NAME    proxy between the desk's MIDI ports and a
+                                 virtual port NAME for the host (needs mido
+                                 with a backend that has virtual ports)
+
+Replay:
+    --replay FILE [--script SCRIPT.py] [--speed X] [--from S] [--to S]
+                  [--idle-rate HZ]
+
+Without --script, every record goes through the ddx3216_protocol parsers
+and the report gives counts per direction and function. With --script, IN
+records become OnMidiMsg calls on the script, running on the FL stubs
+(ddx3216_fl_harness.py), with OnIdle ticking alongside. What the script
+sends is then compared with the OUT traffic that was recorded. --speed 1
+replays in real time; 0, the default, runs as fast as possible.
+
+    --info FILE                  header, duration and totals
+    --selftest                   write, read back, seek and reopen
+                                 captures (including ones cut short by
+                                 a crash) in a temporary directory
+
+Usage:
+    python3 ddx3216_capture.py --record-tcp 127.0.0.1:3217 127.0.0.1:3216 FILE
+    python3 ddx3216_capture.py --replay FILE --script device_DDX3216.py
+    python3 ddx3216_capture.py --selftest
+"""
+
+import os
+import sys
+import mmap
+import time
+import heapq
+import struct
+import bisect
+import socket
+import tempfile
+import threading
+import collections
+
+try:
+    import mido
+except ImportError:
+    mido = None
+
+import ddx3216_cli as cli
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "FLStudioMidiScript", "FLStudio_DDX3216"))
+import ddx3216_protocol as proto  # noqa: E402
+
+CAPTURE_MAGIC = b"DDXCAP1\0"
+INDEX_MAGIC = b"DDXIDX1\0"
+CAPTURE_VERSION = 1
+HEADER = struct.Struct("<8sHHd")
+INDEX_ENTRY = struct.Struct("<QQ")
+INDEX_INTERVAL_US = 1000000
+
+DIR_IN = 0       # desk -> host
+DIR_OUT = 1      # host -> desk
+DIRECTION_NAMES = ("in", "out")
+
+DEFAULT_IDLE_RATE = 50.0
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _read_varint(data, pos: int):
+    """(value, next position), or (None, pos) if data ends mid-varint."""
+    value = 0
+    shift = 0
+    while pos < len(data):
+        b = data[pos]
+        pos += 1
+        value |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return value, pos
+        shift += 7
+    return None, pos
+
+
+def _decode_records(data, pos: int, time_us: int):
+    """Yields (record offset, end offset, time_us, direction, payload)
+    from `pos`, stopping quietly at a truncated last record."""
+    end = len(data)
+    while pos < end:
+        start = pos
+        delta, pos = _read_varint(data, pos)
+        size, pos = _read_varint(data, pos) if delta is not None else (None, pos)
+        if size is None or pos + (size >> 1) > end:
+            return
+        time_us += delta
+        end_pos = pos + (size >> 1)
+        yield start, end_pos, time_us, size & 1, data[pos:end_pos]
+        pos = end_pos
+
+
+class CaptureWriter:
+    """Appends records to a capture file (created if missing). Thread-safe.
+    clock() gives seconds for records written without an explicit time."""
+
+    def __init__(self, path: str, clock=None):
+        self.path = path
+        self.clock = clock or time.perf_counter
+        self._lock = threading.Lock()
+        self.records = 0
+        if os.path.exists(path) and os.path.getsize(path) >= HEADER.size:
+            reader = CaptureReader(path)
+            self.start_time = reader.start_time
+            self._last_us, valid_end = reader.tail()
+            index = [entry for entry in reader.index if entry[1] < valid_end]
+            self._index_next = (index[-1][0] // INDEX_INTERVAL_US + 1) * INDEX_INTERVAL_US if index else 0
+            self.records = reader.count
+            reader.close()
+            # entries past the dropped tail would point into new records
+            with open(path + ".idx", "wb") as f:
+                f.write(INDEX_MAGIC + b"".join(INDEX_ENTRY.pack(*entry) for entry in index))
+            self._file = open(path, "r+b")
+            self._file.truncate(valid_end)
+            self._file.seek(valid_end)
+            # the clock restarts; keep time monotonic across sessions
+            self._t0 = self.clock() - self._last_us / 1e6
+        else:
+            self.start_time = time.time()
+            self._last_us = 0
+            self._index_next = 0
+            self._file = open(path, "wb")
+            self._file.write(HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION, 0, self.start_time))
+            self._t0 = self.clock()
+        index_path = path + ".idx"
+        new_index = not os.path.exists(index_path)
+        self._index = open(index_path, "ab")
+        if new_index:
+            self._index.write(INDEX_MAGIC)
+
+    def write(self, direction: int, data, t: float = None):
+        """Appends one message. t is seconds since the capture started
+        (default: from the clock); times never go backwards."""
+        data = bytes(data)
+        with self._lock:
+            time_us = int(((self.clock() - self._t0) if t is None else t) * 1e6)
+            time_us = max(time_us, self._last_us)
+            offset = self._file.tell()
+            self._file.write(_varint(time_us - self._last_us) + _varint(len(data) << 1 | direction) + data)
+            self._last_us = time_us
+            self.records += 1
+            if time_us >= self._index_next:
+                # the record goes to disk first, so an index entry never
+                # points past what a crash leaves behind
+                self._file.flush()
+                self._index.write(INDEX_ENTRY.pack(time_us, offset))
+                self._index.flush()
+                self._index_next = (time_us // INDEX_INTERVAL_US + 1) * INDEX_INTERVAL_US
+
+    def tap(self, direction: int):
+        """A one-argument sink recording everything passed to it."""
+        return lambda data: self.write(direction, data)
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+            self._index.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+            self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CaptureReader:
+    """Reads a capture file: iterate for (t, direction, data) with t in
+    seconds since the start; records(start, end) to read a time range."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self.data = None
+        try:
+            if os.path.getsize(path) < HEADER.size:
+                raise ValueError(f"{path}: not a capture file")
+            self.data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, _, self.start_time = HEADER.unpack_from(self.data)
+            if magic != CAPTURE_MAGIC or version != CAPTURE_VERSION:
+                raise ValueError(f"{path}: not a version {CAPTURE_VERSION} capture file")
+            self.index = self._load_index()
+        except Exception:
+            if self.data is not None:
+                self.data.close()
+            self._file.close()
+            raise
+        self._count = None
+
+    def _load_index(self):
+        index = []
+        try:
+            with open(self.path + ".idx", "rb") as f:
+                raw = f.read()
+        except OSError:
+            raw = b""
+        if raw.startswith(INDEX_MAGIC):
+            body = len(raw) - len(INDEX_MAGIC)
+            for time_us, offset in INDEX_ENTRY.iter_unpack(
+                    raw[len(INDEX_MAGIC):len(INDEX_MAGIC) + body - body % INDEX_ENTRY.size]):
+                if offset < len(self.data):
+                    index.append((time_us, offset))
+        if not index and len(self.data) > HEADER.size:
+            index = self.build_index()
+        return index
+
+    def build_index(self):
+        index = []
+        next_us = 0
+        for offset, _, time_us, _, _ in _decode_records(self.data, HEADER.size, 0):
+            if time_us >= next_us:
+                index.append((time_us, offset))
+                next_us = (time_us // INDEX_INTERVAL_US + 1) * INDEX_INTERVAL_US
+        return index
+
+    def _records_from(self, start_us: int):
+        i = bisect.bisect_right(self.index, (start_us, float("inf"))) - 1
+        if i < 0:
+            pos, base_us = HEADER.size, 0
+        else:
+            # an index entry points at a record; its delta is relative to
+            # the record before, so rewind the clock by that delta
+            time_us, pos = self.index[i]
+            delta, _ = _read_varint(self.data, pos)
+            base_us = time_us - delta
+        return _decode_records(self.data, pos, base_us)
+
+    def records(self, start: float = 0.0, end: float = None):
+        start_us = int(start * 1e6)
+        end_us = None if end is None else int(end * 1e6)
+        for _, _, time_us, direction, payload in self._records_from(start_us):
+            if time_us < start_us:
+                continue
+            if end_us is not None and time_us > end_us:
+                return
+            yield time_us / 1e6, direction, payload
+
+    def __iter__(self):
+        return self.records()
+
+    def close(self):
+        self.data.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def tail(self):
+        """(time_us of the last complete record, offset just past it) --
+        where an appending writer carries on. Scans from the last index
+        entry whose record is complete, falling back to earlier entries
+        (and finally the header) when a crash cut the indexed record
+        short."""
+        for time_us, pos in reversed(self.index):
+            delta, _ = _read_varint(self.data, pos)
+            if delta is None:
+                continue
+            last = None
+            for last in _decode_records(self.data, pos, time_us - delta):
+                pass
+            if last is not None:
+                return last[2], last[1]
+        last_us = 0
+        end = HEADER.size
+        for _, end, last_us, _, _ in _decode_records(self.data, HEADER.size, 0):
+            pass
+        return last_us, end
+
+    @property
+    def count(self):
+        if self._count is None:
+            self._count = sum(1 for _ in _decode_records(self.data, HEADER.size, 0))
+        return self._count
+
+
+# ---------------------------------------------------------------------------
+# Summaries
+# ---------------------------------------------------------------------------
+
+_SHORT_KINDS = {0x80: "note off", 0x90: "note on", 0xA0: "poly at", 0xB0: "cc",
+                0xC0: "program", 0xD0: "chan at", 0xE0: "pitch bend"}
+
+
+def message_kind(data) -> str:
+    if data[0] == 0xF0:
+        function = proto.sysex_function(data)
+        return "sysex ?" if function is None else f"sysex {function:#04x}"
+    return _SHORT_KINDS.get(data[0] & 0xF0, f"{data[0]:#04x}")
+
+
+def _entries(data) -> int:
+    """Entries carried by one message, through the protocol parsers."""
+    function = proto.sysex_function(data)
+    if function == proto.FUNC_PARAM_CHANGE:
+        return len(proto.parse_param_change_sysex(data))
+    if function == proto.FUNC_CHANNEL_ATTENUATION:
+        return len(proto.parse_attenuation_sysex(data))
+    if function == proto.FUNC_METER_DATA:
+        parsed = proto.parse_meter_data_sysex(data)
+        return parsed[1] if parsed else 0
+    if function in proto.DUMP_FUNCTIONS:
+        return 1 if proto.parse_dump_block_sysex(data) else 0
+    return 1
+
+
+def protocol_summary(records):
+    """{(direction, kind): [messages, bytes, entries]} over (t, direction,
+    data) records, plus the span covered."""
+    totals = collections.defaultdict(lambda: [0, 0, 0])
+    first = last = None
+    for t, direction, data in records:
+        if first is None:
+            first = t
+        last = t
+        row = totals[(direction, message_kind(data))]
+        row[0] += 1
+        row[1] += len(data)
+        row[2] += _entries(data)
+    return totals, (last - first) if first is not None else 0.0
+
+
+def _paced(records, speed: float, start: float = 0.0):
+    """Passes records through no faster than `speed` x real time."""
+    t0 = time.perf_counter()
+    for record in records:
+        delay = t0 + (record[0] - start) / speed - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        yield record
+
+
+def print_protocol_summary(path: str, totals, span: float, elapsed: float):
+    print(f"=== Capture replay (protocol): {os.path.basename(path)} ===")
+    messages = sum(row[0] for row in totals.values())
+    print(f"{messages} messages over {span:.2f} s, parsed in {elapsed * 1000.0:.1f} ms "
+          f"({messages / elapsed if elapsed else 0.0:.0f} msg/s)")
+    print(f"  {'dir':4} {'kind':12} {'messages':>9} {'bytes':>10} {'entries':>9} {'bytes/s':>9}")
+    for (direction, kind), (count, size, entries) in sorted(totals.items()):
+        print(f"  {DIRECTION_NAMES[direction]:4} {kind:12} {count:9} {size:10} {entries:9} "
+              f"{size / span if span else 0.0:9.0f}")
+
+
+def print_info(path: str):
+    with CaptureReader(path) as reader:
+        per_direction = [[0, 0], [0, 0]]
+        last = 0.0
+        for t, direction, data in reader:
+            per_direction[direction][0] += 1
+            per_direction[direction][1] += len(data)
+            last = t
+        print(f"=== Capture: {path} ===")
+        print(f"started:  {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(reader.start_time))}")
+        print(f"duration: {last:.3f} s   records: {reader.count}   "
+              f"file: {os.path.getsize(path)} bytes   index entries: {len(reader.index)}")
+        for direction, (count, size) in enumerate(per_direction):
+            print(f"  {DIRECTION_NAMES[direction]:4} {count:9} messages {size:10} bytes")
+
+
+# ---------------------------------------------------------------------------
+# Replay through a device script
+# ---------------------------------------------------------------------------
+
+def replay_script(path: str, script_path: str, speed: float = 0.0, start: float = 0.0,
+                  end: float = None, idle_rate: float = DEFAULT_IDLE_RATE):
+    """Feeds the IN records to the script's OnMidiMsg (with OnIdle at
+    idle_rate) and returns (harness result, recorded OUT totals, replayed
+    OUT totals), the totals as {kind: [messages, bytes]}."""
+    import ddx3216_fl_harness as harness
+    import _flstub
+
+    recorded = collections.defaultdict(lambda: [0, 0])
+    replayed = collections.defaultdict(lambda: [0, 0])
+
+    def count(totals, data):
+        row = totals[message_kind(data)]
+        row[0] += 1
+        row[1] += len(data)
+
+    with CaptureReader(path) as reader:
+        if end is None:
+            end = reader.tail()[0] / 1e6
+
+        def inbound():
+            for t, direction, data in reader.records(start, end):
+                if direction == DIR_OUT:
+                    count(recorded, data)
+                else:
+                    yield t - start, "OnMidiMsg", (harness.FlMidiMsg.from_bytes(data),)
+
+        h = harness.Harness(harness.load_script(script_path))
+        h.init()
+        h.reset()
+        _flstub.sinks.append(lambda data: count(replayed, data))
+        events = heapq.merge(inbound(), harness.periodic_events("OnIdle", idle_rate, end - start),
+                             key=lambda event: event[0])
+        h.run(events, speed)
+        result = h.summary()
+        h.deinit()
+    return result, recorded, replayed
+
+
+def print_replay_comparison(recorded, replayed):
+    print("output vs recording:")
+    print(f"  {'kind':12} {'recorded':>9} {'bytes':>9} {'replayed':>9} {'bytes':>9} {'change':>8}")
+    for kind in sorted(set(recorded) | set(replayed)):
+        old = recorded.get(kind, [0, 0])
+        new = replayed.get(kind, [0, 0])
+        change = f"{(new[1] / old[1] - 1.0) * 100.0:+7.1f}%" if old[1] else "     new"
+        print(f"  {kind:12} {old[0]:9} {old[1]:9} {new[0]:9} {new[1]:9} {change:>8}")
+
+
+# ---------------------------------------------------------------------------
+# Recorders
+# ---------------------------------------------------------------------------
+
+def _pump(src, dst, writer: CaptureWriter, direction: int):
+    """Forwards src -> dst, recording each complete message."""
+    assembler = proto.SysExAssembler()
+    try:
+        while True:
+            data = src.recv(4096)
+            if not data:
+                break
+            dst.sendall(data)
+            for msg in assembler.feed(data):
+                writer.write(direction, msg)
+            writer.flush()
+    except OSError:
+        pass
+    for sock in (src, dst):
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+def _address(text: str):
+    host, _, port = text.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def record_tcp(listen: str, target: str, path: str):
+    """Proxies one client at a time to `target`, recording both ways."""
+    server = socket.create_server(_address(listen))
+    print(f"recording {listen} -> {target} into {path} (Ctrl-C to stop)")
+    with CaptureWriter(path) as writer:
+        try:
+            while True:
+                client, addr = server.accept()
+                upstream = socket.create_connection(_address(target))
+                for sock in (client, upstream):
+                    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                print(f"  client {addr[0]}:{addr[1]} connected")
+                pumps = [threading.Thread(target=_pump, args=(client, upstream, writer, DIR_OUT)),
+                         threading.Thread(target=_pump, args=(upstream, client, writer, DIR_IN))]
+                for pump in pumps:
+                    pump.start()
+                for pump in pumps:
+                    pump.join()
+                client.close()
+                upstream.close()
+                print(f"  client disconnected, {writer.records} records so far")
+        except KeyboardInterrupt:
+            pass
+
+
+def record_midi(in_name: str, out_name: str, virtual_name: str, path: str):
+    """Sits between the desk's MIDI ports and a virtual port the host
+    connects to, recording both ways."""
+    if mido is None:
+        print("--record-midi needs mido (pip install mido python-rtmidi)")
+        sys.exit(1)
+    desk_in = mido.open_input(in_name)
+    desk_out = mido.open_output(out_name)
+    host = mido.open_ioport(virtual_name, virtual=True)
+    print(f"recording {in_name}/{out_name} <-> virtual port {virtual_name!r} into {path} (Ctrl-C to stop)")
+    with CaptureWriter(path) as writer:
+        try:
+            while True:
+                busy = False
+                for msg in desk_in.iter_pending():
+                    writer.write(DIR_IN, msg.bytes())
+                    host.send(msg)
+                    busy = True
+                for msg in host.iter_pending():
+                    writer.write(DIR_OUT, msg.bytes())
+                    desk_out.send(msg)
+                    busy = True
+                if busy:
+                    writer.flush()
+                else:
+                    time.sleep(0.0005)
+        except KeyboardInterrupt:
+            pass
+
+
+# ---------------------------------------------------------------------------
+# Self-test
+# ---------------------------------------------------------------------------
+
+def _write_sample(path: str, count: int, spacing: float):
+    messages = [bytes((0xB0, 1 + i % 32, i % 128)) * (1 + i % 4) for i in range(count)]
+    for stale in (path, path + ".idx"):
+        if os.path.exists(stale):
+            os.remove(stale)
+    with CaptureWriter(path) as writer:
+        for i, data in enumerate(messages):
+            writer.write(i % 2, data, t=i * spacing)
+    return messages
+
+
+def selftest() -> bool:
+    """Round trip, time-range reads, and reopening after the file was cut
+    at every offset within its last few records. Returns True if all
+    checks passed."""
+    print("=== DDX3216 capture self-test ===")
+    failures = []
+
+    def check(label, ok):
+        print(f"  {label:52} {'ok' if ok else 'FAILED'}")
+        if not ok:
+            failures.append(label)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sample.cap")
+        messages = _write_sample(path, 101, 1.0)
+        with CaptureReader(path) as reader:
+            check("round trip", [data for _, _, data in reader] == messages)
+            check("records(50, 60) via the index",
+                  [data for _, _, data in reader.records(50.0, 60.0)] == messages[50:61])
+            check("index covers every second", len(reader.index) == len(messages))
+
+        full = os.path.getsize(path)
+        cuts_ok = True
+        index_ok = True
+        for cut in range(1, 40):
+            messages = _write_sample(path, 101, 1.0)
+            os.truncate(path, full - cut)
+            with CaptureReader(path) as reader:
+                kept = [data for _, _, data in reader]
+            with CaptureWriter(path) as writer:
+                writer.write(DIR_OUT, b"\xb0\x01\x7f", t=200.0)
+            with CaptureReader(path) as reader:
+                after = [data for _, _, data in reader]
+                cuts_ok = cuts_ok and kept == messages[:len(kept)] and len(kept) >= 90 \
+                    and after == kept + [b"\xb0\x01\x7f"]
+                index_ok = index_ok and reader.build_index() == reader.index
+        check("reopen after truncation keeps complete records", cuts_ok)
+        check("index still valid after truncation and append", index_ok)
+
+    return not failures
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    mode = None
+    mode_args = []
+    script = None
+    speed = 0.0
+    start = 0.0
+    end = None
+    idle_rate = DEFAULT_IDLE_RATE
+    it = iter(args)
+    for a in it:
+        if a == "--record-tcp":
+            mode, mode_args = a, [cli.option_value(it, a, __doc__) for _ in range(3)]
+        elif a == "--record-midi":
+            mode, mode_args = a, [cli.option_value(it, a, __doc__) for _ in range(4)]
+        elif a in ("--replay", "--info"):
+            mode, mode_args = a, [cli.option_value(it, a, __doc__)]
+        elif a == "--script":
+            script = cli.option_value(it, a, __doc__)
+        elif a == "--speed":
+            speed = cli.float_option(it, a, __doc__)
+        elif a == "--from":
+            start = cli.float_option(it, a, __doc__)
+        elif a == "--to":
+            end = cli.float_option(it, a, __doc__)
+        elif a == "--idle-rate":
+            idle_rate = cli.float_option(it, a, __doc__)
+        elif a == "--selftest":
+            mode = a
+        else:
+            print(__doc__)
+            sys.exit(1)
+
+    if mode == "--selftest":
+        sys.exit(0 if selftest() else 1)
+    elif mode == "--record-tcp":
+        record_tcp(*mode_args)
+    elif mode == "--record-midi":
+        record_midi(*mode_args)
+    elif mode == "--info":
+        print_info(mode_args[0])
+    elif mode == "--replay" and script:
+        result, recorded, replayed = replay_script(mode_args[0], script, speed, start, end, idle_rate)
+        import ddx3216_fl_harness as harness
+        harness.print_summary(script, result)
+        print_replay_comparison(recorded, replayed)
+    elif mode == "--replay":
+        with CaptureReader(mode_args[0]) as reader:
+            t0 = time.perf_counter()
+            records = reader.records(start, end)
+            if speed:
+                records = _paced(records, speed, start)
+            totals, span = protocol_summary(records)
+            print_protocol_summary(mode_args[0], totals, span, time.perf_counter() - t0)
+    else:
+        print(__doc__)
+        sys.exit(1)
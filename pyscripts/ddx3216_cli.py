@@ -0,0 +1,49 @@
+"""
+ddx3216_cli.py
+
+Argument helpers shared by the desktop tools' command lines, which walk
+sys.argv with an iterator (`it = iter(args)`, then `for a in it`).
+
+A missing or malformed option value is a usage error like any other bad
+argument: what was wrong and the tool's usage text (its module docstring,
+passed in as `usage`) are printed, and the tool exits with status 1 --
+never a StopIteration or ValueError traceback.
+"""
+
+import sys
+
+
+def usage_error(message: str, usage: str):
+    print(message)
+    print(usage)
+    sys.exit(1)
+
+
+def option_value(it, option: str, usage: str) -> str:
+    """The argument after `option`."""
+    value = next(it, None)
+    if value is None:
+        usage_error(f"{option} needs a value", usage)
+    return value
+
+
+def int_value(text: str, what: str, usage: str, base: int = 10) -> int:
+    try:
+        return int(text, base)
+    except ValueError:
+        usage_error(f"{what}: not a number: {text}", usage)
+
+
+def float_value(text: str, what: str, usage: str) -> float:
+    try:
+        return float(text)
+    except ValueError:
+        usage_error(f"{what}: not a number: {text}", usage)
+
+
+def int_option(it, option: str, usage: str, base: int = 10) -> int:
+    return int_value(option_value(it, option, usage), option, usage, base)
+
+
+def float_option(it, option: str, usage: str) -> float:
+    return float_value(option_value(it, option, usage), option, usage)
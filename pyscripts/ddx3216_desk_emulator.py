@@ -0,0 +1,597 @@
+#!/usr/bin/env python3
+"""
+ddx3216_desk_emulator.py
+
+Software stand-in for a DDX3216, so the scripts' throughput features can be
+exercised and benchmarked without the desk on the bench.
+
+VirtualDesk speaks the protocol in ddx3216_protocol.py:
+
+  * 0x20 parameter changes and 0x22 channel attenuation (mute groups
+    included) update its parameter state; fader/pan CCs do too;
+  * 0x40 connection tests are answered with a 0x00 frame;
+  * 0x44 meter requests are answered with one 0x04 frame for every slot,
+    levels following the channel faders;
+  * 0x50-0x52 bulk dump requests are served block by block with the
+    manual's ACK flow (the host acknowledges a block by requesting the
+    next, and a repeated request means resend), and 0x10-0x12 data blocks
+    from the host are accepted the same way, ACKed by requesting the next
+    block. Uploaded files can be downloaded again. Files are keyed by
+    (function, what); 0x52's filename is not modelled.
+
+Timing is modelled, not just content: both directions of the MIDI link are
+31.25 kbaud (MIDI_BYTES_PER_SECOND from ddx3216_scheduler.py), a frame is
+only handled once its last byte has arrived, and every frame costs
+processing_delay before the answer starts going out. receive() and poll()
+take an optional `now`, so tests can run the model in virtual time; the
+stream endpoint below runs it in real time over a pipe or socket.
+
+Usage:
+    python3 ddx3216_desk_emulator.py [--tcp HOST:PORT] [--channel N] [--bps N]
+                                     [--delay MS] [--corrupt RATE] [--selftest]
+
+--tcp serves one connection at a time (desk state survives reconnects);
+--selftest runs a short session over a loopback pipe and prints how long
+each exchange took. --bps 0 removes the link-rate limit.
+"""
+
+import os
+import sys
+import time
+import heapq
+import queue
+import random
+import socket
+import threading
+import collections
+from array import array
+
+import ddx3216_cli as cli
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "FLStudioMidiScript", "FLStudio_DDX3216"))
+import ddx3216_protocol as proto  # noqa: E402
+from ddx3216_scheduler import MIDI_BYTES_PER_SECOND  # noqa: E402
+
+DEFAULT_PROCESSING_DELAY = 0.002     # seconds per frame
+DEFAULT_SETTINGS_BLOCKS = 16         # the manual's example dump is blocks 0-15
+DEFAULT_PORT = 3216
+READ_CHUNK = 4096
+VOLUME_RAW_MAX = 1472
+CC_VALUE_MAX = 127
+
+
+class WireLink:
+    """One direction of a serial link: bytes queue up behind whatever is
+    still on the wire. bytes_per_second of None or 0 means unlimited."""
+
+    def __init__(self, bytes_per_second=MIDI_BYTES_PER_SECOND):
+        self.byte_time = 1.0 / bytes_per_second if bytes_per_second else 0.0
+        self.busy_until = 0.0
+
+    def transmit(self, now: float, size: int) -> float:
+        """Time at which the last of `size` bytes handed over at `now` has
+        arrived."""
+        self.busy_until = max(now, self.busy_until) + size * self.byte_time
+        return self.busy_until
+
+
+class VirtualDesk:
+    """Protocol state and link model of one desk. Not thread-safe on its
+    own; StreamEndpoint serialises access."""
+
+    def __init__(self, midi_channel=None, bytes_per_second=MIDI_BYTES_PER_SECOND,
+                 processing_delay=DEFAULT_PROCESSING_DELAY, clock=None,
+                 settings_blocks=DEFAULT_SETTINGS_BLOCKS, corrupt_rate=0.0, seed=0x3216):
+        self.midi_channel = midi_channel
+        self.device_byte = proto.device_byte_for_channel(midi_channel)
+        self.processing_delay = processing_delay
+        self.clock = clock or time.perf_counter
+        self.rx = WireLink(bytes_per_second)
+        self.tx = WireLink(bytes_per_second)
+        self.corrupt_rate = corrupt_rate
+        self._rng = random.Random(seed)
+
+        self.params = {}
+        self.mute_groups = {}                  # channel -> group id
+        self.meters = array("B", bytes(proto.METER_SLOT_COUNT))
+        settings = bytes(self._rng.getrandbits(8)
+                         for _ in range(settings_blocks * proto.DUMP_BLOCK_PAYLOAD))
+        self.files = {(proto.FUNC_DUMP_SETTINGS, proto.DUMP_WHAT_UNKNOWN): settings}
+        self._sent_block = {}                  # (function, what) -> last block served
+        self._uploads = {}                     # (function, what) -> [data, next block]
+
+        self.stats = collections.Counter()
+        self._assembler = proto.SysExAssembler()
+        self._outbox = []
+        self._serial = 0
+
+    # -- link model --------------------------------------------------------
+
+    def receive(self, data, now=None):
+        """Hands raw MIDI bytes written by the host at `now` to the desk.
+        Each complete message is handled when its last byte has arrived."""
+        if now is None:
+            now = self.clock()
+        data = bytes(data)
+        self.stats["bytes_in"] += len(data)
+        start = self.rx.transmit(now, len(data)) - len(data) * self.rx.byte_time
+        pos = 0
+        while pos < len(data):
+            end = data.find(b"\xf7", pos)
+            end = len(data) if end < 0 else end + 1
+            arrived = start + end * self.rx.byte_time
+            for msg in self._assembler.feed(data[pos:end]):
+                for response in self.handle(msg):
+                    self._send(response, arrived + self.processing_delay)
+            pos = end
+
+    def _send(self, frame, ready):
+        frame = bytes(frame)
+        self.stats["bytes_out"] += len(frame)
+        self._serial += 1
+        heapq.heappush(self._outbox, (self.tx.transmit(ready, len(frame)), self._serial, frame))
+
+    def next_due(self):
+        """Arrival time of the next queued response at the host, or None."""
+        return self._outbox[0][0] if self._outbox else None
+
+    def poll(self, now=None):
+        """Responses that have fully arrived at the host by `now`."""
+        if now is None:
+            now = self.clock()
+        out = []
+        while self._outbox and self._outbox[0][0] <= now:
+            out.append(heapq.heappop(self._outbox)[2])
+        return out
+
+    def emit_param_change(self, module, param, raw_value, now=None):
+        """Simulates a change made on the desk itself (a fader pulled by
+        hand): updates the state and sends the 0x20 frame to the host."""
+        self.params[(module, param)] = raw_value
+        self._send(proto.build_param_change_sysex(module, param, raw_value, self.device_byte),
+                   self.clock() if now is None else now)
+
+    def emit_cc(self, cc, value, now=None):
+        """Like emit_param_change, for a move the desk reports as a fader
+        or pan CC (what the physical surface sends)."""
+        self._apply_cc(cc, value)
+        status = 0xB0 | ((self.midi_channel or 1) - 1)
+        self._send(bytes([status, cc, value]), self.clock() if now is None else now)
+
+    # -- protocol ----------------------------------------------------------
+
+    def accepts(self, device_byte):
+        return (self.midi_channel is None or device_byte == proto.DEVICE_BYTE_OMNI
+                or device_byte == self.device_byte)
+
+    def handle(self, msg):
+        """Applies one complete message; returns the frames to answer with.
+        Usable on its own to drive the protocol without the link model."""
+        self.stats["messages_in"] += 1
+        if msg[0] != 0xF0:
+            return self._handle_short(msg)
+        function = proto.sysex_function(msg)
+        if function is None or not self.accepts(msg[4]):
+            self.stats["ignored"] += 1
+            return []
+        handler = self._HANDLERS.get(function)
+        if handler is None:
+            if function & proto.REQUEST_BIT and function & ~proto.REQUEST_BIT in proto.DUMP_FUNCTIONS:
+                return self._handle_dump_request(msg)
+            if function in proto.DUMP_FUNCTIONS:
+                return self._handle_dump_block(msg)
+            self.stats["ignored"] += 1
+            return []
+        return handler(self, msg)
+
+    def _apply_cc(self, cc, value):
+        if proto.is_fader_cc(cc):
+            self.params[(proto.cc_to_channel_index(cc), proto.PARAM_VOLUME)] = \
+                value * VOLUME_RAW_MAX // CC_VALUE_MAX
+            return True
+        if proto.is_pan_cc(cc):
+            self.params[(proto.cc_to_channel_index(cc), proto.PARAM_PAN)] = value * 60 // CC_VALUE_MAX
+            return True
+        return False
+
+    def _handle_short(self, msg):
+        if len(msg) == 3 and msg[0] & 0xF0 == 0xB0 and self._apply_cc(msg[1], msg[2]):
+            self.stats["cc_writes"] += 1
+            return []
+        self.stats["ignored"] += 1
+        return []
+
+    def _handle_param_change(self, msg):
+        changes = proto.parse_param_change_sysex(msg)
+        for module, param, raw in changes:
+            self.params[(module, param)] = raw
+        self.stats["param_writes"] += len(changes)
+        return []
+
+    def _handle_attenuation(self, msg):
+        changes = proto.parse_attenuation_sysex(msg)
+        for channel, raw in changes:
+            group = self.mute_groups.get(channel)
+            if group is None:
+                members = (channel,)
+            else:
+                members = [ch for ch, g in self.mute_groups.items() if g == group]
+            for member in members:
+                self.params[(proto.MODULE_CHANNEL_BASE + member, proto.PARAM_VOLUME)] = raw
+        self.stats["attenuation_writes"] += len(changes)
+        return []
+
+    def _handle_connection_test(self, msg):
+        self.stats["connection_tests"] += 1
+        return [proto.build_connection_test_sysex(self.device_byte, request=False)]
+
+    def _handle_meter_request(self, msg):
+        self.stats["meter_requests"] += 1
+        for channel in range(proto.METER_INPUT_COUNT):
+            raw = self.params.get((proto.MODULE_CHANNEL_BASE + channel, proto.PARAM_VOLUME), 0)
+            self.meters[proto.METER_SLOT_INPUT_BASE + channel] = raw * proto.METER_LEVEL_MAX // VOLUME_RAW_MAX
+        return [proto.build_meter_data_sysex(0, self.meters, self.device_byte)]
+
+    _HANDLERS = {
+        proto.FUNC_PARAM_CHANGE: _handle_param_change,
+        proto.FUNC_CHANNEL_ATTENUATION: _handle_attenuation,
+        proto.REQUEST_BIT | proto.FUNC_CONNECTION_TEST: _handle_connection_test,
+        proto.REQUEST_BIT | proto.FUNC_METER_DATA: _handle_meter_request,
+    }
+
+    def _handle_dump_request(self, msg):
+        function, what, block = proto.parse_dump_request_sysex(msg)
+        key = (function, what)
+        data = self.files.get(key)
+        if data is None:
+            self.stats["ignored"] += 1
+            return []
+        total = proto.dump_block_count(len(data))
+        if block >= total:                     # ACK of the last block
+            self._sent_block.pop(key, None)
+            self.stats["dumps_sent"] += 1
+            return []
+        if self._sent_block.get(key) == block:
+            self.stats["resends"] += 1
+        self._sent_block[key] = block
+        self.stats["blocks_sent"] += 1
+        start = block * proto.DUMP_BLOCK_PAYLOAD
+        frame = proto.build_dump_block_sysex(function, total, block,
+                                             data[start:start + proto.DUMP_BLOCK_PAYLOAD],
+                                             what, device_byte=self.device_byte)
+        if self.corrupt_rate and self._rng.random() < self.corrupt_rate:
+            frame[-2] ^= 0x01
+            self.stats["corrupted"] += 1
+        return [frame]
+
+    def _handle_dump_block(self, msg):
+        function, what, _, total, block, payload, checksum_ok = proto.parse_dump_block_sysex(msg)
+        key = (function, what)
+        upload = self._uploads.get(key)
+        if upload is None or block == 0:
+            upload = self._uploads[key] = [bytearray(), 0]
+        if not checksum_ok or block != upload[1]:
+            self.stats["bad_checksums" if not checksum_ok else "out_of_order"] += 1
+            return [proto.build_dump_request_sysex(function, upload[1], what, self.device_byte)]
+        del upload[0][block * proto.DUMP_BLOCK_PAYLOAD:]
+        upload[0].extend(payload[:proto.DUMP_BLOCK_PAYLOAD])
+        upload[1] = block + 1
+        self.stats["blocks_received"] += 1
+        if upload[1] >= total:
+            self.files[key] = bytes(upload[0])
+            del self._uploads[key]
+            self.stats["dumps_received"] += 1
+        return [proto.build_dump_request_sysex(function, block + 1, what, self.device_byte)]
+
+
+class StreamEndpoint:
+    """Runs a VirtualDesk over a byte stream in real time: a reader thread
+    hands whatever arrives to the desk, a writer thread sends each response
+    once the link model says it would have arrived. read(n) returns b"" at
+    end of stream; write(data) sends everything."""
+
+    def __init__(self, desk, read, write):
+        self.desk = desk
+        self.read = read
+        self.write = write
+        self._cond = threading.Condition()
+        self._running = False
+        self._threads = []
+
+    def start(self):
+        self._running = True
+        self._threads = [threading.Thread(target=self._reader, daemon=True),
+                         threading.Thread(target=self._writer, daemon=True)]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+    def join(self, timeout=None):
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _reader(self):
+        while True:
+            try:
+                data = self.read(READ_CHUNK)
+            except OSError:
+                data = b""
+            with self._cond:
+                if not data or not self._running:
+                    self._running = False
+                    self._cond.notify_all()
+                    return
+                self.desk.receive(data)
+                self._cond.notify_all()
+
+    def _writer(self):
+        while True:
+            with self._cond:
+                while self._running:
+                    due = self.desk.next_due()
+                    now = self.desk.clock()
+                    if due is not None and due <= now:
+                        break
+                    self._cond.wait(None if due is None else due - now)
+                if not self._running:
+                    return
+                frames = self.desk.poll()
+            try:
+                self._emit(frames)
+            except OSError:
+                self.stop()
+                return
+
+    def _emit(self, frames):
+        for frame in frames:
+            self.write(frame)
+
+
+class TransportEndpoint(StreamEndpoint):
+    """Runs a VirtualDesk on the far end of a ddx3216_transport.Transport
+    (e.g. one side of LoopbackTransport.pair()). Frames the transport
+    delivers go to the desk as they arrive; responses go back through
+    send_frames() once due, as one batch per poll."""
+
+    def __init__(self, desk, transport):
+        StreamEndpoint.__init__(self, desk, None, None)
+        self.transport = transport
+
+    def start(self):
+        self._running = True
+        self.transport.on_frames = self._on_frames
+        self._threads = [threading.Thread(target=self._writer, daemon=True)]
+        self._threads[0].start()
+        return self
+
+    def _on_frames(self, frames):
+        with self._cond:
+            if not self._running:
+                return
+            for frame in frames:
+                self.desk.receive(frame)
+            self._cond.notify_all()
+
+    def _emit(self, frames):
+        if frames:
+            self.transport.send_frames(frames)
+
+
+class DeskClient:
+    """Host side of a stream to the emulator: send() writes raw bytes,
+    receive() returns the next complete message (bytes) or None on
+    timeout."""
+
+    def __init__(self, read, write, close=None):
+        self._read = read
+        self.write = write
+        self._close = close
+        self._messages = queue.Queue()
+        self._assembler = proto.SysExAssembler()
+        self._thread = threading.Thread(target=self._reader, daemon=True)
+        self._thread.start()
+
+    def _reader(self):
+        while True:
+            try:
+                data = self._read(READ_CHUNK)
+            except OSError:
+                data = b""
+            if not data:
+                self._messages.put(None)
+                return
+            for msg in self._assembler.feed(data):
+                self._messages.put(msg)
+
+    def send(self, data):
+        self.write(bytes(data))
+
+    def receive(self, timeout=None):
+        try:
+            return self._messages.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def request(self, data, timeout=5.0):
+        """send() then receive(): one round trip."""
+        self.send(data)
+        return self.receive(timeout)
+
+    def close(self):
+        if self._close is not None:
+            self._close()
+
+
+class TransportClient(DeskClient):
+    """DeskClient over any ddx3216_transport.Transport, so download(),
+    upload() and the self-tests run unchanged on serial, UDP or an
+    in-process loopback. Takes over the transport's on_frames."""
+
+    def __init__(self, transport):
+        self.transport = transport
+        self._messages = queue.Queue()
+        transport.on_frames = self._on_frames
+
+    def _on_frames(self, frames):
+        for frame in frames:
+            self._messages.put(frame)
+
+    def send(self, data):
+        self.transport.send(data)
+
+    def send_frames(self, frames):
+        self.transport.send_frames(frames)
+
+    def close(self):
+        self.transport.close()
+
+
+def open_loopback(desk):
+    """Runs `desk` on a pair of OS pipes. Returns (client, endpoint)."""
+    host_r, desk_w = os.pipe()
+    desk_r, host_w = os.pipe()
+    desk_out = os.fdopen(desk_w, "wb", buffering=0)
+    host_out = os.fdopen(host_w, "wb", buffering=0)
+    endpoint = StreamEndpoint(desk, lambda n: os.read(desk_r, n), desk_out.write).start()
+
+    def close():
+        host_out.close()
+        endpoint.join(1.0)
+        desk_out.close()
+        os.close(desk_r)
+
+    client = DeskClient(lambda n: os.read(host_r, n), host_out.write, close)
+    return client, endpoint
+
+
+def connect_tcp(host: str, port: int = DEFAULT_PORT) -> DeskClient:
+    sock = socket.create_connection((host, port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return DeskClient(sock.recv, sock.sendall, sock.close)
+
+
+def serve_tcp(desk, host: str = "127.0.0.1", port: int = DEFAULT_PORT):
+    """Serves `desk` to one TCP client at a time, forever."""
+    server = socket.create_server((host, port))
+    print(f"DDX3216 emulator listening on {host}:{port}")
+    while True:
+        conn, addr = server.accept()
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        print(f"  client {addr[0]}:{addr[1]} connected")
+        endpoint = StreamEndpoint(desk, conn.recv, conn.sendall).start()
+        endpoint.join()
+        endpoint.stop()
+        conn.close()
+        print(f"  client disconnected  {dict(desk.stats)}")
+
+
+def download(client: DeskClient, function: int, what: int = proto.DUMP_WHAT_UNKNOWN,
+             device_byte: int = proto.DEVICE_BYTE_OMNI, timeout: float = 5.0):
+    """Fetches a whole dump from the desk, retrying bad blocks. Returns the
+    decoded bytes (the last block still zero-padded to 7), or None."""
+    data = bytearray()
+    block = 0
+    total = 1
+    while block < total:
+        reply = client.request(proto.build_dump_request_sysex(function, block, what, device_byte),
+                               timeout)
+        parsed = reply and proto.parse_dump_block_sysex(reply)
+        if not parsed:
+            return None
+        _, _, _, total, index, payload, checksum_ok = parsed
+        if checksum_ok and index == block:
+            data.extend(payload[:proto.DUMP_BLOCK_PAYLOAD])
+            block += 1
+    client.send(proto.build_dump_request_sysex(function, block, what, device_byte))
+    return bytes(data)
+
+
+def upload(client: DeskClient, function: int, data: bytes, what: int = proto.DUMP_WHAT_UNKNOWN,
+           device_byte: int = proto.DEVICE_BYTE_OMNI, timeout: float = 5.0) -> bool:
+    """Sends a whole dump to the desk, following its block requests."""
+    total = proto.dump_block_count(len(data))
+    block = 0
+    while block < total:
+        start = block * proto.DUMP_BLOCK_PAYLOAD
+        frame = proto.build_dump_block_sysex(function, total, block,
+                                             data[start:start + proto.DUMP_BLOCK_PAYLOAD],
+                                             what, device_byte=device_byte)
+        reply = client.request(frame, timeout)
+        parsed = reply and proto.parse_dump_request_sysex(reply)
+        if not parsed:
+            return False
+        block = parsed[2]
+    return True
+
+
+def selftest(desk: VirtualDesk):
+    client, endpoint = open_loopback(desk)
+
+    def timed(label, fn):
+        t0 = time.perf_counter()
+        result = fn()
+        print(f"  {label:34} {(time.perf_counter() - t0) * 1000.0:9.1f} ms")
+        return result
+
+    print("=== DDX3216 emulator self-test (loopback pipe) ===")
+    timed("connection test", lambda: client.request(proto.build_connection_test_sysex()))
+    changes = [(ch, proto.PARAM_VOLUME, 1000 + ch) for ch in range(32)]
+    frames = proto.build_param_change_batch_sysex(changes)
+
+    def write_and_ping():
+        for frame in frames:
+            client.send(frame)
+        return client.request(proto.build_connection_test_sysex())
+
+    timed(f"32 fader writes ({len(frames)} frames) + ping", write_and_ping)
+    timed("meter request", lambda: client.request(proto.build_meter_request_sysex()))
+    settings = timed("settings download", lambda: download(client, proto.FUNC_DUMP_SETTINGS))
+    ok = timed("settings upload", lambda: upload(client, proto.FUNC_DUMP_SETTINGS, settings))
+    again = download(client, proto.FUNC_DUMP_SETTINGS)
+    print(f"  upload ok={ok}  round trip identical={again == settings}  "
+          f"fader state ok={all(desk.params.get((m, p)) == r for m, p, r in changes)}")
+    client.close()
+    endpoint.stop()
+    print(f"  stats: {dict(sorted(desk.stats.items()))}")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    tcp = None
+    channel = None
+    bps = MIDI_BYTES_PER_SECOND
+    delay = DEFAULT_PROCESSING_DELAY
+    corrupt = 0.0
+    run_selftest = False
+    it = iter(args)
+    for a in it:
+        if a == "--tcp":
+            tcp = cli.option_value(it, a, __doc__)
+        elif a == "--channel":
+            channel = cli.int_option(it, a, __doc__)
+        elif a == "--bps":
+            bps = cli.int_option(it, a, __doc__)
+        elif a == "--delay":
+            delay = cli.float_option(it, a, __doc__) / 1000.0
+        elif a == "--corrupt":
+            corrupt = cli.float_option(it, a, __doc__)
+        elif a == "--selftest":
+            run_selftest = True
+        else:
+            print(__doc__)
+            sys.exit(1)
+    desk = VirtualDesk(channel, bps, delay, corrupt_rate=corrupt)
+    if run_selftest:
+        selftest(desk)
+    elif tcp:
+        host, _, port = tcp.rpartition(":")
+        serve_tcp(desk, host or "127.0.0.1", int(port))
+    else:
+        print(__doc__)
+        sys.exit(1)
@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+ddx3216_fl_harness.py
+
+Runs an FL Studio device script (device_DDX3216.py, device_DDX3216_daw2.py)
+outside FL Studio, on the API stubs in fl_stubs/, and replays callback
+sequences into it at controlled rates -- so per-callback CPU cost and MIDI
+output can be measured and compared between revisions.
+
+Events are (time, callback, args) tuples, merged from generators:
+
+  * faders: physical fader moves arriving as CCs (OnMidiMsg);
+  * sysex:  the same moves as 0x20 parameter-change frames;
+  * mixer:  FL-side automation moving mixer volumes, which comes back to
+            the script as OnDirtyMixerTrack the way FL delivers it;
+  * idle / refresh / meters: OnIdle, OnRefresh and OnUpdateMeters at their
+            own rates;
+
+or read from a JSON-lines file of {"t": s, "cb": "OnMidiMsg", "msg": "b0 01 40"}
+records ("args": [...] for other callbacks). After every callback, mixer
+tracks the script dirtied are delivered as OnDirtyMixerTrack calls plus one
+OnRefresh, as FL does.
+
+With --desk the script's output goes through the desk emulator
+(ddx3216_desk_emulator.py) in harness time, and the desk's answers are fed
+back as OnMidiMsg, so link saturation shows up as backlog.
+
+--speed 1 paces events in real time; the default 0 runs them back to back.
+Either way harness time advances per event, and after OnInit the script's
+OutputScheduler is switched to harness time too, so its byte budget refills
+at the replay's pace and the output counts match what the link would carry.
+
+Usage:
+    python3 ddx3216_fl_harness.py SCRIPT.py [--scenario faders,idle,...]
+        [--duration S] [--fader-rate HZ] [--mixer-rate HZ] [--idle-rate HZ]
+        [--refresh-rate HZ] [--meter-rate HZ] [--channels N] [--speed X]
+        [--events FILE] [--desk] [--json OUT]
+"""
+
+import os
+import sys
+import json
+import time
+import heapq
+import types
+import importlib.util
+
+import ddx3216_cli as cli
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+STUB_DIR = os.path.join(_HERE, "fl_stubs")
+SCRIPT_DIR = os.path.join(_HERE, "..", "FLStudioMidiScript", "FLStudio_DDX3216")
+sys.path.insert(0, SCRIPT_DIR)
+sys.path.insert(0, STUB_DIR)
+import _flstub  # noqa: E402
+import midi  # noqa: E402
+import mixer  # noqa: E402
+import ddx3216_protocol as proto  # noqa: E402
+from ddx3216_scheduler import MIDI_BYTES_PER_SECOND, OutputScheduler  # noqa: E402
+
+DEFAULT_SCENARIO = ("faders", "idle", "refresh", "meters")
+DEFAULT_DURATION = 10.0
+DEFAULT_RATES = {"faders": 200.0, "sysex": 200.0, "mixer": 50.0,
+                 "idle": 50.0, "refresh": 10.0, "meters": 20.0}
+DEFAULT_CHANNELS = 8
+MIXER_EVENT = "@mixer"       # pseudo-callback: FL-side mixer change
+
+_loaded = 0
+
+
+class FlMidiMsg:
+    """Stand-in for the event object FL passes to OnMidiMsg."""
+
+    def __init__(self, status, data1=0, data2=0, sysex=None, port=0):
+        self.status = status
+        self.data1 = data1
+        self.data2 = data2
+        self.sysex = sysex
+        self.port = port
+        self.handled = False
+        self.midiId = status & 0xF0 if status < 0xF0 else status
+        self.midiChan = status & 0x0F if status < 0xF0 else 0
+        self.midiChanEx = self.midiChan
+        self.inEv = data2
+        self.outEv = data2
+        self.isIncrement = False
+        self.res = midi.EKRes
+        self.pmeFlags = midi.PME_System | midi.PME_System_Safe | midi.PME_LiveInput
+        self.timestamp = _flstub.now
+
+    @property
+    def note(self):
+        return self.data1
+
+    @property
+    def velocity(self):
+        return self.data2
+
+    @property
+    def controlNum(self):
+        return self.data1
+
+    @property
+    def controlVal(self):
+        return self.data2
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = bytes(data)
+        if data[0] == 0xF0:
+            return cls(midi.MIDI_SYSEX, sysex=data)
+        return cls(data[0], data[1] if len(data) > 1 else 0, data[2] if len(data) > 2 else 0)
+
+
+def load_script(path: str):
+    """Imports a device script against the stubs under a fresh name."""
+    global _loaded
+    _loaded += 1
+    name = f"_harness_script_{_loaded}"
+    spec = importlib.util.spec_from_file_location(name, os.path.abspath(path))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def use_harness_clock(script) -> int:
+    """Points the OutputSchedulers a loaded script holds (as module globals
+    or attributes of them) at harness time. Returns how many were found."""
+    found = 0
+    for value in list(vars(script).values()):
+        if isinstance(value, (type, types.ModuleType)):
+            continue
+        for candidate in [value] + list(getattr(value, "__dict__", {}).values()):
+            if isinstance(candidate, OutputScheduler):
+                candidate.clock = lambda: _flstub.now
+                found += 1
+    return found
+
+
+def _triangle(step: int, top: int) -> int:
+    step %= 2 * top
+    return step if step <= top else 2 * top - step
+
+
+def fader_cc_events(rate: float, duration: float, channels: int = DEFAULT_CHANNELS):
+    """Physical fader moves as CCs, round-robin over `channels` faders."""
+    for i in range(int(rate * duration)):
+        channel = i % channels
+        value = _triangle(i // channels + channel * 8, 127)
+        yield (i / rate, "OnMidiMsg",
+               (FlMidiMsg(midi.MIDI_CONTROLCHANGE, proto.fader_cc_for_channel(channel), value),))
+
+
+def fader_sysex_events(rate: float, duration: float, channels: int = DEFAULT_CHANNELS):
+    """Physical fader moves as 0x20 parameter-change frames."""
+    for i in range(int(rate * duration)):
+        channel = i % channels
+        raw = _triangle((i // channels) * 16 + channel * 64, 1472)
+        frame = proto.build_param_change_sysex(proto.MODULE_CHANNEL_BASE + channel,
+                                               proto.PARAM_VOLUME, raw)
+        yield i / rate, "OnMidiMsg", (FlMidiMsg.from_bytes(frame),)
+
+
+def mixer_events(rate: float, duration: float, channels: int = DEFAULT_CHANNELS):
+    """FL-side automation of the first `channels` mixer tracks."""
+    for i in range(int(rate * duration)):
+        track = 1 + i % channels
+        yield i / rate, MIXER_EVENT, (track, _triangle(i // channels, 100) / 100.0)
+
+
+def periodic_events(callback: str, rate: float, duration: float, args=()):
+    for i in range(int(rate * duration)):
+        yield i / rate, callback, args
+
+
+def scenario_events(names, duration: float, rates: dict, channels: int = DEFAULT_CHANNELS):
+    """Merges the named generators into one time-ordered stream."""
+    streams = []
+    for name in names:
+        rate = rates[name]
+        if name == "faders":
+            streams.append(fader_cc_events(rate, duration, channels))
+        elif name == "sysex":
+            streams.append(fader_sysex_events(rate, duration, channels))
+        elif name == "mixer":
+            streams.append(mixer_events(rate, duration, channels))
+        elif name == "idle":
+            streams.append(periodic_events("OnIdle", rate, duration))
+        elif name == "refresh":
+            streams.append(periodic_events("OnRefresh", rate, duration,
+                                           (midi.HW_Dirty_Mixer_Display | midi.HW_Dirty_Mixer_Controls,)))
+        elif name == "meters":
+            streams.append(periodic_events("OnUpdateMeters", rate, duration))
+        else:
+            raise ValueError(f"unknown scenario {name!r}")
+    return heapq.merge(*streams, key=lambda event: event[0])
+
+
+def read_events(path: str):
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if "msg" in record:
+                args = (FlMidiMsg.from_bytes(bytes.fromhex(record["msg"])),)
+            else:
+                args = tuple(record.get("args", ()))
+            yield record["t"], record["cb"], args
+
+
+class Harness:
+    """Drives one loaded script and keeps per-callback timings."""
+
+    def __init__(self, script, desk=None):
+        self.script = script
+        self.desk = desk
+        self.wall = proto.LatencyTracker(enabled=True)
+        self.cpu = {}
+        self.events = 0
+        self.elapsed = 0.0
+        self.duration = 0.0
+        if desk is not None:
+            _flstub.sinks.append(lambda data: desk.receive(data, _flstub.now))
+
+    def call(self, name: str, *args):
+        fn = getattr(self.script, name, None)
+        if fn is None:
+            return
+        c0 = time.process_time()
+        w0 = time.perf_counter()
+        fn(*args)
+        self.wall.record(name, time.perf_counter() - w0)
+        self.cpu[name] = self.cpu.get(name, 0.0) + time.process_time() - c0
+
+    def deliver_dirty(self):
+        tracks = _flstub.take_dirty()
+        for track in tracks:
+            self.call("OnDirtyMixerTrack", track)
+        if tracks:
+            self.call("OnRefresh", midi.HW_Dirty_Mixer_Controls)
+
+    def dispatch(self, name: str, args):
+        if name == MIXER_EVENT:
+            mixer.setTrackVolume.__wrapped__(*args)
+        else:
+            self.call(name, *args)
+        self.deliver_dirty()
+
+    def run(self, events, speed: float = 0.0):
+        start = time.perf_counter()
+        t = 0.0
+        for t, name, args in events:
+            if speed:
+                delay = start + t / speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            _flstub.now = t
+            if self.desk is not None:
+                for frame in self.desk.poll(t):
+                    self.dispatch("OnMidiMsg", (FlMidiMsg.from_bytes(frame),))
+            self.dispatch(name, args)
+            self.events += 1
+        self.elapsed += time.perf_counter() - start
+        self.duration = max(self.duration, t)
+
+    def init(self):
+        self.call("OnInit")
+        use_harness_clock(self.script)
+        self.deliver_dirty()
+
+    def reset(self):
+        """Forgets timings and stub counters, e.g. after OnInit."""
+        self.wall.reset()
+        self.cpu.clear()
+        self.events = 0
+        self.elapsed = 0.0
+        self.duration = 0.0
+        _flstub.reset()
+
+    def deinit(self):
+        self.call("OnDeInit")
+
+    def summary(self) -> dict:
+        callbacks = {}
+        for name, ring in sorted(self.wall.paths.items()):
+            callbacks[name] = {
+                "calls": ring.count,
+                "cpu_ms": self.cpu.get(name, 0.0) * 1000.0,
+                "mean_us": self.cpu.get(name, 0.0) / ring.count * 1e6,
+                "p50_us": ring.percentile(50) * 1e6,
+                "p99_us": ring.percentile(99) * 1e6,
+                "max_us": ring.max * 1e6,
+            }
+        out = dict(_flstub.output)
+        wire = out["sysex_bytes"] + out["short_bytes"]
+        result = {
+            "events": self.events,
+            "duration_s": self.duration,
+            "elapsed_s": self.elapsed,
+            "callbacks": callbacks,
+            "output": out,
+            "wire_bytes_per_s": wire / self.duration if self.duration else 0.0,
+            "api_calls": [[name, calls, seconds * 1000.0] for name, calls, seconds in _flstub.call_rows()],
+        }
+        if self.desk is not None:
+            result["desk"] = dict(self.desk.stats)
+            result["desk_backlog_s"] = max(0.0, self.desk.rx.busy_until - self.duration)
+        return result
+
+
+def print_summary(script_path: str, result: dict, api_rows: int = 15):
+    print(f"=== FL harness: {os.path.basename(script_path)} ===")
+    print(f"events: {result['events']}  over {result['duration_s']:.2f} s harness time  "
+          f"({result['elapsed_s']:.2f} s wall)")
+    print(f"  {'callback':20} {'calls':>8} {'cpu ms':>9} {'mean us':>9} "
+          f"{'p50 us':>9} {'p99 us':>9} {'max us':>9}")
+    for name, row in result["callbacks"].items():
+        print(f"  {name:20} {row['calls']:8} {row['cpu_ms']:9.1f} {row['mean_us']:9.1f} "
+              f"{row['p50_us']:9.1f} {row['p99_us']:9.1f} {row['max_us']:9.1f}")
+    out = result["output"]
+    print(f"output: {out['sysex_frames']} SysEx frames ({out['sysex_bytes']} bytes), "
+          f"{out['short_msgs']} short messages ({out['short_bytes']} bytes), "
+          f"midiOutNewMsg {out['new_msgs_sent']} sent / {out['new_msgs_suppressed']} suppressed")
+    print(f"wire rate: {result['wire_bytes_per_s']:.0f} bytes/s "
+          f"({result['wire_bytes_per_s'] / MIDI_BYTES_PER_SECOND * 100.0:.0f}% of a MIDI link)")
+    if "desk" in result:
+        print(f"desk: {result['desk']}  backlog at end: {result['desk_backlog_s'] * 1000.0:.0f} ms")
+    print(f"FL API calls (top {api_rows}):")
+    for name, calls, ms in result["api_calls"][:api_rows]:
+        print(f"  {name:32} {calls:8} {ms:9.2f} ms")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    scripts = []
+    scenario = DEFAULT_SCENARIO
+    duration = DEFAULT_DURATION
+    rates = dict(DEFAULT_RATES)
+    channels = DEFAULT_CHANNELS
+    speed = 0.0
+    events_path = None
+    use_desk = False
+    json_out = None
+    it = iter(args)
+    for a in it:
+        if a == "--scenario":
+            scenario = tuple(cli.option_value(it, a, __doc__).split(","))
+        elif a == "--duration":
+            duration = cli.float_option(it, a, __doc__)
+        elif a.endswith("-rate") and a[2:-5] in rates:
+            rates[a[2:-5]] = cli.float_option(it, a, __doc__)
+        elif a == "--fader-rate":
+            rates["faders"] = rates["sysex"] = cli.float_option(it, a, __doc__)
+        elif a == "--meter-rate":
+            rates["meters"] = cli.float_option(it, a, __doc__)
+        elif a == "--channels":
+            channels = cli.int_option(it, a, __doc__)
+        elif a == "--speed":
+            speed = cli.float_option(it, a, __doc__)
+        elif a == "--events":
+            events_path = cli.option_value(it, a, __doc__)
+        elif a == "--desk":
+            use_desk = True
+        elif a == "--json":
+            json_out = cli.option_value(it, a, __doc__)
+        else:
+            scripts.append(a)
+    if len(scripts) != 1:
+        print(__doc__)
+        sys.exit(1)
+
+    desk = None
+    if use_desk:
+        import ddx3216_desk_emulator
+        desk = ddx3216_desk_emulator.VirtualDesk(clock=lambda: _flstub.now)
+    harness = Harness(load_script(scripts[0]), desk)
+    harness.init()
+    harness.reset()
+    events = read_events(events_path) if events_path else scenario_events(scenario, duration, rates, channels)
+    harness.run(events, speed)
+    result = harness.summary()
+    harness.deinit()
+    print_summary(scripts[0], result)
+    if json_out:
+        with open(json_out, "w") as f:
+            json.dump(result, f, indent=2)
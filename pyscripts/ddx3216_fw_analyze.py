@@ -8,7 +8,8 @@ What it does:
   1. Reports file size + header/tail bytes.
   2. Computes block entropy (4KB windows) to flag likely code vs data vs
      padding/blank regions (useful before pointing a disassembler at it).
-  3. Extracts embedded ASCII strings.
+  3. Extracts embedded ASCII strings with their offsets, telling plain runs
+     from null-terminated and length-prefixed (LCD-style) ones.
   4. Applies a light "de-vowel" heuristic: many embedded/POST-era firmware
      strip vowels from debug strings to save ROM space (confirmed in the
      DDX3216 flash images -- e.g. "GNRLERR!!" = "GENERAL ERR!!"). This just
@@ -16,38 +17,430 @@ What it does:
      reconstruction (too many false positives for that).
 
 Usage:
-    python3 ddx3216_fw_analyze.py <file1.bin> [file2.bin ...]
-    python3 ddx3216_fw_analyze.py --diff <fileA.bin> <fileB.bin>   # byte-diff two same-size images
+    python3 ddx3216_fw_analyze.py [--jobs N] [--json out.json] [--csv out.csv] [--all-strings] <file1.bin> [file2.bin ...]
+    python3 ddx3216_fw_analyze.py --diff [--align] <fileA.bin> <fileB.bin>   # byte-diff two images
+    python3 ddx3216_fw_analyze.py --sweep <window> <step> <file.bin>  # sliding-window entropy
+    python3 ddx3216_fw_analyze.py --strings [--base N] <file.bin>   # every string + Z80 code refs
+    python3 ddx3216_fw_analyze.py --compare [--chunk N] <file1.bin> <file2.bin> [file3.bin ...]
+        # N-way similarity matrix + shared/moved/unique regions
+    python3 ddx3216_fw_analyze.py --selftest
+
+    Analysis and --diff accept --cache DIR / --no-cache / --cache-size MB
+    anywhere on the command line.
+
+Several files are analysed in parallel on a process pool (--jobs, default
+one per core) and reported in the order given; --json/--csv also write the
+structured results (entropy profile, word-like strings, de-voweled
+candidates) for every file.
+
+--compare splits every image into chunks -- content-defined by default, so
+an insertion only disturbs the chunks around it; --chunk N for fixed N-byte
+chunks -- hashes them into one index, and derives everything from that index
+in a single pass over the data: a byte-weighted similarity matrix and, for
+every image relative to the one before it on the command line, which regions
+are unchanged, moved, shared with some other image, or unique.
+
+Per-file analyses and diffs are cached on disk (default
+~/.cache/ddx3216_fw_analyze), keyed by the SHA-256 of the image contents and
+ANALYZER_VERSION, so re-running over an unchanged archive only hashes the
+files; new or changed images are the only ones re-analysed. The cache is
+trimmed least-recently-used first once it grows past --cache-size.
+
+Images are memory-mapped read-only rather than read into memory, and every
+stage (entropy, strings, diff) works on the mapping directly, so peak memory
+doesn't grow with image size or with the number of files in a batch.
+
+Entropy is computed with NumPy when it's installed (block histograms come from
+batched bincounts over a strided view) and in plain Python otherwise.
 """
 
+import os
 import sys
 import re
+import csv
+import json
 import math
+import mmap
 import collections
+import contextlib
+import hashlib
+import pickle
+import random
+import bisect
+from concurrent.futures import ProcessPoolExecutor
+
+import ddx3216_cli as cli
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# bytes of int64 index array built per bincount call when sweeping: each
+# batch holds rows * window entries of 8 bytes, so rows are capped to fit
+# (at least one window, which costs 8 * window bytes on its own)
+SWEEP_BATCH_BYTES = 32 * 1024 * 1024
+
+# bump whenever analysis/diff output changes shape or meaning, so stale cache
+# entries are ignored
+ANALYZER_VERSION = 2
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "ddx3216_fw_analyze")
+DEFAULT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+
+@contextlib.contextmanager
+def open_image(path: str):
+    """Yields a read-only, bytes-like view of the file at `path`: an mmap
+    (indexable, sliceable, .find(), buffer protocol for NumPy/re), or b""
+    for an empty file, which can't be mapped."""
+    with open(path, "rb") as f:
+        if f.seek(0, 2) == 0:
+            yield b""
+            return
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield mapped
+        finally:
+            try:
+                mapped.close()
+            except BufferError:
+                pass   # a caller still holds a view; the GC unmaps it later
+
+
+def content_hash(data) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_hash(path: str) -> str:
+    with open_image(path) as data:
+        return content_hash(data)
+
+
+class ResultCache:
+    """On-disk cache: one file per (kind, key) under `directory` -- JSON for
+    get()/put(), pickle for get_object()/put_object() (parsed stores that
+    aren't plain JSON, e.g. the Z80 listing index).
+
+    Entry mtimes double as LRU timestamps -- get() touches the entry -- and
+    put() deletes the least recently used entries once the directory
+    holds more than max_bytes. Unreadable or corrupt entries count as
+    misses."""
+
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, kind: str, key: str, ext: str = "json") -> str:
+        return os.path.join(self.directory, f"{kind}-v{ANALYZER_VERSION}-{key}.{ext}")
+
+    def get(self, kind: str, key: str):
+        path = self._path(kind, key)
+        try:
+            with open(path) as f:
+                value = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def put(self, kind: str, key: str, value):
+        self._write(self._path(kind, key), json.dumps(value, separators=(",", ":")).encode())
+
+    def get_object(self, kind: str, key: str):
+        path = self._path(kind, key, "pickle")
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+            os.utime(path)
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError,
+                AttributeError, ImportError):
+            # AttributeError/ImportError (ModuleNotFoundError included): the
+            # entry names a class this process can't import, e.g. one pickled
+            # from another script's __main__
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def put_object(self, kind: str, key: str, value):
+        self._write(self._path(kind, key, "pickle"), pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+    def _write(self, path: str, payload: bytes):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(payload)
+        os.replace(tmp, path)
+        self.evict()
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits max_bytes."""
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith((".json", ".pickle")):
+                    continue
+                st = entry.stat()
+                entries.append((st.st_mtime_ns, st.st_size, entry.path))
+                total += st.st_size
+        if total <= self.max_bytes:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
 
 
 def entropy(chunk: bytes) -> float:
     if not chunk:
         return 0.0
+    if np is not None:
+        return float(_entropy_from_counts(np.bincount(np.frombuffer(chunk, dtype=np.uint8),
+                                                      minlength=256)[None, :],
+                                          len(chunk))[0])
     counts = collections.Counter(chunk)
     n = len(chunk)
     return -sum((v / n) * math.log2(v / n) for v in counts.values())
 
 
-def block_entropy_report(data: bytes, block_size: int = 4096, max_blocks: int = 64):
-    print(f"  overall entropy: {entropy(data):.3f} bits/byte  (8.0 = random/compressed/encrypted, "
-          f"~4-5 = text, ~5.5-6.5 = typical machine code, near 0 = padding/blank)")
-    step = max(block_size, len(data) // max_blocks) if len(data) > block_size * max_blocks else block_size
-    print(f"  block entropy (window={step} bytes):")
-    for i in range(0, len(data), step):
-        chunk = data[i:i + step]
-        e = entropy(chunk)
-        bar = "#" * int(e / 8 * 40)
-        print(f"    0x{i:07x}  {e:5.2f}  {bar}")
+def _entropy_from_counts(counts, n):
+    """counts: (rows, 256) byte histograms of n-byte windows -> (rows,)
+    entropies in bits/byte. Uses H = log2(n) - sum(c*log2(c))/n."""
+    c = counts.astype(np.float64)
+    clog = np.zeros_like(c)
+    np.log2(c, out=clog, where=c > 0)
+    return np.log2(n) - (c * clog).sum(axis=1) / n
+
+
+def _window_histograms(arr, window: int, step: int, rows: int):
+    """Byte histograms of arr[r*step : r*step + window] for r in range(rows),
+    via one bincount over a strided (rows, window) view with each row's
+    values offset by row*256. The view itself copies nothing."""
+    view = np.lib.stride_tricks.sliding_window_view(arr, window)[::step][:rows]
+    rows = view.shape[0]
+    idx = view + (np.arange(rows, dtype=np.int64) * 256)[:, None]
+    return np.bincount(idx.ravel(), minlength=rows * 256).reshape(rows, 256)
+
+
+def block_entropies(data: bytes, block_size: int = 4096, step: int = None):
+    """Entropy of data[i:i + block_size] for i = 0, step, 2*step, ...
+
+    step defaults to block_size (non-overlapping blocks; the last block may
+    be short, as in the report). With step < block_size the windows overlap
+    and only full windows are returned. Returns a list of (offset, entropy).
+    """
+    if step is None:
+        step = block_size
+    n = len(data)
+    if n == 0:
+        return []
+    if n < block_size:
+        return [(0, entropy(data))]
+
+    if np is None:
+        return _block_entropies_python(data, block_size, step)
+
+    arr = np.frombuffer(data, dtype=np.uint8)
+    full = (n - block_size) // step + 1
+    results = []
+    batch_rows = max(1, SWEEP_BATCH_BYTES // (block_size * 8))
+    for first in range(0, full, batch_rows):
+        rows = min(batch_rows, full - first)
+        sub = arr[first * step:]
+        ents = _entropy_from_counts(_window_histograms(sub, block_size, step, rows), block_size)
+        results.extend(zip(range(first * step, (first + rows) * step, step), ents.tolist()))
+    if step >= block_size:
+        # trailing short block, as the report has always shown it
+        for o in range(full * step, n, step):
+            results.append((o, entropy(data[o:o + block_size])))
+    return results
+
+
+def _block_entropies_python(data: bytes, block_size: int, step: int):
+    n = len(data)
+    if step >= block_size:
+        return [(i, entropy(data[i:i + block_size])) for i in range(0, n, step)]
+
+    # overlapping windows: slide one histogram along instead of recounting
+    counts = [0] * 256
+    for b in data[:block_size]:
+        counts[b] += 1
+    log2n = math.log2(block_size)
+    results = []
+    pos = 0
+    while True:
+        results.append((pos, log2n - sum(c * math.log2(c) for c in counts if c) / block_size))
+        nxt = pos + step
+        if nxt + block_size > n:
+            break
+        for b in data[pos:nxt]:
+            counts[b] -= 1
+        for b in data[pos + block_size:nxt + block_size]:
+            counts[b] += 1
+        pos = nxt
+    return results
+
+
+def report_window(size: int, block_size: int = 4096, max_blocks: int = 64) -> int:
+    """Entropy window used by the per-file report: block_size, widened so
+    that big images still fit in about max_blocks lines."""
+    return max(block_size, size // max_blocks) if size > block_size * max_blocks else block_size
+
+
+def entropy_sweep_report(path: str, window: int, step: int):
+    with open_image(path) as data:
+        print(f"\n=== entropy sweep {path} (window={window}, step={step}) ===")
+        for i, e in block_entropies(data, window, step):
+            bar = "#" * int(e / 8 * 40)
+            print(f"    0x{i:07x}  {e:5.2f}  {bar}")
+
+
+STRING_SCAN_CHUNK = 1 << 16
+
+STRING_ASCII = "ascii"      # printable run with no recognisable framing
+STRING_CSTRING = "cstring"  # followed by a 0x00 terminator
+STRING_PASCAL = "pascal"    # preceded by its own length byte (LCD text tables)
+
+
+def scan_strings(data, min_len: int = 5, chunk_size: int = STRING_SCAN_CHUNK):
+    """Yields (offset, string, kind) for every printable ASCII run of at
+    least min_len bytes, in offset order.
+
+    `data` is scanned chunk_size bytes at a time through a memoryview, so
+    the regex never sees more than about one chunk at once; a run still
+    open at the end of a chunk is carried into the next one. A run whose
+    preceding byte equals its length is taken to be length-prefixed; one
+    followed by 0x00 to be null-terminated."""
+    pattern = re.compile(rb"[\x20-\x7e]{%d,}" % min_len)
+    view = memoryview(data)
+    n = len(view)
+    start = 0
+    while start < n:
+        end = min(n, start + chunk_size)
+        # a printable tail may continue past the chunk: leave it (even if
+        # it's still shorter than min_len) for the next round
+        resume = end
+        if end < n:
+            while resume > start and 0x20 <= view[resume - 1] <= 0x7E:
+                resume -= 1
+        for m in pattern.finditer(view[start:resume]):
+            yield _classify_run(view, start + m.start(), m.group())
+        if resume == start:
+            # one run longer than a whole chunk: widen until it closes
+            end = start + chunk_size
+            while end < n and 0x20 <= view[end] <= 0x7E:
+                end += 1
+            yield _classify_run(view, start, bytes(view[start:end]))
+            resume = end
+        start = resume
+
+
+def _classify_run(view, offset: int, run: bytes):
+    after = offset + len(run)
+    if offset > 0 and view[offset - 1] == len(run):
+        return offset, run, STRING_PASCAL
+    if after < len(view) and view[after] == 0:
+        return offset, run, STRING_CSTRING
+    return offset, run, STRING_ASCII
 
 
 def extract_strings(data: bytes, min_len: int = 5):
-    return re.findall(rb"[\x20-\x7e]{%d,}" % min_len, data)
+    return [s for _, s, _ in scan_strings(data, min_len)]
+
+
+# Z80 16-bit immediate loads that typically point at string data:
+# LD BC/DE/HL,nn and LD IX/IY,nn
+_Z80_LD_IMM16 = re.compile(rb"(?=([\x01\x11\x21]|[\xdd\xfd]\x21)(..))", re.DOTALL)
+_Z80_INDEX_PREFIXES = (0xDD, 0xFD)
+
+
+class StringIndex:
+    """Strings of one image by offset, plus which code addresses refer to
+    them. Lookups: at(offset) finds the string containing an offset
+    (O(log n)), find(text) every offset of an exact string (O(1)),
+    refs_to(offset) the code addresses recorded against a string."""
+
+    def __init__(self, entries=()):
+        self.offsets = []
+        self.strings = []
+        self.kinds = []
+        self._by_text = collections.defaultdict(list)
+        self._refs = collections.defaultdict(list)
+        for offset, text, kind in entries:
+            self.add(offset, text, kind)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def add(self, offset: int, text: bytes, kind: str):
+        """Entries must arrive in offset order (as scan_strings yields them)."""
+        self.offsets.append(offset)
+        self.strings.append(text)
+        self.kinds.append(kind)
+        self._by_text[text].append(offset)
+
+    def at(self, offset: int):
+        """(start, string, kind) of the string covering `offset`, or None."""
+        i = bisect.bisect_right(self.offsets, offset) - 1
+        if i >= 0 and offset < self.offsets[i] + len(self.strings[i]):
+            return self.offsets[i], self.strings[i], self.kinds[i]
+        return None
+
+    def find(self, text: bytes):
+        return self._by_text.get(text, [])
+
+    def add_reference(self, string_offset: int, code_address: int):
+        self._refs[string_offset].append(code_address)
+
+    def refs_to(self, string_offset: int):
+        return self._refs.get(string_offset, [])
+
+    def referenced(self):
+        """Offsets of strings with at least one recorded reference."""
+        return sorted(self._refs)
+
+
+def find_code_references(data, index: StringIndex, base: int = 0) -> int:
+    """Scans `data` for Z80 16-bit immediate loads whose operand is the
+    start of a string in `index` (as a CPU address: image offset + base)
+    and records them with index.add_reference(). Returns how many were
+    found. Finds candidates only -- a matching operand in data that isn't
+    code is counted too."""
+    starts = set(index.offsets)
+    found = 0
+    for m in _Z80_LD_IMM16.finditer(data):
+        p = m.start()
+        if data[p] == 0x21 and p > 0 and data[p - 1] in _Z80_INDEX_PREFIXES:
+            continue            # the 21 of an LD IX/IY,nn already matched at its prefix
+        target = int.from_bytes(m.group(2), "little") - base
+        if target in starts:
+            index.add_reference(target, p + base)
+            found += 1
+    return found
+
+
+def strings_report(path: str, base: int = 0):
+    with open_image(path) as data:
+        index = StringIndex(scan_strings(data))
+        found = find_code_references(data, index, base)
+    kinds = collections.Counter(index.kinds)
+    print(f"\n=== strings {path} ===")
+    print(f"  {len(index)} strings ({', '.join(f'{k} {kinds[k]}' for k in sorted(kinds))}), "
+          f"{found} candidate code references (base {base:#x})")
+    for offset, text, kind in zip(index.offsets, index.strings, index.kinds):
+        refs = index.refs_to(offset)
+        xref = "  <- " + ", ".join(f"{a:#06x}" for a in refs) if refs else ""
+        print(f"    0x{offset:07x}  {kind:7}  {text.decode('ascii')}{xref}")
 
 
 def wordlike(strings):
@@ -66,72 +459,581 @@ def looks_devoweled(s: bytes) -> bool:
     return (vowel_count / len(letters)) < 0.15
 
 
-def analyze_file(path: str):
-    with open(path, "rb") as f:
-        data = f.read()
-
-    print(f"\n=== {path} ===")
-    print(f"  size: {len(data)} bytes")
-    print(f"  head: {data[:32].hex()}")
-    print(f"  tail: {data[-32:].hex()}")
+DEVOWELED_SHOW_LIMIT = 60
 
-    block_entropy_report(data)
 
-    strings = extract_strings(data)
+def analyze_data(data, path: str = "") -> dict:
+    """Everything the per-file report shows, as plain JSON-able values."""
+    window = report_window(len(data))
+    found = list(scan_strings(data))
+    strings = [text for _, text, _ in found]
     words = wordlike(strings)
-    print(f"  strings found: {len(strings)} total, {len(words)} word-like")
-
-    devoweled = [s for s in words if looks_devoweled(s)]
-    print(f"  likely de-voweled debug/POST strings ({len(devoweled)}):")
-    seen = set()
-    shown = 0
-    for s in devoweled:
-        if s in seen:
-            continue
-        seen.add(s)
-        print(f"    {s.decode('ascii', 'replace')}")
-        shown += 1
-        if shown >= 60:
-            print("    ... (truncated, raise the limit in-script if you need more)")
+    first_seen = {}
+    for offset, text, _ in found:
+        first_seen.setdefault(text, offset)
+    unique_words = list(dict.fromkeys(words))
+    return {
+        "path": path,
+        "size": len(data),
+        "head": data[:32].hex(),
+        "tail": data[-32:].hex(),
+        "entropy": entropy(data),
+        "entropy_window": window,
+        "entropy_profile": [[i, round(e, 4)] for i, e in block_entropies(data, window)],
+        "strings_total": len(strings),
+        "string_kinds": dict(collections.Counter(kind for _, _, kind in found)),
+        "wordlike_total": len(words),
+        "wordlike": [w.decode("ascii", "replace") for w in unique_words],
+        "devoweled_total": sum(1 for s in words if looks_devoweled(s)),
+        "devoweled": [[first_seen[w], w.decode("ascii")] for w in unique_words if looks_devoweled(w)],
+    }
+
+
+def analyze_image(path: str) -> dict:
+    """analyze_data() for a file; errors are returned, not raised, so one
+    bad file doesn't sink a batch."""
+    try:
+        with open_image(path) as data:
+            return analyze_data(data, path)
+    except OSError as e:
+        return {"path": path, "error": str(e)}
+
+
+def print_analysis(result: dict, devoweled_limit: int = DEVOWELED_SHOW_LIMIT):
+    """Prints the report for one analyze_data() result; devoweled_limit=None
+    lists every de-voweled candidate."""
+    print(f"\n=== {result['path']} ===")
+    if "error" in result:
+        print(f"  error: {result['error']}")
+        return
+    print(f"  size: {result['size']} bytes")
+    print(f"  head: {result['head']}")
+    print(f"  tail: {result['tail']}")
+
+    print(f"  overall entropy: {result['entropy']:.3f} bits/byte  (8.0 = random/compressed/encrypted, "
+          f"~4-5 = text, ~5.5-6.5 = typical machine code, near 0 = padding/blank)")
+    print(f"  block entropy (window={result['entropy_window']} bytes):")
+    for i, e in result["entropy_profile"]:
+        bar = "#" * int(e / 8 * 40)
+        print(f"    0x{i:07x}  {e:5.2f}  {bar}")
+
+    kinds = ", ".join(f"{k} {n}" for k, n in sorted(result["string_kinds"].items()))
+    print(f"  strings found: {result['strings_total']} total, {result['wordlike_total']} word-like"
+          + (f" ({kinds})" if kinds else ""))
+
+    print(f"  likely de-voweled debug/POST strings ({result['devoweled_total']}):")
+    for shown, (offset, s) in enumerate(result["devoweled"]):
+        if devoweled_limit is not None and shown >= devoweled_limit:
+            print("    ... (truncated, use --all-strings or --strings to list them all)")
             break
+        print(f"    0x{offset:07x}  {s}")
+
+
+def analyze_file(path: str, cache: ResultCache = None):
+    print_analysis(analyze_batch([path], 1, cache)[0])
+
+
+def analyze_batch(paths, jobs: int = None, cache: ResultCache = None):
+    """analyze_image() over many files on a process pool (jobs=None: one
+    worker per core, jobs=1: in-process). Results come back in input
+    order. With a cache, only images whose contents aren't cached yet are
+    analysed."""
+    results = [None] * len(paths)
+    keys = [None] * len(paths)
+    todo = []
+    for i, path in enumerate(paths):
+        if cache is not None:
+            try:
+                keys[i] = file_hash(path)
+            except OSError:
+                pass   # analyze_image() reports it
+            else:
+                cached = cache.get("analysis", keys[i])
+                if cached is not None:
+                    cached["path"] = path
+                    results[i] = cached
+                    continue
+        todo.append(i)
+
+    todo_paths = [paths[i] for i in todo]
+    if jobs == 1 or len(todo) < 2:
+        fresh = [analyze_image(p) for p in todo_paths]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            fresh = list(pool.map(analyze_image, todo_paths, chunksize=1))
+
+    for i, result in zip(todo, fresh):
+        results[i] = result
+        if cache is not None and keys[i] is not None and "error" not in result:
+            cache.put("analysis", keys[i], result)
+    return results
+
+
+def write_json_report(results, out_path: str):
+    with open(out_path, "w") as f:
+        json.dump(results, f, indent=1)
+
+
+CSV_FIELDS = ("path", "size", "entropy", "entropy_window", "strings_total", "wordlike_total",
+              "devoweled_total", "entropy_profile", "devoweled", "error")
+
+
+def write_csv_report(results, out_path: str):
+    """One row per file; the profile is "offset:entropy" pairs and the
+    de-voweled list is "|"-joined so each file stays on one row."""
+    with open(out_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        for r in results:
+            row = dict(r)
+            if "entropy_profile" in r:
+                row["entropy_profile"] = " ".join(f"{i:#x}:{e:.3f}" for i, e in r["entropy_profile"])
+                row["devoweled"] = "|".join(f"{o:#x}:{t}" for o, t in r["devoweled"])
+            writer.writerow(row)
+
+
+ALIGN_ANCHOR_LEN = 32        # bytes per anchor used to guess an alignment offset
+ALIGN_ANCHOR_COUNT = 64
+ALIGN_MAX_SHIFT = 0x10000
+DIFF_REGION_SIZE = 4096      # granularity of the per-region table
+
+
+def _overlap(len_a: int, len_b: int, offset: int):
+    """Range of A indices i for which b[i + offset] exists."""
+    lo = max(0, -offset)
+    hi = min(len_a, len_b - offset)
+    return lo, max(lo, hi)
+
+
+def diff_runs(a: bytes, b: bytes, offset: int = 0):
+    """Compares a[i] with b[i + offset] over the overlap. Returns
+    (runs, diff_count, lo, hi): runs is a list of inclusive (start, end)
+    A offsets of contiguous differing bytes, [lo, hi) the compared range."""
+    lo, hi = _overlap(len(a), len(b), offset)
+    if hi <= lo:
+        return [], 0, lo, hi
+
+    if np is not None:
+        va = np.frombuffer(a, dtype=np.uint8)[lo:hi]
+        vb = np.frombuffer(b, dtype=np.uint8)[lo + offset:hi + offset]
+        mask = va != vb
+        diff_count = int(np.count_nonzero(mask))
+        if not diff_count:
+            return [], 0, lo, hi
+        # run edges: +1 where a run starts, -1 one past where it ends
+        edges = np.diff(mask.view(np.int8), prepend=0, append=0)
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1) - 1
+        runs = list(zip((starts + lo).tolist(), (ends + lo).tolist()))
+        return runs, diff_count, lo, hi
+
+    # plain Python: skip identical blocks wholesale, walk only the rest
+    runs = []
+    diff_count = 0
+    run_start = None
+    for blk in range(lo, hi, DIFF_REGION_SIZE):
+        end = min(blk + DIFF_REGION_SIZE, hi)
+        if run_start is None and a[blk:end] == b[blk + offset:end + offset]:
+            continue
+        for i in range(blk, end):
+            if a[i] != b[i + offset]:
+                diff_count += 1
+                if run_start is None:
+                    run_start = i
+            elif run_start is not None:
+                runs.append((run_start, i - 1))
+                run_start = None
+    if run_start is not None:
+        runs.append((run_start, hi - 1))
+    return runs, diff_count, lo, hi
+
+
+def _count_matches(a: bytes, b: bytes, offset: int) -> int:
+    lo, hi = _overlap(len(a), len(b), offset)
+    if hi <= lo:
+        return 0
+    if np is not None:
+        va = np.frombuffer(a, dtype=np.uint8)[lo:hi]
+        vb = np.frombuffer(b, dtype=np.uint8)[lo + offset:hi + offset]
+        return int(np.count_nonzero(va == vb))
+    return (hi - lo) - diff_runs(a, b, offset)[1]
+
+
+def find_alignment(a: bytes, b: bytes, max_shift: int = ALIGN_MAX_SHIFT) -> int:
+    """Best offset such that a[i] lines up with b[i + offset].
+
+    Candidates come from anchors: ALIGN_ANCHOR_COUNT evenly spaced,
+    non-blank ALIGN_ANCHOR_LEN-byte slices of A looked up in B within
+    +/-max_shift. Offset 0 and end-aligned are always candidates. Each
+    candidate is scored by a full vectorised byte compare; most matching
+    bytes wins (ties go to the smaller shift)."""
+    votes = collections.Counter({0: 0, len(b) - len(a): 0})
+    span = len(a) - ALIGN_ANCHOR_LEN
+    if span > 0:
+        stride = max(1, span // ALIGN_ANCHOR_COUNT)
+        for pos in range(0, span, stride):
+            anchor = a[pos:pos + ALIGN_ANCHOR_LEN]
+            if len(set(anchor)) < 4:   # padding/blank fill matches everywhere
+                continue
+            start = max(0, pos - max_shift)
+            found = b.find(anchor, start, pos + max_shift + ALIGN_ANCHOR_LEN)
+            if found >= 0:
+                votes[found - pos] += 1
+    candidates = [off for off, _ in votes.most_common(8) if abs(off) <= max_shift or off == 0]
+    return max(candidates, key=lambda off: (_count_matches(a, b, off), -abs(off)))
+
+
+def diff_regions(a: bytes, b: bytes, runs, offset: int = 0, region_size: int = DIFF_REGION_SIZE):
+    """Per-region summary over A offsets: for every region_size-aligned
+    region containing differences, (start, differing_bytes, entropy_a,
+    entropy_b)."""
+    per_region = collections.Counter()
+    for s, e in runs:
+        while s <= e:
+            region = s - s % region_size
+            stop = min(e, region + region_size - 1)
+            per_region[region] += stop - s + 1
+            s = stop + 1
+    results = []
+    for region in sorted(per_region):
+        chunk_a = a[region:region + region_size]
+        chunk_b = b[max(0, region + offset):max(0, region + offset + region_size)]
+        results.append((region, per_region[region], entropy(chunk_a), entropy(chunk_b)))
+    return results
 
 
-def diff_files(path_a: str, path_b: str):
-    a = open(path_a, "rb").read()
-    b = open(path_b, "rb").read()
+def diff_files(path_a: str, path_b: str, align: bool = False, cache: ResultCache = None):
+    with open_image(path_a) as a, open_image(path_b) as b:
+        key = None
+        result = None
+        if cache is not None:
+            key = f"{content_hash(a)}-{content_hash(b)}-{int(align)}"
+            result = cache.get("diff", key)
+        if result is None:
+            result = diff_data(a, b, align)
+            if cache is not None:
+                cache.put("diff", key, result)
+    print_diff(path_a, path_b, result)
+
+
+def diff_data(a, b, align: bool = False) -> dict:
+    """Everything the diff report shows, as plain JSON-able values."""
+    offset = find_alignment(a, b) if align else 0
+    runs, ndiff, lo, hi = diff_runs(a, b, offset)
+    return {
+        "size_a": len(a),
+        "size_b": len(b),
+        "align": align,
+        "offset": offset,
+        "compared": hi - lo,
+        "differing": ndiff,
+        "runs": [list(r) for r in runs],
+        "regions": [list(r) for r in diff_regions(a, b, runs, offset)] if runs else [],
+    }
+
+
+def print_diff(path_a: str, path_b: str, result: dict):
     print(f"\n=== diff {path_a} vs {path_b} ===")
-    if len(a) != len(b):
-        print(f"  size mismatch: {len(a)} vs {len(b)} bytes -- diffing up to shorter length")
-    n = min(len(a), len(b))
-    diffs = [i for i in range(n) if a[i] != b[i]]
-    print(f"  {len(diffs)} differing bytes out of {n} ({100*len(diffs)/n:.2f}%)")
-    if not diffs:
+    size_a, size_b = result["size_a"], result["size_b"]
+    if size_a != size_b or result["align"]:
+        if size_a != size_b:
+            print(f"  size mismatch: {size_a} vs {size_b} bytes")
+        if result["align"]:
+            print(f"  best alignment: B offset {result['offset']:+#x} relative to A")
+        else:
+            print("  diffing from offset 0 up to the shorter length (--align to search for a shift)")
+    n = result["compared"]
+    if n == 0:
+        print("  no overlap to compare")
+        return
+    ndiff = result["differing"]
+    runs = result["runs"]
+    print(f"  {ndiff} differing bytes out of {n} ({100*ndiff/n:.2f}%)")
+    if not runs:
         return
-    # collapse into contiguous runs for readability
-    runs = []
-    start = diffs[0]
-    prev = diffs[0]
-    for i in diffs[1:]:
-        if i != prev + 1:
-            runs.append((start, prev))
-            start = i
-        prev = i
-    runs.append((start, prev))
     print(f"  {len(runs)} contiguous diff regions; first 30:")
     for s, e in runs[:30]:
         print(f"    0x{s:07x} - 0x{e:07x}  ({e - s + 1} bytes)")
 
+    regions = result["regions"]
+    print(f"  {len(regions)} of {(n + DIFF_REGION_SIZE - 1) // DIFF_REGION_SIZE} "
+          f"{DIFF_REGION_SIZE}-byte regions differ (entropy A -> B):")
+    for start, count, ent_a, ent_b in regions:
+        print(f"    0x{start:07x}  {100 * count / DIFF_REGION_SIZE:6.2f}%  "
+              f"{ent_a:5.2f} -> {ent_b:5.2f}  ({ent_b - ent_a:+.2f})")
+
+
+CDC_WINDOW = 32             # bytes in the rolling chunk-boundary hash
+CDC_AVG_CHUNK = 1024        # must be a power of two
+CDC_MIN_CHUNK = 256
+CDC_MAX_CHUNK = 8192
+
+# fixed pseudo-random byte -> 32-bit value table for the rolling hash; seeded
+# so chunk boundaries (and so results) are reproducible between runs
+_GEAR = random.Random(0x3216).sample(range(1 << 32), 256)
+
+
+def _cdc_candidates(data):
+    """Positions p (chunk ends) where the windowed hash of data[p-CDC_WINDOW:p]
+    has its low bits clear."""
+    mask = CDC_AVG_CHUNK - 1
+    n = len(data)
+    if n < CDC_WINDOW:
+        return []
+    if np is not None:
+        gear = np.array(_GEAR, dtype=np.uint64)
+        sums = np.cumsum(gear[np.frombuffer(data, dtype=np.uint8)], dtype=np.uint64)
+        window = sums[CDC_WINDOW - 1:].copy()
+        window[1:] -= sums[:-CDC_WINDOW]
+        return (np.flatnonzero((window & mask) == 0) + CDC_WINDOW).tolist()
+    out = []
+    h = sum(_GEAR[b] for b in data[:CDC_WINDOW])
+    for p in range(CDC_WINDOW, n + 1):
+        if (h & mask) == 0:
+            out.append(p)
+        if p < n:
+            h += _GEAR[data[p]] - _GEAR[data[p - CDC_WINDOW]]
+    return out
+
+
+def chunk_boundaries(data, chunk_size: int = None):
+    """Chunk end offsets for `data`: every chunk_size bytes if given,
+    otherwise content-defined (CDC_MIN_CHUNK..CDC_MAX_CHUNK, about
+    CDC_AVG_CHUNK on average)."""
+    n = len(data)
+    if chunk_size:
+        return list(range(chunk_size, n, chunk_size)) + ([n] if n else [])
+    ends = []
+    last = 0
+    for p in _cdc_candidates(data):
+        if p - last < CDC_MIN_CHUNK:
+            continue
+        while p - last > CDC_MAX_CHUNK:
+            last += CDC_MAX_CHUNK
+            ends.append(last)
+        ends.append(p)
+        last = p
+    while n - last > CDC_MAX_CHUNK:
+        last += CDC_MAX_CHUNK
+        ends.append(last)
+    if last < n:
+        ends.append(n)
+    return ends
+
+
+def image_chunks(data, chunk_size: int = None):
+    """[(offset, length, digest)] for every chunk of `data`."""
+    chunks = []
+    start = 0
+    for end in chunk_boundaries(data, chunk_size):
+        chunks.append((start, end - start, hashlib.blake2b(data[start:end], digest_size=16).digest()))
+        start = end
+    return chunks
+
+
+def compare_images(chunk_lists, sizes):
+    """Builds the chunk index over every image's chunk list and returns
+    (similarity, regions).
+
+    similarity[i][j] is the byte-weighted (multiset) Jaccard similarity of
+    images i and j: bytes in chunks they have in common over bytes in
+    either. regions[i] lists (start, end, kind) runs over image i with kind
+    relative to image i-1: "same" (same chunk at the same offset), "moved"
+    (in i-1, elsewhere), "shared" (not in i-1 but in some other image) or
+    "unique". For image 0 there is no predecessor, so only shared/unique."""
+    count = len(chunk_lists)
+    # digest -> {image: (occurrences, chunk length)}
+    index = collections.defaultdict(dict)
+    offsets = collections.defaultdict(set)   # (image, digest) -> offsets
+    for i, chunks in enumerate(chunk_lists):
+        for off, length, digest in chunks:
+            seen = index[digest].get(i)
+            index[digest][i] = (seen[0] + 1 if seen else 1, length)
+            offsets[i, digest].add(off)
+
+    shared = [[0] * count for _ in range(count)]
+    for holders in index.values():
+        members = sorted(holders.items())
+        for x, (i, (n_i, length)) in enumerate(members):
+            shared[i][i] += n_i * length
+            for j, (n_j, _) in members[x + 1:]:
+                common = min(n_i, n_j) * length
+                shared[i][j] += common
+                shared[j][i] += common
+    similarity = [[0.0] * count for _ in range(count)]
+    for i in range(count):
+        for j in range(count):
+            union = sizes[i] + sizes[j] - shared[i][j]
+            similarity[i][j] = shared[i][j] / union if union else 1.0
+
+    regions = []
+    for i, chunks in enumerate(chunk_lists):
+        runs = []
+        for off, length, digest in chunks:
+            holders = index[digest]
+            if i > 0 and i - 1 in holders:
+                kind = "same" if off in offsets[i - 1, digest] else "moved"
+            elif len(holders) > 1:
+                kind = "shared"
+            else:
+                kind = "unique"
+            if runs and runs[-1][2] == kind and runs[-1][1] == off:
+                runs[-1][1] = off + length
+            else:
+                runs.append([off, off + length, kind])
+        regions.append([tuple(r) for r in runs])
+    return similarity, regions
+
+
+COMPARE_REGIONS_SHOWN = 30
+
+
+def compare_files(paths, chunk_size: int = None):
+    chunk_lists = []
+    sizes = []
+    for path in paths:
+        with open_image(path) as data:
+            chunk_lists.append(image_chunks(data, chunk_size))
+            sizes.append(len(data))
+    similarity, regions = compare_images(chunk_lists, sizes)
+
+    how = f"fixed {chunk_size}-byte" if chunk_size else f"content-defined (~{CDC_AVG_CHUNK}-byte)"
+    print(f"\n=== compare {len(paths)} images, {how} chunks ===")
+    for i, path in enumerate(paths):
+        print(f"  [{i}] {path}  ({sizes[i]} bytes, {len(chunk_lists[i])} chunks)")
+
+    print("  similarity (shared bytes / bytes in either):")
+    print("        " + "".join(f"{j:>7}" for j in range(len(paths))))
+    for i, row in enumerate(similarity):
+        print(f"    {i:>3} " + "".join(f"{v:7.3f}" for v in row))
+
+    if len(paths) > 2:
+        print("  nearest neighbour:")
+        for i, row in enumerate(similarity):
+            j = max((j for j in range(len(row)) if j != i), key=lambda j: row[j])
+            print(f"    [{i}] -> [{j}]  {row[j]:.3f}")
+
+    for i, runs in enumerate(regions):
+        totals = collections.Counter()
+        for start, end, kind in runs:
+            totals[kind] += end - start
+        against = f"vs [{i - 1}]" if i else "vs all others"
+        summary = ", ".join(f"{kind} {totals[kind]}" for kind in ("same", "moved", "shared", "unique")
+                            if totals[kind])
+        print(f"  [{i}] regions {against}: {summary or 'empty'}")
+        interesting = [r for r in runs if r[2] != "same"]
+        for start, end, kind in interesting[:COMPARE_REGIONS_SHOWN]:
+            print(f"    0x{start:07x} - 0x{end - 1:07x}  {kind:6}  ({end - start} bytes)")
+        if len(interesting) > COMPARE_REGIONS_SHOWN:
+            print(f"    ... {len(interesting) - COMPARE_REGIONS_SHOWN} more")
+
+
+def selftest() -> bool:
+    """Z80 string references: LD HL/IX/IY,nn to one string must give one
+    reference each, not an extra LD HL,nn one byte into every LD IX/IY.
+    Returns True if all checks passed."""
+    print("=== fw_analyze self-test ===")
+    code = bytes([0x21, 0x10, 0x00,           # 0000  LD HL,0x0010
+                  0xDD, 0x21, 0x10, 0x00,     # 0003  LD IX,0x0010
+                  0xFD, 0x21, 0x10, 0x00])    # 0007  LD IY,0x0010
+    data = code.ljust(16, b"\x00") + b"HELLO WORLD\x00"
+    index = StringIndex(scan_strings(data))
+    found = find_code_references(data, index)
+    ok = found == 3 and index.refs_to(16) == [0x0000, 0x0003, 0x0007]
+    print(f"  LD HL/IX/IY,nn references {index.refs_to(16)}  {'ok' if ok else 'FAILED'}")
+    return ok
+
+
+def _pop_cache_options(args):
+    """Strips --cache DIR / --no-cache / --cache-size MB from args and
+    returns the ResultCache they describe (or None)."""
+    directory = DEFAULT_CACHE_DIR
+    max_bytes = DEFAULT_CACHE_MAX_BYTES
+    enabled = True
+    rest = []
+    it = iter(args)
+    for a in it:
+        if a == "--cache":
+            directory = cli.option_value(it, a, __doc__)
+        elif a == "--no-cache":
+            enabled = False
+        elif a == "--cache-size":
+            max_bytes = int(cli.float_option(it, a, __doc__) * 1024 * 1024)
+        else:
+            rest.append(a)
+    args[:] = rest
+    return ResultCache(directory, max_bytes) if enabled else None
+
 
 if __name__ == "__main__":
     args = sys.argv[1:]
+    cache = _pop_cache_options(args)
     if not args:
         print(__doc__)
         sys.exit(1)
+    if args[0] == "--selftest":
+        sys.exit(0 if selftest() else 1)
     if args[0] == "--diff":
-        if len(args) != 3:
-            print("Usage: ddx3216_fw_analyze.py --diff <fileA> <fileB>")
+        align = "--align" in args
+        files = [a for a in args[1:] if a != "--align"]
+        if len(files) != 2:
+            print("Usage: ddx3216_fw_analyze.py --diff [--align] <fileA> <fileB>")
+            sys.exit(1)
+        diff_files(files[0], files[1], align, cache)
+    elif args[0] == "--compare":
+        chunk_size = None
+        files = []
+        it = iter(args[1:])
+        for a in it:
+            if a == "--chunk":
+                chunk_size = cli.int_option(it, a, __doc__, 0)
+            else:
+                files.append(a)
+        if len(files) < 2:
+            print("Usage: ddx3216_fw_analyze.py --compare [--chunk N] <file1> <file2> [file3 ...]")
+            sys.exit(1)
+        compare_files(files, chunk_size)
+    elif args[0] == "--strings":
+        base = 0
+        files = []
+        it = iter(args[1:])
+        for a in it:
+            if a == "--base":
+                base = cli.int_option(it, a, __doc__, 0)
+            else:
+                files.append(a)
+        if len(files) != 1:
+            print("Usage: ddx3216_fw_analyze.py --strings [--base N] <file>")
+            sys.exit(1)
+        strings_report(files[0], base)
+    elif args[0] == "--sweep":
+        if len(args) != 4:
+            print("Usage: ddx3216_fw_analyze.py --sweep <window> <step> <file>")
             sys.exit(1)
-        diff_files(args[1], args[2])
+        window = cli.int_value(args[1], "--sweep window", __doc__, 0)
+        step = cli.int_value(args[2], "--sweep step", __doc__, 0)
+        entropy_sweep_report(args[3], window, step)
     else:
-        for p in args:
-            analyze_file(p)
+        jobs = None
+        json_out = csv_out = None
+        devoweled_limit = DEVOWELED_SHOW_LIMIT
+        paths = []
+        it = iter(args)
+        for a in it:
+            if a == "--jobs":
+                jobs = cli.int_option(it, a, __doc__)
+            elif a == "--json":
+                json_out = cli.option_value(it, a, __doc__)
+            elif a == "--csv":
+                csv_out = cli.option_value(it, a, __doc__)
+            elif a == "--all-strings":
+                devoweled_limit = None
+            else:
+                paths.append(a)
+        results = analyze_batch(paths, jobs, cache)
+        for r in results:
+            print_analysis(r, devoweled_limit)
+        if json_out:
+            write_json_report(results, json_out)
+        if csv_out:
+            write_csv_report(results, csv_out)
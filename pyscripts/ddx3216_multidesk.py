@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+ddx3216_multidesk.py
+
+Scene recall across several DDX3216s with ddx3216_desks.DeskController,
+against emulated desks:
+
+  * separate links: one emulated desk per pty (the serial path), each
+    modelling a MIDI-rate link. The scene is recalled on all of them at
+    once and then desk by desk, and each recall is timed until every desk
+    has answered a ping sent after it;
+  * cascaded: the same number of desks on one in-process link with
+    distinct MIDI channels, where an identical scene goes out once,
+    addressed to all of them (device byte 0x60).
+
+Each run checks that every desk ended up holding the scene.
+
+Usage:
+    python3 ddx3216_multidesk.py [--desks N] [--bps N] [--timeout S]
+"""
+
+import os
+import sys
+import time
+
+import ddx3216_cli as cli
+import ddx3216_desk_emulator as emulator
+import ddx3216_serial
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "FLStudioMidiScript", "FLStudio_DDX3216"))
+import ddx3216_protocol as proto  # noqa: E402
+from ddx3216_desks import DeskController  # noqa: E402
+from ddx3216_scheduler import MIDI_BYTES_PER_SECOND  # noqa: E402
+from ddx3216_transport import LoopbackTransport  # noqa: E402
+
+DEFAULT_DESKS = 4
+DEFAULT_TIMEOUT = 10.0
+POLL_INTERVAL = 0.0005
+
+
+def make_scene(seed: int) -> list:
+    """Every channel's fader and pan plus the master faders."""
+    scene = [(module, proto.PARAM_VOLUME, (seed * 97 + module * 40) % 1473) for module in range(32)]
+    scene += [(module, proto.PARAM_PAN, (seed * 7 + module) % 61) for module in range(32)]
+    scene += [(module, proto.PARAM_VOLUME, (seed * 131) % 1473)
+              for module in (proto.MODULE_MASTER_LEFT, proto.MODULE_MASTER_RIGHT)]
+    return scene
+
+
+def wait_for_pings(controller: DeskController, desks=None, timeout: float = DEFAULT_TIMEOUT) -> bool:
+    deadline = time.perf_counter() + timeout
+    while controller.pending(desks):
+        if time.perf_counter() > deadline:
+            return False
+        time.sleep(POLL_INTERVAL)
+    return True
+
+
+def timed_recall(controller: DeskController, scene: list, desks=None, timeout: float = DEFAULT_TIMEOUT):
+    """(seconds until every desk answered, bytes sent, all answered)."""
+    t0 = time.perf_counter()
+    sent = controller.recall(scene, desks)
+    controller.ping(desks)
+    ok = wait_for_pings(controller, desks, timeout)
+    return time.perf_counter() - t0, sent, ok
+
+
+def holds(desk: emulator.VirtualDesk, scene: list) -> bool:
+    return all(desk.params.get((module, param)) == raw for module, param, raw in scene)
+
+
+def separate_links(count: int, bps: int, timeout: float):
+    print(f"--- {count} desks on separate pty links ({bps or 'unlimited'} B/s modelled) ---")
+    controller = DeskController()
+    emulated = []
+    closers = []
+    for _ in range(count):
+        desk = emulator.VirtualDesk(bytes_per_second=bps)
+        path, _, close = ddx3216_serial.serve_desk_on_pty(desk)
+        controller.add(ddx3216_serial.SerialLink.open(path), name=path)
+        emulated.append(desk)
+        closers.append(close)
+
+    scene = make_scene(1)
+    elapsed, sent, ok = timed_recall(controller, scene, timeout=timeout)
+    parallel_ok = ok and all(holds(desk, scene) for desk in emulated)
+    print(f"  parallel recall    {elapsed * 1000.0:8.1f} ms  {sent:6} bytes  ok={parallel_ok}")
+
+    scene = make_scene(2)
+    t0 = time.perf_counter()
+    sent = 0
+    ok = True
+    for desk in controller.desks:
+        _, desk_sent, desk_ok = timed_recall(controller, scene, [desk], timeout)
+        sent += desk_sent
+        ok = ok and desk_ok
+    elapsed = time.perf_counter() - t0
+    sequential_ok = ok and all(holds(desk, scene) for desk in emulated)
+    print(f"  desk-by-desk       {elapsed * 1000.0:8.1f} ms  {sent:6} bytes  ok={sequential_ok}")
+
+    elapsed, sent, ok = timed_recall(controller, scene, timeout=timeout)
+    print(f"  same scene again   {elapsed * 1000.0:8.1f} ms  {sent:6} bytes  (shadow: nothing to send)")
+
+    for desk in controller.desks:
+        desk.transport.close()
+    for close in closers:
+        close()
+    return parallel_ok and sequential_ok
+
+
+def cascaded(count: int, bps: int, timeout: float):
+    print(f"--- {count} desks cascaded on one link ({bps or 'unlimited'} B/s modelled) ---")
+    host, far = LoopbackTransport.pair()
+    controller = DeskController()
+    emulated = []
+    endpoints = []
+    for channel in range(1, count + 1):
+        desk = emulator.VirtualDesk(channel, bps)
+        endpoints.append(emulator.TransportEndpoint(desk, far).start())
+        controller.add(host, channel)
+        emulated.append(desk)
+    # Every desk on the chain sees every frame, as on a MIDI thru chain.
+    far.on_frames = lambda frames: [endpoint._on_frames(frames) for endpoint in endpoints]
+
+    scene = make_scene(3)
+    elapsed, sent, ok = timed_recall(controller, scene, timeout=timeout)
+    omni_ok = ok and all(holds(desk, scene) for desk in emulated)
+    print(f"  identical scene    {elapsed * 1000.0:8.1f} ms  {sent:6} bytes  ok={omni_ok}  "
+          f"(sent once to all, omni recalls={controller.stats['omni_recalls']})")
+
+    # The first desk already has the new faders, so the desks need
+    # different changes and each is addressed on its own.
+    scene = make_scene(4)
+    controller.recall(scene[:32], controller.desks[:1])
+    elapsed, sent, ok = timed_recall(controller, scene, timeout=timeout)
+    addressed_ok = ok and all(holds(desk, scene) for desk in emulated)
+    print(f"  diverged shadows   {elapsed * 1000.0:8.1f} ms  {sent:6} bytes  ok={addressed_ok}  "
+          f"(addressed per desk, omni recalls={controller.stats['omni_recalls']})")
+
+    for endpoint in endpoints:
+        endpoint.stop()
+    return omni_ok and addressed_ok
+
+
+def selftest(count: int = DEFAULT_DESKS, bps: int = MIDI_BYTES_PER_SECOND,
+             timeout: float = DEFAULT_TIMEOUT) -> bool:
+    print(f"=== DDX3216 multi-desk recall ({count} desks) ===")
+    ok = separate_links(count, bps, timeout)
+    return cascaded(count, bps, timeout) and ok
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    count = DEFAULT_DESKS
+    bps = MIDI_BYTES_PER_SECOND
+    timeout = DEFAULT_TIMEOUT
+    it = iter(args)
+    for a in it:
+        if a == "--desks":
+            count = cli.int_option(it, a, __doc__)
+        elif a == "--bps":
+            bps = cli.int_option(it, a, __doc__)
+        elif a == "--timeout":
+            timeout = cli.float_option(it, a, __doc__)
+        else:
+            print(__doc__)
+            sys.exit(1)
+    sys.exit(0 if selftest(count, bps, timeout) else 1)
@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+"""
+ddx3216_serial.py
+
+RS232 transport for the desktop tools -- the Python side of the JUCE
+app's SerialPortManager.h. The desk frames RS232 traffic exactly like MIDI
+SysEx (F0 ... F7), at 115200 baud 8N1 (DDX3216Protocol.h's Serial
+namespace): about 11,520 bytes/s against MIDI's 3,125, so bulk dumps and
+full state syncs are ~3.7x faster over serial.
+
+SerialLink works on any POSIX tty-like file descriptor -- a USB-RS232
+adapter (/dev/ttyUSB0) or one end of a pseudo-terminal pair, which is how
+everything here can be tested locally against the desk emulator:
+
+  * a reader thread does non-blocking reads (readinto) straight into a
+    reusable bytearray ring, and feeds the filled part through
+    ddx3216_protocol.SysExAssembler, so no bytes object is allocated per
+    read;
+  * a writer thread drains the output queue: everything queued since its
+    last write is gathered into one reusable buffer and written with as
+    few write() calls as the driver allows, instead of one per frame;
+  * SerialLink is a ddx3216_transport.Transport: complete messages go to
+    on_frames(list). Wrap it in the emulator's TransportClient for
+    receive()/request(), so its download()/upload() work over serial
+    unchanged.
+
+Usage:
+    python3 ddx3216_serial.py --selftest
+    python3 ddx3216_serial.py --serve-pty [--channel N]
+    python3 ddx3216_serial.py --port /dev/ttyUSB0 [--baud N]
+        (--ping | --download OUT | --upload FILE)
+
+--selftest runs the emulator's session over a pty pair at the serial rate
+and compares a settings download with the MIDI-rate pipe. --serve-pty runs
+an emulated desk on a pty and prints the path to connect to.
+"""
+
+import io
+import os
+import sys
+import time
+import selectors
+import threading
+import collections
+
+try:
+    import termios
+    import tty
+except ImportError:
+    termios = None
+    tty = None
+
+import ddx3216_cli as cli
+import ddx3216_desk_emulator as emulator
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "FLStudioMidiScript", "FLStudio_DDX3216"))
+import ddx3216_protocol as proto  # noqa: E402
+from ddx3216_transport import Transport  # noqa: E402
+from ddx3216_scheduler import MIDI_BYTES_PER_SECOND  # noqa: E402
+
+SERIAL_BAUD_RATE = 115200
+SERIAL_BYTES_PER_SECOND = SERIAL_BAUD_RATE // 10     # 8N1: 10 bits per byte
+DEFAULT_RING_SIZE = 64 * 1024
+MAX_WRITE = 16 * 1024
+
+_BAUD_CONSTANTS = {}
+if termios is not None:
+    for _rate in (9600, 19200, 38400, 57600, 115200, 230400):
+        if hasattr(termios, f"B{_rate}"):
+            _BAUD_CONSTANTS[_rate] = getattr(termios, f"B{_rate}")
+
+
+class ByteRing:
+    """Fixed-size bytearray ring. writable() and readable() return
+    memoryviews of the contiguous free and filled regions, commit() and
+    consume() move the ends, so data is read into and parsed out of the
+    same buffer with no copies in between."""
+
+    def __init__(self, capacity=DEFAULT_RING_SIZE):
+        self.capacity = capacity
+        self.buffer = bytearray(capacity)
+        self._view = memoryview(self.buffer)
+        self.start = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def writable(self):
+        end = (self.start + self.size) % self.capacity
+        if self.size == self.capacity:
+            return self._view[end:end]
+        return self._view[end:self.start if end < self.start else self.capacity]
+
+    def commit(self, n):
+        self.size += n
+
+    def readable(self):
+        stop = min(self.start + self.size, self.capacity)
+        return self._view[self.start:stop]
+
+    def consume(self, n):
+        self.start = (self.start + n) % self.capacity
+        self.size -= n
+        if self.size == 0:
+            self.start = 0
+
+    def fill(self, stream):
+        """One readinto() on `stream` into the free space. Returns the byte
+        count, 0 at end of stream, None if a non-blocking read would
+        block."""
+        view = self.writable()
+        if not len(view):
+            return None
+        n = stream.readinto(view)
+        view.release()
+        if n:
+            self.commit(n)
+        return n
+
+
+def configure_tty(fd, baud=SERIAL_BAUD_RATE):
+    """Raw mode, 8N1 at `baud`, no flow control. Leaves non-ttys alone."""
+    if termios is None or not os.isatty(fd):
+        return
+    tty.setraw(fd)
+    attrs = termios.tcgetattr(fd)
+    attrs[2] &= ~(termios.PARENB | termios.CSTOPB | termios.CSIZE)
+    attrs[2] |= termios.CS8 | termios.CLOCAL | termios.CREAD
+    if hasattr(termios, "CRTSCTS"):
+        attrs[2] &= ~termios.CRTSCTS
+    speed = _BAUD_CONSTANTS.get(baud)
+    if speed is not None:
+        attrs[4] = attrs[5] = speed
+    termios.tcsetattr(fd, termios.TCSANOW, attrs)
+
+
+def open_pty_pair():
+    """A raw pseudo-terminal pair: (master_fd, slave_fd, slave_path). The
+    desk side (e.g. the emulator) uses master_fd, the host opens
+    slave_path. Keep slave_fd open until done: on Linux, reads on the
+    master fail with EIO whenever no slave descriptor is open."""
+    master_fd, slave_fd = os.openpty()
+    configure_tty(slave_fd)
+    return master_fd, slave_fd, os.ttyname(slave_fd)
+
+
+class SerialLink(Transport):
+    """Threaded, non-blocking host side of a serial link on file
+    descriptor `fd`, which it owns and closes."""
+
+    name = "serial"
+
+    def __init__(self, fd, on_frames=None, ring_size=DEFAULT_RING_SIZE, max_write=MAX_WRITE,
+                 bytes_per_second=SERIAL_BYTES_PER_SECOND):
+        Transport.__init__(self, on_frames)
+        self.fd = fd
+        self.bytes_per_second = bytes_per_second
+        self.max_write = max_write
+        self.ring = ByteRing(ring_size)
+        os.set_blocking(fd, False)
+        self._stream = io.FileIO(fd, "rb", closefd=False)
+        self._assembler = proto.SysExAssembler()
+
+        self._cond = threading.Condition()
+        self._out = collections.deque()
+        self._out_buffer = bytearray()
+        self._unwritten = 0
+        self._running = True
+        self._wake_r, self._wake_w = os.pipe()
+        self._threads = [threading.Thread(target=self._reader, daemon=True),
+                         threading.Thread(target=self._writer, daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+    @classmethod
+    def open(cls, path, baud=SERIAL_BAUD_RATE, **kwargs):
+        fd = os.open(path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        configure_tty(fd, baud)
+        return cls(fd, bytes_per_second=baud // 10, **kwargs)
+
+    # -- output ------------------------------------------------------------
+
+    def send_frames(self, frames):
+        """Queues messages; they go out in one write if they fit in
+        max_write. The frames are only read when the writer gathers them,
+        so don't modify them after sending."""
+        with self._cond:
+            for frame in frames:
+                self._out.append(frame)
+                self._unwritten += len(frame)
+                self.stats["frames_out"] += 1
+            self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """Waits until everything queued has been handed to the driver and,
+        on a real tty, transmitted. False on timeout or a closed link."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._unwritten and self._running:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            if self._unwritten:
+                return False
+        if termios is not None and os.isatty(self.fd):
+            try:
+                termios.tcdrain(self.fd)
+            except termios.error:
+                pass
+        return True
+
+    def _gather(self):
+        """Moves queued chunks into the write buffer, up to max_write (or
+        one whole chunk if that is bigger). Called with the lock held."""
+        buffer = self._out_buffer
+        del buffer[:]
+        while self._out and (not buffer or len(buffer) + len(self._out[0]) <= self.max_write):
+            buffer.extend(self._out.popleft())
+        return buffer
+
+    def _writer(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self.fd, selectors.EVENT_WRITE)
+        try:
+            while True:
+                with self._cond:
+                    while self._running and not self._out:
+                        self._cond.wait()
+                    if not self._running:
+                        return
+                    buffer = self._gather()
+                view = memoryview(buffer)
+                while view:
+                    try:
+                        n = os.write(self.fd, view)
+                    except BlockingIOError:
+                        selector.select(0.1)
+                        continue
+                    except OSError:
+                        self._stop()
+                        return
+                    self.stats["writes"] += 1
+                    self.stats["bytes_out"] += n
+                    view = view[n:]
+                    with self._cond:
+                        self._unwritten -= n
+                        self._cond.notify_all()
+                view.release()
+        finally:
+            selector.close()
+
+    # -- input -------------------------------------------------------------
+
+    def _reader(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self.fd, selectors.EVENT_READ)
+        selector.register(self._wake_r, selectors.EVENT_READ)
+        try:
+            while self._running:
+                selector.select()
+                if not self._running:
+                    return
+                try:
+                    n = self.ring.fill(self._stream)
+                except OSError:
+                    n = 0       # EIO: the other end of a pty went away
+                if n is None:
+                    continue
+                if n == 0:
+                    self._stop()
+                    return
+                self.stats["reads"] += 1
+                self._parse()
+        finally:
+            selector.close()
+
+    def _parse(self):
+        frames = []
+        while len(self.ring):
+            view = self.ring.readable()
+            frames.extend(self._assembler.feed(view))
+            self.ring.consume(len(view))
+            view.release()
+        self._deliver(frames)
+
+    # -- lifetime ----------------------------------------------------------
+
+    def _stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        try:
+            os.write(self._wake_w, b"\0")
+        except OSError:
+            pass
+
+    def close(self):
+        self.flush(1.0)
+        self._stop()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(1.0)
+        self._stream.close()
+        for fd in (self.fd, self._wake_r, self._wake_w):
+            os.close(fd)
+
+
+def _write_all(fd, data):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def serve_desk_on_pty(desk):
+    """Runs `desk` on the master side of a new pty pair. Returns
+    (slave_path, endpoint, close)."""
+    master_fd, slave_fd, path = open_pty_pair()
+    endpoint = emulator.StreamEndpoint(desk, lambda n: os.read(master_fd, n),
+                                       lambda data: _write_all(master_fd, data)).start()
+
+    def close():
+        endpoint.stop()
+        os.close(slave_fd)
+        endpoint.join(1.0)
+        os.close(master_fd)
+    return path, endpoint, close
+
+
+def selftest():
+    desk = emulator.VirtualDesk(bytes_per_second=SERIAL_BYTES_PER_SECOND)
+    path, _, close_desk = serve_desk_on_pty(desk)
+    link = SerialLink.open(path)
+    client = emulator.TransportClient(link)
+    print(f"=== DDX3216 serial link self-test (pty {path}, {SERIAL_BYTES_PER_SECOND} B/s modelled) ===")
+    t0 = time.perf_counter()
+    settings = emulator.download(client, proto.FUNC_DUMP_SETTINGS)
+    serial_time = time.perf_counter() - t0
+    ok = emulator.upload(client, proto.FUNC_DUMP_SETTINGS, settings)
+    again = emulator.download(client, proto.FUNC_DUMP_SETTINGS)
+
+    changes = [(module, param, 40 * module + param) for module in range(32)
+               for param in (proto.PARAM_VOLUME, proto.PARAM_PAN)]
+    t0 = time.perf_counter()
+    link.send_frames(proto.build_param_change_batch_sysex(changes))
+    client.request(proto.build_connection_test_sysex())
+    sync_time = time.perf_counter() - t0
+    print(f"  settings download {len(settings)} bytes  {serial_time * 1000.0:8.1f} ms")
+    print(f"  full state sync ({len(changes)} params) + ping  {sync_time * 1000.0:8.1f} ms")
+    print(f"  upload ok={ok}  round trip identical={again == settings}  "
+          f"state ok={all(desk.params.get((m, p)) == r for m, p, r in changes)}")
+    print(f"  link: {dict(sorted(link.stats.items()))}")
+    client.close()
+    close_desk()
+
+    midi_desk = emulator.VirtualDesk(bytes_per_second=MIDI_BYTES_PER_SECOND)
+    client, midi_endpoint = emulator.open_loopback(midi_desk)
+    t0 = time.perf_counter()
+    emulator.download(client, proto.FUNC_DUMP_SETTINGS)
+    midi_time = time.perf_counter() - t0
+    client.close()
+    midi_endpoint.stop()
+    print(f"  same download at MIDI rate            {midi_time * 1000.0:8.1f} ms  "
+          f"(serial {midi_time / serial_time:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    port = None
+    baud = SERIAL_BAUD_RATE
+    channel = None
+    action = None
+    target = None
+    it = iter(args)
+    for a in it:
+        if a == "--port":
+            port = cli.option_value(it, a, __doc__)
+        elif a == "--baud":
+            baud = cli.int_option(it, a, __doc__)
+        elif a == "--channel":
+            channel = cli.int_option(it, a, __doc__)
+        elif a in ("--selftest", "--serve-pty", "--ping"):
+            action = a
+        elif a in ("--download", "--upload"):
+            action = a
+            target = cli.option_value(it, a, __doc__)
+        else:
+            print(__doc__)
+            sys.exit(1)
+
+    if action == "--selftest":
+        selftest()
+    elif action == "--serve-pty":
+        desk = emulator.VirtualDesk(channel, SERIAL_BYTES_PER_SECOND)
+        path, _, _ = serve_desk_on_pty(desk)
+        print(f"DDX3216 emulator on {path} (Ctrl-C to stop)")
+        try:
+            while True:
+                time.sleep(1.0)
+        except KeyboardInterrupt:
+            print(f"  {dict(desk.stats)}")
+    elif port and action:
+        link = emulator.TransportClient(SerialLink.open(port, baud))
+        device_byte = proto.device_byte_for_channel(channel)
+        if action == "--ping":
+            t0 = time.perf_counter()
+            reply = link.request(proto.build_connection_test_sysex(device_byte))
+            print(f"reply {reply.hex(' ') if reply else None} after {(time.perf_counter() - t0) * 1000.0:.1f} ms")
+        elif action == "--download":
+            data = emulator.download(link, proto.FUNC_DUMP_SETTINGS, device_byte=device_byte)
+            if data is None:
+                print("download failed")
+                sys.exit(1)
+            with open(target, "wb") as f:
+                f.write(data)
+            print(f"{len(data)} bytes -> {target}")
+        else:
+            with open(target, "rb") as f:
+                ok = emulator.upload(link, proto.FUNC_DUMP_SETTINGS, f.read(), device_byte=device_byte)
+            print("upload ok" if ok else "upload failed")
+            sys.exit(0 if ok else 1)
+        link.close()
+    else:
+        print(__doc__)
+        sys.exit(1)
@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+ddx3216_soak.py
+
+Hardware-free soak test for round-trip fader sync: device_DDX3216.py runs
+on the FL API stubs (ddx3216_fl_harness.py) against the desk emulator
+(ddx3216_desk_emulator.py). For --duration seconds of harness time, all
+32 channels plus masters 64/65 get randomised automation from both sides:
+
+  * FL: random-walk volume and pan moves on the mixer tracks, which reach
+    the script as OnDirtyMixerTrack the way FL delivers them;
+  * desk: random-walk moves made "by hand" on the emulator, sent to the
+    script as fader/pan CCs (--cc-share of them) or 0x20 frames. Every
+    move changes the value. The main fader is stereo-linked, so masters 64
+    and 65 always move together.
+
+The script's output scheduler runs on harness time, so the MIDI link's
+byte budget and the emulator's wire model agree. Everything runs as fast
+as the CPU allows; a few minutes of traffic takes seconds.
+
+After the run, OnIdle keeps ticking for --settle seconds with no new moves.
+Then every volume/pan on the desk must match FL's mixer, within one raw
+step for conversion rounding. The run also fails if a move from the desk
+was not reflected in FL straight after its message was handled, or if
+ddx3216_traffic counted any redundant write: a parameter sent the value
+it already had (e.g. FL moving a track's volume resending its pan).
+
+Reported metrics:
+  * writes/s achieved to the desk;
+  * superseded FL writes (coalesced in the scheduler, by design);
+  * dropped desk moves;
+  * echoes and redundant writes, via ddx3216_traffic.TrafficAnalyzer;
+  * how many parameters disagreed at each one-second checkpoint.
+
+A single seed's interleaving can miss a race, so by default --seeds
+consecutive seeds are run, starting from --seed, each with its own report;
+the run passes only if every seed does.
+
+Exit status: 0 pass, 1 fail.
+
+Usage:
+    python3 ddx3216_soak.py [--duration S] [--fl-rate HZ] [--desk-rate HZ]
+        [--idle-rate HZ] [--cc-share F] [--settle S] [--window MS]
+        [--seed N] [--seeds COUNT] [--script PATH] [--json OUT]
+"""
+
+import os
+import sys
+import json
+import time
+import heapq
+import random
+
+import ddx3216_fl_harness as harness
+import ddx3216_capture as capture
+import ddx3216_cli as cli
+import ddx3216_traffic as traffic
+from ddx3216_desk_emulator import VirtualDesk
+import _flstub
+import mixer
+import ddx3216_protocol as proto
+from ddx3216_scheduler import MIDI_BYTES_PER_SECOND
+
+DEFAULT_SCRIPT = os.path.join(harness.SCRIPT_DIR, "device_DDX3216.py")
+DEFAULT_DURATION = 120.0
+DEFAULT_FL_RATE = 100.0        # FL-side automation moves per second
+DEFAULT_DESK_RATE = 60.0       # hand moves on the desk per second
+DEFAULT_IDLE_RATE = 50.0       # OnIdle calls per second
+DEFAULT_CC_SHARE = 0.5
+DEFAULT_SETTLE = 3.0
+DEFAULT_SEED = 0x3216
+DEFAULT_SEED_COUNT = 8
+CHECKPOINT_INTERVAL = 1.0
+TOLERANCE = 1                  # raw steps
+
+NUM_CHANNELS = 32
+MASTER = "master"
+TARGETS = [(channel, param) for channel in range(NUM_CHANNELS)
+           for param in (proto.PARAM_VOLUME, proto.PARAM_PAN)] + [(MASTER, proto.PARAM_VOLUME)]
+MASTER_MODULES = (proto.MODULE_MASTER_LEFT, proto.MODULE_MASTER_RIGHT)
+VOLUME_RAW_MAX = 1472
+PAN_RAW_MAX = 60
+
+FL_EVENT = "@fl"
+DESK_EVENT = "@desk"
+CHECKPOINT_EVENT = "@checkpoint"
+
+
+def _poisson(rng, rate: float, duration: float, kind: str):
+    t = rng.expovariate(rate)
+    while t < duration:
+        yield t, kind, ()
+        t += rng.expovariate(rate)
+
+
+def _periodic(rate: float, duration: float, kind: str):
+    for i in range(int(rate * duration)):
+        yield i / rate, kind, ()
+
+
+class SoakRun:
+    def __init__(self, script_path: str = DEFAULT_SCRIPT, seed: int = DEFAULT_SEED,
+                 cc_share: float = DEFAULT_CC_SHARE, window: float = traffic.DEFAULT_ECHO_WINDOW):
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.cc_share = cc_share
+        self.desk = VirtualDesk(clock=lambda: _flstub.now)
+        self.script = harness.load_script(script_path)
+        self.harness = harness.Harness(self.script, self.desk)
+        self.traffic = traffic.TrafficAnalyzer(window)
+        _flstub.sinks.append(lambda data: self.traffic.feed(_flstub.now, capture.DIR_OUT, data))
+
+        self.harness.init()
+        self.harness.reset()
+        self.master_track = self.script.MASTER_TRACK
+
+        self.fl_moves = 0
+        self.desk_moves = 0
+        self.desk_cc_moves = 0
+        self.last_cc = {}                  # cc -> value last sent by the desk
+        self.dropped = []                  # (t, target, expected, got)
+        self.divergence = []               # mismatched targets per checkpoint
+        self.now = 0.0
+
+    # -- mapping -----------------------------------------------------------
+
+    def fl_track(self, target) -> int:
+        return self.master_track if target == MASTER else self.script.fl_track_for_channel(target)
+
+    def fl_value(self, target, param) -> float:
+        track = self.fl_track(target)
+        return mixer.getTrackVolume(track) if param == proto.PARAM_VOLUME else mixer.getTrackPan(track)
+
+    def expected_raw(self, target, param) -> int:
+        """FL's current value as the raw desk value the script should send."""
+        if param == proto.PARAM_VOLUME:
+            return proto.volume_db_to_raw(self.script.fl_volume_to_db(self.fl_value(target, param)))
+        return proto.pan_position_to_raw(self.fl_value(target, param) * 30.0)
+
+    def desk_raws(self, target, param):
+        if target == MASTER:
+            return [self.desk.params.get((module, param)) for module in MASTER_MODULES]
+        return [self.desk.params.get((proto.MODULE_CHANNEL_BASE + target, param))]
+
+    def mismatches(self):
+        out = []
+        for target, param in TARGETS:
+            expected = self.expected_raw(target, param)
+            for raw in self.desk_raws(target, param):
+                if raw is None or abs(raw - expected) > TOLERANCE:
+                    out.append((target, param, expected, raw))
+                    break
+        return out
+
+    # -- moves -------------------------------------------------------------
+
+    def move_fl(self):
+        target, param = self.rng.choice(TARGETS)
+        track = self.fl_track(target)
+        if param == proto.PARAM_VOLUME:
+            value = min(1.0, max(0.0, mixer.getTrackVolume(track) + self.rng.gauss(0.0, 0.08)))
+            mixer.setTrackVolume.__wrapped__(track, value)
+        else:
+            value = min(1.0, max(-1.0, mixer.getTrackPan(track) + self.rng.gauss(0.0, 0.15)))
+            mixer.setTrackPan.__wrapped__(track, value)
+        self.fl_moves += 1
+        self.harness.deliver_dirty()
+
+    def move_desk(self):
+        target, param = self.rng.choice(TARGETS)
+        self.desk_moves += 1
+        if target != MASTER and self.rng.random() < self.cc_share:
+            cc = (proto.fader_cc_for_channel(target) if param == proto.PARAM_VOLUME
+                  else proto.pan_cc_for_channel(target))
+            # any value but the last one this CC sent
+            value = self.rng.randrange(127)
+            if value >= self.last_cc.get(cc, 128):
+                value += 1
+            self.last_cc[cc] = value
+            self.desk.emit_cc(cc, value, self.now)
+            self.desk_cc_moves += 1
+            return
+        top = VOLUME_RAW_MAX if param == proto.PARAM_VOLUME else PAN_RAW_MAX
+        current = self.desk_raws(target, param)[0]
+        if current is None:
+            current = top // 2
+        # a move always changes the value; at an end stop it goes the other way
+        step = int(self.rng.gauss(0.0, top * 0.08)) or self.rng.choice((-1, 1))
+        raw = min(top, max(0, current + step))
+        if raw == current:
+            raw = min(top, max(0, current - step))
+        modules = MASTER_MODULES if target == MASTER else (proto.MODULE_CHANNEL_BASE + target,)
+        for module in modules:
+            self.desk.emit_param_change(module, param, raw, self.now)
+
+    def deliver_from_desk(self, frame):
+        """Hands one desk message to the script and checks FL followed it."""
+        self.traffic.feed(self.now, capture.DIR_IN, frame)
+        self.harness.dispatch("OnMidiMsg", (harness.FlMidiMsg.from_bytes(frame),))
+        if frame[0] & 0xF0 == 0xB0:
+            cc = frame[1]
+            channel = proto.cc_to_channel_index(cc)
+            if proto.is_fader_cc(cc):
+                self._check_arrival(channel, proto.PARAM_VOLUME, frame[2] / 127.0)
+            elif proto.is_pan_cc(cc):
+                self._check_arrival(channel, proto.PARAM_PAN, frame[2] / 127.0 * 2.0 - 1.0)
+            return
+        for module, param, raw in proto.parse_param_change_sysex(frame):
+            if module in MASTER_MODULES:
+                target = MASTER
+            elif proto.MODULE_CHANNEL_BASE <= module < proto.MODULE_CHANNEL_BASE + NUM_CHANNELS:
+                target = module - proto.MODULE_CHANNEL_BASE
+            else:
+                continue
+            if param == proto.PARAM_VOLUME:
+                expected = self.script.db_to_fl_volume(proto.volume_raw_to_db(raw))
+            else:
+                expected = proto.pan_raw_to_position(raw) / 30.0
+            self._check_arrival(target, param, expected)
+
+    def _check_arrival(self, target, param, expected):
+        got = self.fl_value(target, param)
+        if abs(got - expected) > 1e-6:
+            self.dropped.append((self.now, target, param, expected, got))
+
+    # -- run ---------------------------------------------------------------
+
+    def step(self, t: float, kind: str):
+        self.now = _flstub.now = t
+        for frame in self.desk.poll(t):
+            self.deliver_from_desk(frame)
+        if kind == "OnIdle":
+            self.harness.dispatch("OnIdle", ())
+        elif kind == FL_EVENT:
+            self.move_fl()
+        elif kind == DESK_EVENT:
+            self.move_desk()
+        elif kind == CHECKPOINT_EVENT:
+            self.divergence.append(len(self.mismatches()))
+
+    def run(self, duration: float, fl_rate: float, desk_rate: float, idle_rate: float, settle: float):
+        start = time.perf_counter()
+        # project load: FL pushes every track once
+        self.harness.dispatch("OnDirtyMixerTrack", (-1,))
+        events = heapq.merge(
+            _poisson(self.rng, fl_rate, duration, FL_EVENT) if fl_rate else iter(()),
+            _poisson(self.rng, desk_rate, duration, DESK_EVENT) if desk_rate else iter(()),
+            _periodic(idle_rate, duration + settle, "OnIdle"),
+            ((t + CHECKPOINT_INTERVAL, kind, args)
+             for t, kind, args in _periodic(1.0 / CHECKPOINT_INTERVAL, duration, CHECKPOINT_EVENT)),
+            key=lambda event: event[0])
+        for t, kind, _ in events:
+            self.step(t, kind)
+        self.duration = duration
+        self.settle = settle
+        self.elapsed = time.perf_counter() - start
+        self.final = self.mismatches()
+        return self.metrics()
+
+    def metrics(self) -> dict:
+        desk = self.desk.stats
+        scheduler = self.script._scheduler
+        writes = desk["param_writes"] + desk["attenuation_writes"] + desk["cc_writes"]
+        wire = self.traffic.bytes[capture.DIR_OUT]
+        return {
+            "duration_s": self.duration,
+            "elapsed_s": self.elapsed,
+            "fl_moves": self.fl_moves,
+            "desk_moves": self.desk_moves,
+            "desk_cc_moves": self.desk_cc_moves,
+            "desk_writes": writes,
+            "desk_writes_per_s": writes / self.duration,
+            "to_desk_bytes_per_s": wire / (self.duration + self.settle),
+            "superseded": sum(scheduler.superseded),
+            "dropped": len(self.dropped),
+            "echoes": sum(self.traffic.echoes.values()),
+            "bounces": sum(self.traffic.bounces.values()),
+            "redundant_writes": sum(v[0] for v in self.traffic.redundant.values()),
+            "divergence_mean": sum(self.divergence) / len(self.divergence) if self.divergence else 0.0,
+            "divergence_max": max(self.divergence) if self.divergence else 0,
+            "inconsistent": len(self.final),
+            "seed": self.seed,
+            "passed": not self.final and not self.dropped and not self.traffic.redundant,
+        }
+
+
+def _name(target, param) -> str:
+    where = "master" if target == MASTER else f"ch {target + 1}"
+    return f"{where} {'volume' if param == proto.PARAM_VOLUME else 'pan'}"
+
+
+def print_report(script_path: str, run: SoakRun, metrics: dict):
+    print(f"=== DDX3216 fader sync soak: {os.path.basename(script_path)} ===")
+    print(f"{metrics['duration_s']:.0f} s + {run.settle:.0f} s settle harness time "
+          f"({metrics['elapsed_s']:.1f} s wall)")
+    print(f"  FL automation moves   {metrics['fl_moves']:8}  ({metrics['fl_moves'] / metrics['duration_s']:.0f}/s)")
+    print(f"  desk moves            {metrics['desk_moves']:8}  ({metrics['desk_cc_moves']} as CC)")
+    print(f"  writes to desk        {metrics['desk_writes']:8}  ({metrics['desk_writes_per_s']:.0f}/s, "
+          f"{metrics['to_desk_bytes_per_s']:.0f} B/s = "
+          f"{metrics['to_desk_bytes_per_s'] / MIDI_BYTES_PER_SECOND * 100.0:.0f}% of the link)")
+    print(f"  superseded in queue   {metrics['superseded']:8}")
+    print(f"  dropped desk moves    {metrics['dropped']:8}")
+    print(f"  echoes / bounces      {metrics['echoes']:8} / {metrics['bounces']}  "
+          f"(within {run.traffic.echo_window * 1000.0:.0f} ms)")
+    print(f"  redundant writes      {metrics['redundant_writes']:8}")
+    print(f"  out of sync per 1 s   mean {metrics['divergence_mean']:.1f}  max {metrics['divergence_max']} "
+          f"of {len(TARGETS)}")
+    for t, target, param, expected, got in run.dropped[:10]:
+        print(f"  dropped at {t:8.3f} s: {_name(target, param)} FL {got:.4f}, desk sent {expected:.4f}")
+    for target, param, expected, raw in run.final[:10]:
+        print(f"  out of sync: {_name(target, param)} desk {raw}, FL says {expected}")
+    print("PASS" if metrics["passed"] else
+          f"FAIL: {metrics['inconsistent']} parameter(s) out of sync, {metrics['dropped']} dropped, "
+          f"{metrics['redundant_writes']} redundant")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    script_path = DEFAULT_SCRIPT
+    duration = DEFAULT_DURATION
+    fl_rate = DEFAULT_FL_RATE
+    desk_rate = DEFAULT_DESK_RATE
+    idle_rate = DEFAULT_IDLE_RATE
+    cc_share = DEFAULT_CC_SHARE
+    settle = DEFAULT_SETTLE
+    window = traffic.DEFAULT_ECHO_WINDOW
+    seed = DEFAULT_SEED
+    seed_count = DEFAULT_SEED_COUNT
+    json_out = None
+    it = iter(args)
+    for a in it:
+        if a == "--duration":
+            duration = cli.float_option(it, a, __doc__)
+        elif a == "--fl-rate":
+            fl_rate = cli.float_option(it, a, __doc__)
+        elif a == "--desk-rate":
+            desk_rate = cli.float_option(it, a, __doc__)
+        elif a == "--idle-rate":
+            idle_rate = cli.float_option(it, a, __doc__)
+        elif a == "--cc-share":
+            cc_share = cli.float_option(it, a, __doc__)
+        elif a == "--settle":
+            settle = cli.float_option(it, a, __doc__)
+        elif a == "--window":
+            window = cli.float_option(it, a, __doc__) / 1000.0
+        elif a == "--seed":
+            seed = cli.int_option(it, a, __doc__, 0)
+        elif a == "--seeds":
+            seed_count = cli.int_option(it, a, __doc__)
+        elif a == "--script":
+            script_path = cli.option_value(it, a, __doc__)
+        elif a == "--json":
+            json_out = cli.option_value(it, a, __doc__)
+        else:
+            print(__doc__)
+            sys.exit(1)
+
+    results = []
+    for run_seed in range(seed, seed + seed_count):
+        run = SoakRun(script_path, run_seed, cc_share, window)
+        metrics = run.run(duration, fl_rate, desk_rate, idle_rate, settle)
+        print(f"--- seed {run_seed:#x} ---")
+        print_report(script_path, run, metrics)
+        results.append(metrics)
+    failed = [metrics["seed"] for metrics in results if not metrics["passed"]]
+    if seed_count > 1:
+        print(f"=== {len(results) - len(failed)}/{len(results)} seeds passed"
+              + (f"; failed: {', '.join(f'{s:#x}' for s in failed)}" if failed else "") + " ===")
+    if json_out:
+        with open(json_out, "w") as f:
+            json.dump(results, f, indent=1)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+ddx3216_sysex_xref.py
+
+Call/XREF graph over the DDX3216's Z80 flash, and a ranked list of
+candidate SysEx handler functions -- the way in to confirming the bus/aux/FX
+module addresses that ddx3216_protocol.py still marks as INFERRED.
+
+Edges come from two places:
+
+  * the Ghidra listing (ddx3216_z80_listing.py): control flow of every
+    instruction Ghidra decoded, plus its XREF lists;
+  * a raw scan of the image for CALL nn / JP nn opcodes. Ghidra only decoded
+    a small fraction of the flash as code, so most of the ROM is reachable
+    only this way. These edges are heuristic and kept as separate kinds.
+
+The graph is stored as CSR adjacency arrays (an offsets array over the 64K
+address space plus flat target/kind arrays, in both directions), so a
+whole-ROM traversal is a handful of array reads per edge.
+
+Handler candidates are scored per function (listing functions plus call
+targets) from nearby evidence: immediate compares against 0xF0 (SysEx
+start), 0x0B (DDX3216 model byte) and 0x20 (parameter-change function),
+indirect jumps (JP (HL)/(IX)/(IY)), and tables of 16-bit code pointers
+near the compares or loaded by LD HL,nn inside the function.
+
+Usage:
+    python3 ddx3216_sysex_xref.py [--listing FILE] [--image FILE] [--top N] [--no-cache]
+
+--image scans the first 64K of a raw flash image instead of the bytes
+carried in the listing (listed instructions still come from the listing).
+"""
+
+import sys
+import time
+import bisect
+import collections
+from array import array
+
+import ddx3216_cli as cli
+import ddx3216_fw_analyze as fwa
+import ddx3216_z80_listing as z80
+
+ADDRESS_SPACE = z80.ADDRESS_SPACE
+
+EDGE_FLOW = 0        # fallthrough to the next instruction
+EDGE_JUMP = 1
+EDGE_CALL = 2
+EDGE_READ = 3
+EDGE_WRITE = 4
+EDGE_POINTER = 5
+EDGE_RAW_JUMP = 6    # JP nn found by byte scan outside listed code
+EDGE_RAW_CALL = 7    # CALL nn found by byte scan outside listed code
+EDGE_NAMES = ("flow", "jump", "call", "read", "write", "ptr", "jump?", "call?")
+CONTROL_EDGES = (EDGE_FLOW, EDGE_JUMP, EDGE_CALL, EDGE_RAW_JUMP, EDGE_RAW_CALL)
+
+_XREF_EDGE = {"j": EDGE_JUMP, "c": EDGE_CALL, "R": EDGE_READ, "W": EDGE_WRITE, "*": EDGE_POINTER}
+_BRANCHES = {"JP", "JR", "CALL", "DJNZ", "RST"}
+_NO_FALLTHROUGH = {"RETI", "RETN"}
+
+# Z80 opcodes for the raw scan
+_CALL_OPS = (0xCD, 0xC4, 0xCC, 0xD4, 0xDC, 0xE4, 0xEC, 0xF4, 0xFC)
+_JP_OPS = (0xC3, 0xC2, 0xCA, 0xD2, 0xDA, 0xE2, 0xEA, 0xF2, 0xFA)
+OP_CP_N = 0xFE
+OP_SUB_N = 0xD6
+OP_LD_HL_NN = 0x21
+OP_JP_HL = 0xE9
+OP_PREFIX_IX = 0xDD
+OP_PREFIX_IY = 0xFD
+
+SYSEX_COMPARES = {0xF0: 4, 0x0B: 2, 0x20: 2}   # immediate -> score weight
+COMPARE_CLUSTER = 0x40       # compares this close together count as one dispatch
+INDIRECT_NEAR = 0x40         # JP (HL) this far after a compare
+JUMP_TABLE_NEAR = 0x100      # table this far from a compare
+JUMP_TABLE_MIN_ENTRIES = 4
+JUMP_TABLE_SPAN = 0x1000     # all entries of one table point within this span
+MIN_RAW_CALLERS = 2          # raw call targets need this many callers to count as functions
+
+
+class XrefGraph:
+    """Directed graph over addresses 0..0xFFFF in CSR form: the successors
+    of `a` are out_targets[out_offsets[a]:out_offsets[a + 1]] (kinds in
+    out_kinds at the same positions); in_* is the reverse graph."""
+
+    def __init__(self, edges):
+        self.edge_count = len(edges)
+        self.out_offsets, self.out_targets, self.out_kinds = self._csr(edges, 0, 1)
+        self.in_offsets, self.in_targets, self.in_kinds = self._csr(edges, 1, 0)
+
+    @staticmethod
+    def _csr(edges, key, value):
+        counts = array("I", [0]) * (ADDRESS_SPACE + 1)
+        for e in edges:
+            counts[e[key] + 1] += 1
+        for a in range(ADDRESS_SPACE):
+            counts[a + 1] += counts[a]
+        fill = array("I", counts)
+        targets = array("H", [0]) * len(edges)
+        kinds = array("B", [0]) * len(edges)
+        for e in edges:
+            i = fill[e[key]]
+            targets[i] = e[value]
+            kinds[i] = e[2]
+            fill[e[key]] = i + 1
+        return counts, targets, kinds
+
+    def successors(self, address: int, kinds=None):
+        lo, hi = self.out_offsets[address], self.out_offsets[address + 1]
+        return [(self.out_targets[i], self.out_kinds[i]) for i in range(lo, hi)
+                if kinds is None or self.out_kinds[i] in kinds]
+
+    def predecessors(self, address: int, kinds=None):
+        lo, hi = self.in_offsets[address], self.in_offsets[address + 1]
+        return [(self.in_targets[i], self.in_kinds[i]) for i in range(lo, hi)
+                if kinds is None or self.in_kinds[i] in kinds]
+
+    def reachable(self, roots, kinds=CONTROL_EDGES):
+        """bytearray mask of addresses reachable from `roots` along edges of
+        the given kinds."""
+        allowed = bytearray(len(EDGE_NAMES))
+        for k in kinds:
+            allowed[k] = 1
+        seen = bytearray(ADDRESS_SPACE)
+        stack = list(roots)
+        for r in stack:
+            seen[r] = 1
+        offsets, targets, edge_kinds = self.out_offsets, self.out_targets, self.out_kinds
+        while stack:
+            a = stack.pop()
+            for i in range(offsets[a], offsets[a + 1]):
+                t = targets[i]
+                if not seen[t] and allowed[edge_kinds[i]]:
+                    seen[t] = 1
+                    stack.append(t)
+        return seen
+
+
+def _branch_target(listing, operands: str):
+    """Target address of a branch's operand text ("NC,LAB_ram_0003",
+    "0x1234", "RST7"), or None for indirect branches."""
+    text = operands.rsplit(",", 1)[-1].strip()
+    if not text or text.startswith("("):
+        return None
+    target = listing.resolve(text)
+    return target if target is not None and 0 <= target < ADDRESS_SPACE else None
+
+
+def listing_edges(listing):
+    """Control-flow edges of every decoded instruction plus the listing's
+    XREFs, as (from, to, kind)."""
+    edges = []
+    for row in range(len(listing)):
+        if not listing.is_code(row):
+            continue
+        address, raw, mnemonic, operands, _ = listing.row_info(row)
+        conditional = "," in operands
+        if mnemonic in _BRANCHES:
+            target = _branch_target(listing, operands)
+            if target is not None:
+                edges.append((address, target, EDGE_CALL if mnemonic in ("CALL", "RST") else EDGE_JUMP))
+        ends = (mnemonic in ("JP", "JR") and not conditional) or mnemonic in _NO_FALLTHROUGH \
+            or (mnemonic == "RET" and not operands)
+        nxt = address + len(raw)
+        if not ends and nxt < ADDRESS_SPACE:
+            edges.append((address, nxt, EDGE_FLOW))
+    for i in range(len(listing.xref_to)):
+        kind = _XREF_EDGE.get(listing.ref_kinds[listing.xref_kind[i]])
+        if kind is not None:
+            edges.append((listing.xref_from[i], listing.xref_to[i], kind))
+    return edges
+
+
+def _listed_code_mask(listing):
+    mask = bytearray(ADDRESS_SPACE)
+    for row in range(len(listing)):
+        if listing.is_code(row):
+            a = listing.addr[row]
+            mask[a:a + listing.size[row]] = b"\x01" * listing.size[row]
+    return mask
+
+
+def raw_edges(image, code_mask):
+    """CALL nn / JP nn found by scanning bytes outside listed code."""
+    edges = []
+    for ops, kind in ((_CALL_OPS, EDGE_RAW_CALL), (_JP_OPS, EDGE_RAW_JUMP)):
+        for op in ops:
+            a = image.find(bytes((op,)))
+            while 0 <= a < len(image) - 2:
+                if not code_mask[a]:
+                    edges.append((a, image[a + 1] | image[a + 2] << 8, kind))
+                a = image.find(bytes((op,)), a + 1)
+    return edges
+
+
+def compare_sites(image):
+    """{immediate: [addresses of CP n / SUB n with that immediate]}."""
+    sites = {}
+    for value in SYSEX_COMPARES:
+        found = []
+        for op in (OP_CP_N, OP_SUB_N):
+            needle = bytes((op, value))
+            a = image.find(needle)
+            while a >= 0:
+                found.append(a)
+                a = image.find(needle, a + 1)
+        sites[value] = sorted(found)
+    return sites
+
+
+def indirect_jumps(image):
+    """Addresses of JP (HL), JP (IX) and JP (IY)."""
+    out = []
+    a = image.find(bytes((OP_JP_HL,)))
+    while a >= 0:
+        out.append(a - 1 if a and image[a - 1] in (OP_PREFIX_IX, OP_PREFIX_IY) else a)
+        a = image.find(bytes((OP_JP_HL,)), a + 1)
+    return out
+
+
+def jump_tables(image, is_target):
+    """[(start, [targets])] for runs of at least JUMP_TABLE_MIN_ENTRIES
+    little-endian words that all satisfy is_target(address), lie within
+    JUMP_TABLE_SPAN of each other and aren't all the same. Both word
+    alignments are tried."""
+    tables = []
+    n = len(image) - 1
+    for phase in (0, 1):
+        run = []
+        start = phase
+        for a in range(phase, n, 2):
+            w = image[a] | image[a + 1] << 8
+            if is_target(w) and (not run or abs(w - run[0]) < JUMP_TABLE_SPAN):
+                if not run:
+                    start = a
+                run.append(w)
+                continue
+            if len(run) >= JUMP_TABLE_MIN_ENTRIES and len(set(run)) > 2:
+                tables.append((start, run))
+            run = [w] if is_target(w) else []
+            start = a
+        if len(run) >= JUMP_TABLE_MIN_ENTRIES and len(set(run)) > 2:
+            tables.append((start, run))
+    tables.sort()
+    return tables
+
+
+def _near(sorted_addresses, address: int, before: int, after: int):
+    lo = bisect.bisect_left(sorted_addresses, address - before)
+    hi = bisect.bisect_right(sorted_addresses, address + after)
+    return sorted_addresses[lo:hi]
+
+
+def function_entries(listing, graph):
+    """Sorted function entry addresses: listing functions, listed call
+    targets and raw call targets with at least MIN_RAW_CALLERS callers."""
+    entries = set(listing.function_starts) | listing.entry_points
+    for target in range(ADDRESS_SPACE):
+        callers = graph.predecessors(target, (EDGE_CALL, EDGE_RAW_CALL)) \
+            if graph.in_offsets[target] != graph.in_offsets[target + 1] else ()
+        listed = sum(1 for _, k in callers if k == EDGE_CALL)
+        if listed or len(callers) >= MIN_RAW_CALLERS:
+            entries.add(target)
+    return sorted(entries)
+
+
+def rank_candidates(listing, image, graph, entries):
+    """[(score, entry, evidence)] for functions with SysEx-like dispatch
+    evidence, best first."""
+    compares = compare_sites(image)
+    all_compares = sorted(a for sites in compares.values() for a in sites)
+    indirect = indirect_jumps(image)
+    loaded = {}
+    a = image.find(bytes((OP_LD_HL_NN,)))
+    while 0 <= a < len(image) - 2:
+        loaded.setdefault(image[a + 1] | image[a + 2] << 8, []).append(a)
+        a = image.find(bytes((OP_LD_HL_NN,)), a + 1)
+    entry_set = set(entries)
+    tables = jump_tables(image, lambda w: w in entry_set or listing.row(w) is not None
+                         and listing.is_code(listing.row(w)))
+
+    per_function = collections.defaultdict(lambda: {"compares": collections.Counter(), "sites": [],
+                                                     "indirect": [], "tables": []})
+
+    def owner(address):
+        i = bisect.bisect_right(entries, address) - 1
+        return entries[i] if i >= 0 else None
+
+    for value, sites in compares.items():
+        for site in sites:
+            f = owner(site)
+            if f is not None:
+                per_function[f]["compares"][value] += 1
+                per_function[f]["sites"].append(site)
+    for f, ev in per_function.items():
+        for site in ev["sites"]:
+            for j in _near(indirect, site, 0, INDIRECT_NEAR):
+                if j not in ev["indirect"]:
+                    ev["indirect"].append(j)
+    for start, targets in tables:
+        users = set(owner(r) for r in loaded.get(start, ()))
+        near = _near(all_compares, start, JUMP_TABLE_NEAR, JUMP_TABLE_NEAR)
+        users.update(owner(s) for s in near)
+        for f in users:
+            if f in per_function:
+                per_function[f]["tables"].append((start, len(targets)))
+
+    ranked = []
+    for f, ev in per_function.items():
+        score = sum(SYSEX_COMPARES[v] for v in ev["compares"])
+        sites = sorted(ev["sites"])
+        clustered = any(b - a <= COMPARE_CLUSTER and image[a + 1] != image[b + 1]
+                        for a, b in zip(sites, sites[1:]))
+        if clustered:
+            score += 3
+        score += 2 * min(len(ev["indirect"]), 2) + 3 * min(len(ev["tables"]), 2)
+        callers = len(graph.predecessors(f, (EDGE_CALL, EDGE_RAW_CALL)))
+        ev["callers"] = callers
+        ev["clustered"] = clustered
+        ranked.append((score, f, ev))
+    ranked.sort(key=lambda r: (-r[0], r[1]))
+    return ranked
+
+
+def report(listing_path: str, image_path: str = None, top: int = 20, cache=None):
+    t0 = time.perf_counter()
+    listing = z80.load(listing_path, cache)
+    t1 = time.perf_counter()
+    if image_path:
+        with fwa.open_image(image_path) as data:
+            image = bytes(data[:ADDRESS_SPACE])
+    else:
+        image = bytes(listing.image)
+
+    code_mask = _listed_code_mask(listing)
+    edges = listing_edges(listing) + raw_edges(image, code_mask)
+    graph = XrefGraph(edges)
+    t2 = time.perf_counter()
+    roots = sorted(listing.entry_points | set(listing.function_starts))
+    seen = graph.reachable(roots)
+    t3 = time.perf_counter()
+    entries = function_entries(listing, graph)
+    ranked = rank_candidates(listing, image, graph, entries)
+    t4 = time.perf_counter()
+
+    kinds = collections.Counter(graph.out_kinds)
+    print(f"\n=== SysEx handler candidates ({image_path or listing_path}) ===")
+    print(f"  graph: {graph.edge_count} edges ("
+          + ", ".join(f"{EDGE_NAMES[k]} {kinds[k]}" for k in sorted(kinds)) + f"), "
+          f"{len(entries)} function entries")
+    print(f"  reachable from {len(roots)} listed entry points: {sum(seen)} addresses")
+    print(f"  timing: listing {1000 * (t1 - t0):.0f} ms, graph {1000 * (t2 - t1):.0f} ms, "
+          f"traversal {1000 * (t3 - t2):.0f} ms, ranking {1000 * (t4 - t3):.0f} ms")
+    print(f"  top {min(top, len(ranked))} of {len(ranked)} functions with compare evidence:")
+    for score, f, ev in ranked[:top]:
+        names = ", ".join(listing.labels_for(f)) or "-"
+        cmp_text = " ".join(f"CP {v:#04x} ({n})" for v, n in sorted(ev["compares"].items()))
+        print(f"    {score:3}  {f:#06x}  {names:16} {cmp_text}{'  clustered' if ev['clustered'] else ''}")
+        extra = []
+        if ev["indirect"]:
+            extra.append("indirect jumps at " + ", ".join(f"{a:#06x}" for a in ev["indirect"][:4]))
+        if ev["tables"]:
+            extra.append("tables at " + ", ".join(f"{s:#06x}[{n}]" for s, n in ev["tables"][:4]))
+        extra.append(f"{ev['callers']} callers")
+        print("            " + "; ".join(extra))
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    listing_path = z80.DEFAULT_LISTING
+    image_path = None
+    top = 20
+    use_cache = True
+    it = iter(args)
+    for a in it:
+        if a == "--listing":
+            listing_path = cli.option_value(it, a, __doc__)
+        elif a == "--image":
+            image_path = cli.option_value(it, a, __doc__)
+        elif a == "--top":
+            top = cli.int_option(it, a, __doc__)
+        elif a == "--no-cache":
+            use_cache = False
+        elif a in ("-h", "--help"):
+            print(__doc__)
+            sys.exit(0)
+        else:
+            print(__doc__)
+            sys.exit(1)
+    report(listing_path, image_path, top, fwa.ResultCache() if use_cache else None)
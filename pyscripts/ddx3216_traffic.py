@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+ddx3216_traffic.py
+
+Where does the MIDI bandwidth go? Reads a capture made by
+ddx3216_capture.py in one streaming pass and breaks the traffic down by
+direction, function code, module and parameter, and per second.
+
+Every message goes through the ddx3216_protocol parsers. 0x20 and 0x22
+frames are split into their entries, and each entry is charged its own
+bytes plus a share of the frame header. Fader and pan CCs count as that
+channel's volume or pan, so the CC and SysEx paths can be compared.
+
+It also finds:
+
+  * redundant writes -- a parameter sent again in the same direction with
+    the value it already had, with nothing written to it in between (a
+    value that returns after the other side moved it isn't redundant);
+  * echoes -- a value arriving from the desk and FL writing the same
+    parameter back within --window ms (default 50). A bounce is the desk
+    then answering that echo within the window again, which is the start
+    of a feedback loop.
+
+Memory is bounded by the parameter space, not by the capture length: only
+per-key totals, last values and last times are kept, plus one counter per
+second. So hour-long captures stream through in constant memory.
+
+--folded writes "direction;function;module;param bytes" lines, which
+flamegraph.pl or speedscope turn into a flame graph. The same tree is
+printed, pruned at 1%, at the end of the report.
+
+Usage:
+    python3 ddx3216_traffic.py CAPTURE [--window MS] [--from S] [--to S]
+        [--top N] [--folded OUT] [--json OUT]
+"""
+
+import os
+import sys
+import json
+import collections
+from array import array
+
+import ddx3216_capture as capture
+import ddx3216_cli as cli
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "FLStudioMidiScript", "FLStudio_DDX3216"))
+import ddx3216_protocol as proto  # noqa: E402
+from ddx3216_scheduler import MIDI_BYTES_PER_SECOND  # noqa: E402
+
+DEFAULT_ECHO_WINDOW = 0.050
+DEFAULT_TOP = 10
+TREE_MIN_SHARE = 0.01
+NO_MODULE = -1
+
+_PARAM_NAMES = {proto.PARAM_VOLUME: "volume", proto.PARAM_MUTE: "mute", proto.PARAM_PAN: "pan"}
+
+
+def module_name(module: int) -> str:
+    if module == NO_MODULE:
+        return "-"
+    if proto.MODULE_CHANNEL_BASE <= module < proto.MODULE_CHANNEL_BASE + 32:
+        return f"ch {module - proto.MODULE_CHANNEL_BASE + 1}"
+    if module == proto.MODULE_MASTER_LEFT:
+        return "master L"
+    if module == proto.MODULE_MASTER_RIGHT:
+        return "master R"
+    return f"module {module}"
+
+
+def param_name(param: int) -> str:
+    if param == NO_MODULE:
+        return "-"
+    return _PARAM_NAMES.get(param, f"param {param}")
+
+
+def message_entries(data):
+    """[(module, param, value, bytes)] for one message: a 0x20/0x22 frame's
+    entries with the header shared between them, a fader/pan CC as its
+    channel's volume/pan, anything else as one (NO_MODULE, NO_MODULE)
+    entry carrying the whole message."""
+    size = len(data)
+    if data[0] == 0xF0:
+        function = proto.sysex_function(data)
+        if function == proto.FUNC_PARAM_CHANGE:
+            changes = proto.parse_param_change_sysex(data)
+            if changes:
+                share = size / len(changes)
+                return [(module, param, raw, share) for module, param, raw in changes]
+        elif function == proto.FUNC_CHANNEL_ATTENUATION:
+            changes = proto.parse_attenuation_sysex(data)
+            if changes:
+                share = size / len(changes)
+                return [(proto.MODULE_CHANNEL_BASE + channel, proto.PARAM_VOLUME, raw, share)
+                        for channel, raw in changes]
+    elif data[0] & 0xF0 == 0xB0 and size == 3:
+        cc = data[1]
+        if proto.is_fader_cc(cc):
+            return [(proto.MODULE_CHANNEL_BASE + proto.cc_to_channel_index(cc), proto.PARAM_VOLUME,
+                     data[2], size)]
+        if proto.is_pan_cc(cc):
+            return [(proto.MODULE_CHANNEL_BASE + proto.cc_to_channel_index(cc), proto.PARAM_PAN,
+                     data[2], size)]
+    return [(NO_MODULE, NO_MODULE, None, size)]
+
+
+class TrafficAnalyzer:
+    """Streaming aggregation over (t, direction, data) records."""
+
+    def __init__(self, echo_window: float = DEFAULT_ECHO_WINDOW):
+        self.echo_window = echo_window
+        self.by_kind = collections.defaultdict(lambda: [0, 0])            # (dir, kind) -> [messages, bytes]
+        self.by_param = collections.defaultdict(lambda: [0, 0.0])         # (dir, kind, module, param) -> [entries, bytes]
+        self.per_second = (array("I"), array("I"))
+        self.redundant = collections.defaultdict(lambda: [0, 0.0])        # (dir, kind, module, param) -> [entries, bytes]
+        self.echoes = collections.Counter()                               # (module, param) -> count
+        self.bounces = collections.Counter()
+        self.echo_latency = proto.LatencyRing()
+        self.messages = 0
+        self.bytes = [0, 0]
+        self.first = None
+        self.last = 0.0
+        self._last_write = {}      # (module, param) -> (dir, kind, value)
+        self._last_in = {}         # (module, param) -> t
+        self._last_echo = {}       # (module, param) -> t
+
+    def feed(self, t: float, direction: int, data):
+        if self.first is None:
+            self.first = t
+        self.last = t
+        self.messages += 1
+        self.bytes[direction] += len(data)
+        kind = capture.message_kind(data)
+        row = self.by_kind[(direction, kind)]
+        row[0] += 1
+        row[1] += len(data)
+
+        second = int(t - self.first)
+        if second >= len(self.per_second[0]):
+            grow = array("I", bytes(4 * (second + 1 - len(self.per_second[0]))))
+            for series in self.per_second:
+                series.extend(grow)
+        self.per_second[direction][second] += len(data)
+
+        window = self.echo_window
+        for module, param, value, size in message_entries(data):
+            key = (direction, kind, module, param)
+            row = self.by_param[key]
+            row[0] += 1
+            row[1] += size
+            if value is None:
+                continue
+            target = (module, param)
+            write = (direction, kind, value)
+            if self._last_write.get(target) == write:
+                row = self.redundant[key]
+                row[0] += 1
+                row[1] += size
+            self._last_write[target] = write
+
+            if direction == capture.DIR_IN:
+                echoed = self._last_echo.get(target)
+                if echoed is not None and t - echoed <= window:
+                    self.bounces[target] += 1
+                self._last_in[target] = t
+            else:
+                received = self._last_in.get(target)
+                if received is not None and t - received <= window:
+                    self.echoes[target] += 1
+                    self.echo_latency.add(t - received)
+                    self._last_echo[target] = t
+                    del self._last_in[target]
+
+    def feed_all(self, records):
+        for t, direction, data in records:
+            self.feed(t, direction, data)
+        return self
+
+    @property
+    def duration(self) -> float:
+        return self.last - self.first if self.first is not None else 0.0
+
+    def folded(self):
+        """Flame-graph input: one "dir;kind;module;param bytes" line per key."""
+        lines = []
+        for (direction, kind, module, param), (_, size) in sorted(self.by_param.items()):
+            frames = [capture.DIRECTION_NAMES[direction], kind]
+            if module != NO_MODULE:
+                frames += [module_name(module), param_name(param)]
+            lines.append(f"{';'.join(frames)} {round(size)}")
+        return lines
+
+    def to_dict(self) -> dict:
+        def rows(table):
+            return [[capture.DIRECTION_NAMES[key[0]], key[1], module_name(key[2]), param_name(key[3]),
+                     value[0], round(value[1], 1)] for key, value in table.items()]
+        return {
+            "duration_s": self.duration,
+            "messages": self.messages,
+            "bytes": {"in": self.bytes[0], "out": self.bytes[1]},
+            "by_kind": [[capture.DIRECTION_NAMES[d], kind, v[0], v[1]] for (d, kind), v in self.by_kind.items()],
+            "by_param": rows(self.by_param),
+            "redundant": rows(self.redundant),
+            "echoes": [[module_name(m), param_name(p), n] for (m, p), n in self.echoes.most_common()],
+            "bounces": [[module_name(m), param_name(p), n] for (m, p), n in self.bounces.most_common()],
+            "per_second": {"in": list(self.per_second[0]), "out": list(self.per_second[1])},
+        }
+
+
+def _percent(part: float, whole: float) -> str:
+    return f"{part / whole * 100.0:5.1f}%" if whole else "    -"
+
+
+def _print_tree(analyzer: TrafficAnalyzer):
+    total = float(sum(analyzer.bytes))
+    tree = {}
+    for (direction, kind, module, param), (_, size) in analyzer.by_param.items():
+        path = [capture.DIRECTION_NAMES[direction], kind]
+        if module != NO_MODULE:
+            path += [module_name(module), param_name(param)]
+        node = tree
+        for frame in path:
+            entry = node.setdefault(frame, [0.0, {}])
+            entry[0] += size
+            node = entry[1]
+
+    def walk(node, depth):
+        for name, (size, children) in sorted(node.items(), key=lambda item: -item[1][0]):
+            if size < total * TREE_MIN_SHARE:
+                continue
+            print(f"  {'  ' * depth}{name:{max(1, 28 - 2 * depth)}} {round(size):10} {_percent(size, total)}")
+            walk(children, depth + 1)
+
+    print("bytes by direction / function / module / param (>= 1%):")
+    walk(tree, 0)
+
+
+def print_report(path: str, analyzer: TrafficAnalyzer, top: int = DEFAULT_TOP):
+    duration = analyzer.duration
+    total = sum(analyzer.bytes)
+    print(f"=== Traffic: {path} ===")
+    print(f"{analyzer.messages} messages, {total} bytes over {duration:.1f} s")
+    for direction, name in enumerate(capture.DIRECTION_NAMES):
+        series = sorted(analyzer.per_second[direction])
+        if not series:
+            continue
+        p95 = series[min(len(series) - 1, int(len(series) * 0.95))]
+        print(f"  {name:4} {analyzer.bytes[direction]:10} bytes  "
+              f"avg {analyzer.bytes[direction] / max(duration, 1.0):7.0f} B/s  "
+              f"p95 {p95:6} B/s  max {series[-1]:6} B/s  "
+              f"(link {MIDI_BYTES_PER_SECOND} B/s, max {series[-1] / MIDI_BYTES_PER_SECOND * 100.0:.0f}%)")
+
+    print("by function:")
+    for (direction, kind), (count, size) in sorted(analyzer.by_kind.items(), key=lambda item: -item[1][1]):
+        print(f"  {capture.DIRECTION_NAMES[direction]:4} {kind:12} {count:9} msgs {size:10} bytes "
+              f"{_percent(size, total)}")
+
+    print(f"top {top} parameters:")
+    ranked = sorted(((key, value) for key, value in analyzer.by_param.items() if key[2] != NO_MODULE),
+                    key=lambda item: -item[1][1])
+    for (direction, kind, module, param), (count, size) in ranked[:top]:
+        print(f"  {capture.DIRECTION_NAMES[direction]:4} {kind:12} {module_name(module):10} "
+              f"{param_name(param):8} {count:8} writes {round(size):9} bytes {_percent(size, total)}")
+
+    redundant_bytes = sum(value[1] for value in analyzer.redundant.values())
+    print(f"redundant writes: {sum(v[0] for v in analyzer.redundant.values())} "
+          f"({round(redundant_bytes)} bytes, {_percent(redundant_bytes, total).strip()} of all traffic)")
+    for (direction, kind, module, param), (count, size) in sorted(
+            analyzer.redundant.items(), key=lambda item: -item[1][1])[:top]:
+        print(f"  {capture.DIRECTION_NAMES[direction]:4} {kind:12} {module_name(module):10} "
+              f"{param_name(param):8} {count:8} resends {round(size):9} bytes")
+
+    echoes = sum(analyzer.echoes.values())
+    print(f"echoes (in -> out within {analyzer.echo_window * 1000.0:.0f} ms): {echoes}", end="")
+    if echoes:
+        ring = analyzer.echo_latency
+        print(f"  latency p50 {ring.percentile(50) * 1000.0:.1f} ms  p99 {ring.percentile(99) * 1000.0:.1f} ms  "
+              f"bounces back: {sum(analyzer.bounces.values())}")
+        for (module, param), count in analyzer.echoes.most_common(top):
+            print(f"  {module_name(module):10} {param_name(param):8} {count:8} echoes "
+                  f"{analyzer.bounces.get((module, param), 0):8} bounces")
+    else:
+        print()
+
+    busiest = sorted(range(len(analyzer.per_second[0])),
+                     key=lambda s: -(analyzer.per_second[0][s] + analyzer.per_second[1][s]))[:5]
+    if busiest:
+        print("busiest seconds: " + ", ".join(
+            f"t+{s}s {analyzer.per_second[0][s] + analyzer.per_second[1][s]} B" for s in busiest))
+    _print_tree(analyzer)
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    paths = []
+    window = DEFAULT_ECHO_WINDOW
+    start = 0.0
+    end = None
+    top = DEFAULT_TOP
+    folded_out = None
+    json_out = None
+    it = iter(args)
+    for a in it:
+        if a == "--window":
+            window = cli.float_option(it, a, __doc__) / 1000.0
+        elif a == "--from":
+            start = cli.float_option(it, a, __doc__)
+        elif a == "--to":
+            end = cli.float_option(it, a, __doc__)
+        elif a == "--top":
+            top = cli.int_option(it, a, __doc__)
+        elif a == "--folded":
+            folded_out = cli.option_value(it, a, __doc__)
+        elif a == "--json":
+            json_out = cli.option_value(it, a, __doc__)
+        else:
+            paths.append(a)
+    if len(paths) != 1:
+        print(__doc__)
+        sys.exit(1)
+
+    with capture.CaptureReader(paths[0]) as reader:
+        analyzer = TrafficAnalyzer(window).feed_all(reader.records(start, end))
+    print_report(paths[0], analyzer, top)
+    if folded_out:
+        with open(folded_out, "w") as f:
+            f.write("\n".join(analyzer.folded()) + "\n")
+    if json_out:
+        with open(json_out, "w") as f:
+            json.dump(analyzer.to_dict(), f, indent=1)
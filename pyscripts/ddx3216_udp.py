@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+ddx3216_udp.py
+
+UDP transport for the desktop tools: DDX3216 messages (F0 ... F7 SysEx or
+short messages) carried in datagrams, for a desk behind a network MIDI
+bridge or the emulator on another machine.
+
+UdpTransport is a ddx3216_transport.Transport:
+
+  * send_frames() packs as many whole frames as fit in max_datagram into
+    each datagram and hands the frames themselves to sendmsg(), so a batch
+    is gathered by the kernel rather than joined into a new bytes object;
+  * a reader thread receives into one reusable bytearray (recvfrom_into)
+    and feeds it through ddx3216_protocol.SysExAssembler, so a frame split
+    across datagrams still comes out whole;
+  * without a fixed peer it answers whoever sent the last datagram, which
+    is how serve_desk_on_udp() runs an emulated desk.
+
+UDP doesn't retransmit. The bulk dump flow survives a lost block (the host
+asks again after a timeout); a lost parameter change is simply lost, as it
+would be on a MIDI cable with a loose plug.
+
+Usage:
+    python3 ddx3216_udp.py --selftest
+    python3 ddx3216_udp.py --serve HOST:PORT [--channel N] [--bps N]
+    python3 ddx3216_udp.py --connect HOST:PORT [--channel N]
+        (--ping | --download OUT | --upload FILE)
+"""
+
+import os
+import sys
+import time
+import socket
+import threading
+
+import ddx3216_cli as cli
+import ddx3216_desk_emulator as emulator
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "FLStudioMidiScript", "FLStudio_DDX3216"))
+import ddx3216_protocol as proto  # noqa: E402
+from ddx3216_scheduler import MIDI_BYTES_PER_SECOND  # noqa: E402
+from ddx3216_transport import Transport  # noqa: E402
+
+DEFAULT_PORT = emulator.DEFAULT_PORT
+MAX_DATAGRAM = 1472            # Ethernet MTU minus IPv4 and UDP headers
+RECEIVE_BUFFER = 65536         # largest possible datagram
+POLL_INTERVAL = 0.2            # how often the reader checks for close()
+
+
+def _address(text: str):
+    host, _, port = text.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def _address_option(it, option: str):
+    text = cli.option_value(it, option, __doc__)
+    try:
+        return _address(text)
+    except ValueError:
+        cli.usage_error(f"{option}: not HOST:PORT: {text}", __doc__)
+
+
+class UdpTransport(Transport):
+    """Datagram link on `sock`, which it owns and closes. `peer` is the
+    (host, port) to send to; None means the sender of the last datagram
+    received."""
+
+    name = "udp"
+
+    def __init__(self, sock, peer=None, on_frames=None, max_datagram=MAX_DATAGRAM):
+        Transport.__init__(self, on_frames)
+        self.sock = sock
+        self.peer = peer
+        self.follow_sender = peer is None
+        self.max_datagram = max_datagram
+        self._buffer = bytearray(RECEIVE_BUFFER)
+        self._assembler = proto.SysExAssembler()
+        self._running = True
+        sock.settimeout(POLL_INTERVAL)
+        self._thread = threading.Thread(target=self._reader, daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def connect(cls, address, **kwargs):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        return cls(sock, address, **kwargs)
+
+    @classmethod
+    def bind(cls, address, **kwargs):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(address)
+        return cls(sock, None, **kwargs)
+
+    @property
+    def address(self):
+        return self.sock.getsockname()
+
+    # -- output ------------------------------------------------------------
+
+    def send_frames(self, frames):
+        """Sends whole frames, as many per datagram as fit. Dropped
+        silently while there is no peer to send to."""
+        peer = self.peer
+        if peer is None:
+            return
+        group = []
+        size = 0
+        for frame in frames:
+            if not isinstance(frame, (bytes, bytearray, memoryview)):
+                frame = bytes(frame)
+            if group and size + len(frame) > self.max_datagram:
+                self._send_datagram(group, size, peer)
+                group = []
+                size = 0
+            group.append(frame)
+            size += len(frame)
+        if group:
+            self._send_datagram(group, size, peer)
+
+    def _send_datagram(self, buffers, size, peer):
+        if hasattr(self.sock, "sendmsg"):
+            self.sock.sendmsg(buffers, (), 0, peer)
+        else:
+            self.sock.sendto(b"".join(buffers), peer)
+        self.stats["datagrams_out"] += 1
+        self.stats["frames_out"] += len(buffers)
+        self.stats["bytes_out"] += size
+
+    # -- input -------------------------------------------------------------
+
+    def _reader(self):
+        view = memoryview(self._buffer)
+        while self._running:
+            try:
+                n, sender = self.sock.recvfrom_into(self._buffer)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            if self.follow_sender:
+                self.peer = sender
+            self.stats["datagrams_in"] += 1
+            self._deliver(self._assembler.feed(view[:n]))
+
+    def close(self):
+        self._running = False
+        if self._thread is not threading.current_thread():
+            self._thread.join(POLL_INTERVAL * 2)
+        self.sock.close()
+
+
+def serve_desk_on_udp(desk, address=("127.0.0.1", 0)):
+    """Runs `desk` on a UDP socket bound to `address` (port 0 picks a free
+    one). Returns ((host, port), endpoint, close)."""
+    transport = UdpTransport.bind(address)
+    endpoint = emulator.TransportEndpoint(desk, transport).start()
+
+    def close():
+        endpoint.stop()
+        endpoint.join(1.0)
+        transport.close()
+    return transport.address, endpoint, close
+
+
+def selftest():
+    print("=== DDX3216 UDP transport self-test (localhost) ===")
+    changes = [(module, param, 40 * module + param) for module in range(32)
+               for param in (proto.PARAM_VOLUME, proto.PARAM_PAN)]
+    frames = proto.build_param_change_batch_sysex(changes)
+    for bps, label in ((MIDI_BYTES_PER_SECOND, "MIDI rate modelled"), (0, "unlimited")):
+        desk = emulator.VirtualDesk(bytes_per_second=bps)
+        address, _, close_desk = serve_desk_on_udp(desk)
+        transport = UdpTransport.connect(address)
+        client = emulator.TransportClient(transport)
+        print(f"  desk at {address[0]}:{address[1]}, {label}")
+        t0 = time.perf_counter()
+        settings = emulator.download(client, proto.FUNC_DUMP_SETTINGS)
+        download_time = time.perf_counter() - t0
+        ok = emulator.upload(client, proto.FUNC_DUMP_SETTINGS, settings)
+        again = emulator.download(client, proto.FUNC_DUMP_SETTINGS)
+        t0 = time.perf_counter()
+        client.send_frames(frames)
+        client.request(proto.build_connection_test_sysex())
+        sync_time = time.perf_counter() - t0
+        print(f"    settings download {len(settings)} bytes  {download_time * 1000.0:8.1f} ms")
+        print(f"    full state sync ({len(changes)} params) + ping  {sync_time * 1000.0:8.1f} ms")
+        print(f"    upload ok={ok}  round trip identical={again == settings}  "
+              f"state ok={all(desk.params.get((m, p)) == r for m, p, r in changes)}")
+        print(f"    link: {dict(sorted(transport.stats.items()))}")
+        client.close()
+        close_desk()
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    serve = None
+    connect = None
+    channel = None
+    bps = 0
+    action = None
+    target = None
+    it = iter(args)
+    for a in it:
+        if a == "--serve":
+            serve = _address_option(it, a)
+        elif a == "--connect":
+            connect = _address_option(it, a)
+        elif a == "--channel":
+            channel = cli.int_option(it, a, __doc__)
+        elif a == "--bps":
+            bps = cli.int_option(it, a, __doc__)
+        elif a in ("--selftest", "--ping"):
+            action = a
+        elif a in ("--download", "--upload"):
+            action = a
+            target = cli.option_value(it, a, __doc__)
+        else:
+            print(__doc__)
+            sys.exit(1)
+
+    if action == "--selftest":
+        selftest()
+    elif serve:
+        desk = emulator.VirtualDesk(channel, bps)
+        address, _, close_desk = serve_desk_on_udp(desk, serve)
+        print(f"DDX3216 emulator on udp {address[0]}:{address[1]} (Ctrl-C to stop)")
+        try:
+            while True:
+                time.sleep(1.0)
+        except KeyboardInterrupt:
+            print(f"  {dict(desk.stats)}")
+        close_desk()
+    elif connect and action:
+        client = emulator.TransportClient(UdpTransport.connect(connect))
+        device_byte = proto.device_byte_for_channel(channel)
+        if action == "--ping":
+            t0 = time.perf_counter()
+            reply = client.request(proto.build_connection_test_sysex(device_byte))
+            print(f"reply {reply.hex(' ') if reply else None} after {(time.perf_counter() - t0) * 1000.0:.1f} ms")
+        elif action == "--download":
+            data = emulator.download(client, proto.FUNC_DUMP_SETTINGS, device_byte=device_byte)
+            if data is None:
+                print("download failed")
+                sys.exit(1)
+            with open(target, "wb") as f:
+                f.write(data)
+            print(f"{len(data)} bytes -> {target}")
+        else:
+            with open(target, "rb") as f:
+                ok = emulator.upload(client, proto.FUNC_DUMP_SETTINGS, f.read(), device_byte=device_byte)
+            print("upload ok" if ok else "upload failed")
+            sys.exit(0 if ok else 1)
+        client.close()
+    else:
+        print(__doc__)
+        sys.exit(1)
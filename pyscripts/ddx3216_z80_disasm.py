@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+"""
+ddx3216_z80_disasm.py
+
+Built-in Z80 disassembler and multi-pattern byte scanner for raw DDX3216
+ROM images, so a dump can be looked at without a Ghidra run.
+
+  * disassemble() is a linear sweep driven by opcode tables that are
+    generated once at import for every prefix group (unprefixed, CB, ED,
+    DD/FD, DDCB/FDCB). Decoding an instruction is one or two table lookups
+    plus operand formatting; each entry also records the control-flow kind
+    and branch target, for call-graph work.
+  * PatternScanner matches many byte signatures in a single pass
+    (Aho-Corasick, compiled to a flat 256-way transition table), e.g. every
+    protocol constant in PROTOCOL_SIGNATURES at once over each ROM revision.
+
+Both work directly on memory-mapped images (ddx3216_fw_analyze.open_image).
+
+Usage:
+    python3 ddx3216_z80_disasm.py [--base N] [--start A] [--end B] <image.bin>
+    python3 ddx3216_z80_disasm.py --scan [--base N] <image.bin> [image2.bin ...]
+"""
+
+import os
+import re
+import sys
+import collections
+from array import array
+
+import ddx3216_cli as cli
+import ddx3216_fw_analyze as fwa
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "FLStudioMidiScript", "FLStudio_DDX3216"))
+import ddx3216_protocol as proto  # noqa: E402
+
+FLOW_NONE = 0
+FLOW_JUMP = 1          # unconditional, direct
+FLOW_JUMP_COND = 2
+FLOW_CALL = 3
+FLOW_CALL_COND = 4
+FLOW_RET = 5
+FLOW_RET_COND = 6
+FLOW_INDIRECT = 7      # JP (HL)/(IX)/(IY)
+FLOW_HALT = 8
+
+Instruction = collections.namedtuple("Instruction", "address size mnemonic operands flow target")
+
+# -- opcode tables -------------------------------------------------------
+#
+# Each table maps an opcode byte to (mnemonic, operand template, fields,
+# flow). `fields` lists the operand bytes that follow the opcode, in order:
+# "n" byte, "nn" word, "e" relative branch offset, "d" index displacement.
+# The template refers to them as {n} {nn} {e} {d}.
+
+_R = ("B", "C", "D", "E", "H", "L", "(HL)", "A")
+_RP = ("BC", "DE", "HL", "SP")
+_RP2 = ("BC", "DE", "HL", "AF")
+_CC = ("NZ", "Z", "NC", "C", "PO", "PE", "P", "M")
+_ALU = (("ADD", "A,"), ("ADC", "A,"), ("SUB", ""), ("SBC", "A,"),
+        ("AND", ""), ("XOR", ""), ("OR", ""), ("CP", ""))
+_ROT = ("RLC", "RRC", "RL", "RR", "SLA", "SRA", "SLL", "SRL")
+_IM = ("0", "0/1", "1", "2", "0", "0/1", "1", "2")
+_BLI = (("LDI", "CPI", "INI", "OUTI"), ("LDD", "CPD", "IND", "OUTD"),
+        ("LDIR", "CPIR", "INIR", "OTIR"), ("LDDR", "CPDR", "INDR", "OTDR"))
+_FIELD_SIZE = {"n": 1, "nn": 2, "e": 1, "d": 1}
+
+
+def _base_entry(op):
+    x, y, z = op >> 6, (op >> 3) & 7, op & 7
+    p, q = y >> 1, y & 1
+    if x == 0:
+        if z == 0:
+            if y == 0:
+                return "NOP", "", (), FLOW_NONE
+            if y == 1:
+                return "EX", "AF,AF'", (), FLOW_NONE
+            if y == 2:
+                return "DJNZ", "{e}", ("e",), FLOW_JUMP_COND
+            if y == 3:
+                return "JR", "{e}", ("e",), FLOW_JUMP
+            return "JR", _CC[y - 4] + ",{e}", ("e",), FLOW_JUMP_COND
+        if z == 1:
+            if q == 0:
+                return "LD", _RP[p] + ",{nn}", ("nn",), FLOW_NONE
+            return "ADD", "HL," + _RP[p], (), FLOW_NONE
+        if z == 2:
+            return (("LD", "(BC),A", (), FLOW_NONE), ("LD", "(DE),A", (), FLOW_NONE),
+                    ("LD", "({nn}),HL", ("nn",), FLOW_NONE), ("LD", "({nn}),A", ("nn",), FLOW_NONE),
+                    ("LD", "A,(BC)", (), FLOW_NONE), ("LD", "A,(DE)", (), FLOW_NONE),
+                    ("LD", "HL,({nn})", ("nn",), FLOW_NONE), ("LD", "A,({nn})", ("nn",), FLOW_NONE))[q * 4 + p]
+        if z == 3:
+            return ("INC" if q == 0 else "DEC"), _RP[p], (), FLOW_NONE
+        if z == 4:
+            return "INC", _R[y], (), FLOW_NONE
+        if z == 5:
+            return "DEC", _R[y], (), FLOW_NONE
+        if z == 6:
+            return "LD", _R[y] + ",{n}", ("n",), FLOW_NONE
+        return ("RLCA", "RRCA", "RLA", "RRA", "DAA", "CPL", "SCF", "CCF")[y], "", (), FLOW_NONE
+    if x == 1:
+        if y == 6 and z == 6:
+            return "HALT", "", (), FLOW_HALT
+        return "LD", _R[y] + "," + _R[z], (), FLOW_NONE
+    if x == 2:
+        return _ALU[y][0], _ALU[y][1] + _R[z], (), FLOW_NONE
+    if z == 0:
+        return "RET", _CC[y], (), FLOW_RET_COND
+    if z == 1:
+        if q == 0:
+            return "POP", _RP2[p], (), FLOW_NONE
+        return (("RET", "", (), FLOW_RET), ("EXX", "", (), FLOW_NONE),
+                ("JP", "(HL)", (), FLOW_INDIRECT), ("LD", "SP,HL", (), FLOW_NONE))[p]
+    if z == 2:
+        return "JP", _CC[y] + ",{nn}", ("nn",), FLOW_JUMP_COND
+    if z == 3:
+        return (("JP", "{nn}", ("nn",), FLOW_JUMP), None,
+                ("OUT", "({n}),A", ("n",), FLOW_NONE), ("IN", "A,({n})", ("n",), FLOW_NONE),
+                ("EX", "(SP),HL", (), FLOW_NONE), ("EX", "DE,HL", (), FLOW_NONE),
+                ("DI", "", (), FLOW_NONE), ("EI", "", (), FLOW_NONE))[y]
+    if z == 4:
+        return "CALL", _CC[y] + ",{nn}", ("nn",), FLOW_CALL_COND
+    if z == 5:
+        if q == 0:
+            return "PUSH", _RP2[p], (), FLOW_NONE
+        return ("CALL", "{nn}", ("nn",), FLOW_CALL) if p == 0 else None
+    if z == 6:
+        return _ALU[y][0], _ALU[y][1] + "{n}", ("n",), FLOW_NONE
+    return "RST", f"{y * 8:#04x}", (), FLOW_CALL
+
+
+def _cb_entry(op):
+    x, y, z = op >> 6, (op >> 3) & 7, op & 7
+    if x == 0:
+        return _ROT[y], _R[z], (), FLOW_NONE
+    return ("BIT", "RES", "SET")[x - 1], f"{y},{_R[z]}", (), FLOW_NONE
+
+
+def _ed_entry(op):
+    x, y, z = op >> 6, (op >> 3) & 7, op & 7
+    p, q = y >> 1, y & 1
+    if x == 1:
+        if z == 0:
+            return ("IN", f"{_R[y]},(C)" if y != 6 else "(C)", (), FLOW_NONE)
+        if z == 1:
+            return ("OUT", f"(C),{_R[y]}" if y != 6 else "(C),0", (), FLOW_NONE)
+        if z == 2:
+            return ("SBC" if q == 0 else "ADC"), "HL," + _RP[p], (), FLOW_NONE
+        if z == 3:
+            if q == 0:
+                return "LD", "({nn})," + _RP[p], ("nn",), FLOW_NONE
+            return "LD", _RP[p] + ",({nn})", ("nn",), FLOW_NONE
+        if z == 4:
+            return "NEG", "", (), FLOW_NONE
+        if z == 5:
+            return ("RETI" if y == 1 else "RETN"), "", (), FLOW_RET
+        if z == 6:
+            return "IM", _IM[y], (), FLOW_NONE
+        return (("LD", "I,A"), ("LD", "R,A"), ("LD", "A,I"), ("LD", "A,R"),
+                ("RRD", ""), ("RLD", ""), ("NOP", ""), ("NOP", ""))[y] + ((), FLOW_NONE)
+    if x == 2 and z <= 3 and y >= 4:
+        return _BLI[y - 4][z], "", (), FLOW_NONE
+    return "NOP*", "", (), FLOW_NONE       # undefined ED opcode: a two-byte no-op
+
+
+def _index_entry(base, op, reg):
+    """DD (reg='IX') / FD (reg='IY') version of unprefixed entry `base`:
+    (HL) becomes (IX+d), and HL/H/L become IX/IXH/IXL when the instruction
+    doesn't also use (HL). Instructions not touching HL keep their meaning
+    (the prefix is ignored by the CPU)."""
+    mnemonic, operands, fields, flow = base
+    if op == 0xE9:
+        return mnemonic, f"({reg})", fields, flow
+    if op == 0xEB:                          # EX DE,HL is unaffected
+        return base
+    if "(HL)" in operands:
+        return mnemonic, operands.replace("(HL)", f"({reg}{{d}})"), ("d",) + fields, flow
+    operands = re.sub(r"\bHL\b", reg, operands)
+    operands = re.sub(r"\bH\b", reg + "H", operands)
+    operands = re.sub(r"\bL\b", reg + "L", operands)
+    return mnemonic, operands, fields, flow
+
+
+def _build_tables():
+    base = [_base_entry(op) for op in range(256)]
+    cb = [_cb_entry(op) for op in range(256)]
+    ed = [_ed_entry(op) for op in range(256)]
+    index = {}
+    index_cb = {}
+    for prefix, reg in ((0xDD, "IX"), (0xFD, "IY")):
+        index[prefix] = [None if base[op] is None else _index_entry(base[op], op, reg) for op in range(256)]
+        index_cb[prefix] = [(m, o.replace("(HL)", f"({reg}{{d}})"), (), f) for m, o, _, f in cb]
+    return base, cb, ed, index, index_cb
+
+
+_BASE, _CB, _ED, _INDEX, _INDEX_CB = _build_tables()
+
+# precomputed total sizes for everything but the CB/DD/ED/FD prefixes
+_BASE_SIZE = array("B", (0 if e is None else 1 + sum(_FIELD_SIZE[f] for f in e[2]) for e in _BASE))
+
+
+def _decode(data, i, end):
+    """(entry, size, prefix length, field offset) of the instruction at i,
+    or None if it runs past `end`."""
+    op = data[i]
+    size = _BASE_SIZE[op]
+    if size:
+        return (_BASE[op], size, 1) if i + size <= end else None
+    if op == 0xCB:
+        return (_CB[data[i + 1]], 2, 2) if i + 2 <= end else None
+    if op == 0xED:
+        if i + 2 > end:
+            return None
+        entry = _ED[data[i + 1]]
+        size = 2 + sum(_FIELD_SIZE[f] for f in entry[2])
+        return (entry, size, 2) if i + size <= end else None
+    # DD / FD
+    if i + 2 > end:
+        return None
+    op2 = data[i + 1]
+    if op2 == 0xCB:
+        if i + 4 > end:
+            return None
+        return (_INDEX_CB[op][data[i + 3]], 4, -1)
+    entry = _INDEX[op][op2]
+    if entry is None:                       # DD DD / DD ED / DD FD ...: prefix alone
+        return ("NOP*", "", (), FLOW_NONE), 1, 1
+    size = 2 + sum(_FIELD_SIZE[f] for f in entry[2])
+    return (entry, size, 2) if i + size <= end else None
+
+
+def disassemble(data, start: int = 0, end: int = None, base: int = 0):
+    """Linear sweep over data[start:end], yielding an Instruction per
+    decoded opcode. Addresses (and branch targets) are image offsets +
+    base. A truncated instruction at the end comes out as a one-byte DB."""
+    end = len(data) if end is None else min(end, len(data))
+    i = start
+    while i < end:
+        decoded = _decode(data, i, end)
+        if decoded is None:
+            yield Instruction(i + base, 1, "DB", f"{data[i]:#04x}", FLOW_NONE, None)
+            i += 1
+            continue
+        (mnemonic, template, fields, flow), size, pos = decoded
+        values = {}
+        target = None
+        if pos < 0:                         # DDCB/FDCB: d sits before the opcode
+            values["d"] = _signed(data[i + 2])
+        else:
+            j = i + pos
+            for f in fields:
+                if f == "nn":
+                    values[f] = data[j] | data[j + 1] << 8
+                    j += 2
+                elif f == "e":
+                    values[f] = (i + size + _signed(data[j]) + base) & 0xFFFF
+                    j += 1
+                elif f == "d":
+                    values[f] = _signed(data[j])
+                    j += 1
+                else:
+                    values[f] = data[j]
+                    j += 1
+        if flow in (FLOW_JUMP, FLOW_JUMP_COND, FLOW_CALL, FLOW_CALL_COND):
+            if "e" in values:
+                target = values["e"]
+            elif "nn" in values:
+                target = values["nn"]
+            elif mnemonic == "RST":
+                target = int(template, 16)
+        yield Instruction(i + base, size, mnemonic, _format(template, values), flow, target)
+        i += size
+
+
+def _signed(b: int) -> int:
+    return b - 256 if b & 0x80 else b
+
+
+def _format(template: str, values) -> str:
+    if not values:
+        return template
+    out = template
+    if "n" in values:
+        out = out.replace("{n}", f"{values['n']:#04x}")
+    if "nn" in values:
+        out = out.replace("{nn}", f"{values['nn']:#06x}")
+    if "e" in values:
+        out = out.replace("{e}", f"{values['e']:#06x}")
+    if "d" in values:
+        out = out.replace("{d}", f"{values['d']:+#05x}")
+    return out
+
+
+# -- multi-pattern scanning --------------------------------------------
+
+class PatternScanner:
+    """Aho-Corasick matcher for a fixed set of byte signatures.
+
+    The trie's failure links are folded into a dense transition table
+    (states x 256, array('I')), so scanning costs one table read per input
+    byte however many patterns there are."""
+
+    def __init__(self, patterns):
+        """patterns: {name: bytes}"""
+        self.names = list(patterns)
+        self.lengths = [len(patterns[n]) for n in self.names]
+        goto = [{}]
+        outputs = [[]]
+        for pid, name in enumerate(self.names):
+            state = 0
+            for b in patterns[name]:
+                nxt = goto[state].get(b)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][b] = nxt
+                    goto.append({})
+                    outputs.append([])
+                state = nxt
+            outputs[state].append(pid)
+
+        count = len(goto)
+        delta = array("I", [0]) * (count * 256)
+        fail = [0] * count
+        queue = collections.deque()
+        for b, s in goto[0].items():
+            delta[b] = s
+            queue.append(s)
+        while queue:
+            state = queue.popleft()
+            outputs[state] = outputs[state] + outputs[fail[state]]
+            row = state * 256
+            fail_row = fail[state] * 256
+            for b in range(256):
+                nxt = goto[state].get(b)
+                if nxt is None:
+                    delta[row + b] = delta[fail_row + b]
+                else:
+                    fail[nxt] = delta[fail_row + b]
+                    delta[row + b] = nxt
+                    queue.append(nxt)
+        self.delta = delta
+        self.outputs = [tuple(o) for o in outputs]
+        self.state_count = count
+
+    def scan(self, data, start: int = 0, end: int = None):
+        """Yields (offset, name) for every occurrence of every pattern in
+        data[start:end], in order of where the match ends."""
+        delta = self.delta
+        outputs = self.outputs
+        names = self.names
+        lengths = self.lengths
+        end = len(data) if end is None else end
+        state = 0
+        i = start
+        for b in memoryview(data)[start:end]:
+            state = delta[state * 256 + b]
+            if outputs[state]:
+                for pid in outputs[state]:
+                    yield i - lengths[pid] + 1, names[pid]
+            i += 1
+
+    def count(self, data):
+        return collections.Counter(name for _, name in self.scan(data))
+
+
+def _protocol_signatures():
+    header = bytes((0xF0,) + proto.MANUFACTURER_ID)
+    sigs = {
+        "sysex header F0 00 20 32": header,
+        "manufacturer id 00 20 32": bytes(proto.MANUFACTURER_ID),
+    }
+    for value, what in ((0xF0, "SysEx start"), (0xF7, "SysEx end"), (proto.APPARATUS_ID, "apparatus id"),
+                        (proto.FUNC_PARAM_CHANGE, "param change"), (proto.FUNC_CHANNEL_ATTENUATION, "attenuation"),
+                        (proto.MANUFACTURER_ID[2], "manufacturer byte 3")):
+        sigs[f"CP {value:#04x} ({what})"] = bytes((0xFE, value))
+        sigs[f"LD A,{value:#04x} ({what})"] = bytes((0x3E, value))
+    return sigs
+
+
+PROTOCOL_SIGNATURES = _protocol_signatures()
+SCAN_HITS_SHOWN = 20
+
+
+def scan_report(paths, base: int = 0, signatures=None):
+    scanner = PatternScanner(signatures or PROTOCOL_SIGNATURES)
+    for path in paths:
+        with fwa.open_image(path) as data:
+            hits = collections.defaultdict(list)
+            for offset, name in scanner.scan(data):
+                hits[name].append(offset)
+            print(f"\n=== scan {path} ({len(data)} bytes, {len(scanner.names)} signatures) ===")
+            for name in scanner.names:
+                offsets = hits.get(name, [])
+                print(f"  {len(offsets):6}  {name}")
+                for offset in offsets[:SCAN_HITS_SHOWN]:
+                    insn = next(disassemble(data, offset, offset + 4, base))
+                    print(f"            {offset + base:#07x}  {insn.mnemonic} {insn.operands}".rstrip())
+                if len(offsets) > SCAN_HITS_SHOWN:
+                    print(f"            ... {len(offsets) - SCAN_HITS_SHOWN} more")
+
+
+def print_disassembly(path: str, start: int = 0, end: int = None, base: int = 0):
+    with fwa.open_image(path) as data:
+        for insn in disassemble(data, start, end, base):
+            raw = bytes(data[insn.address - base:insn.address - base + insn.size]).hex(" ")
+            print(f"{insn.address:#07x}  {raw:12} {insn.mnemonic:5} {insn.operands}".rstrip())
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    scan = False
+    base = 0
+    start = 0
+    end = None
+    files = []
+    it = iter(args)
+    for a in it:
+        if a == "--scan":
+            scan = True
+        elif a == "--base":
+            base = cli.int_option(it, a, __doc__, 0)
+        elif a == "--start":
+            start = cli.int_option(it, a, __doc__, 0)
+        elif a == "--end":
+            end = cli.int_option(it, a, __doc__, 0)
+        else:
+            files.append(a)
+    if not files or (not scan and len(files) != 1):
+        print(__doc__)
+        sys.exit(1)
+    if scan:
+        scan_report(files, base)
+    else:
+        print_disassembly(files[0], start, end, base)
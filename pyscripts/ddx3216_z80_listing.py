@@ -0,0 +1,445 @@
+#!/usr/bin/env python3
+"""
+ddx3216_z80_listing.py
+
+Indexed loader for the Ghidra text listing of the DDX3216's Z80 flash
+(CPUIC16_FlashBINZ80.txt at the repo root).
+
+The listing is streamed once, line by line, into a compact store:
+
+  * every listed address (code or "??" data byte) as one row in parallel
+    arrays -- address, size, interned mnemonic, interned operand text --
+    plus a 64K address -> row table and the raw bytes as a 64K image;
+  * labels (name <-> address, including Ghidra's "LAB_x+1" offcut forms),
+    functions (from the FUNCTION banners) and entry points;
+  * every XREF edge (from, to, kind), sorted by target, with a by-source
+    permutation alongside.
+
+Address lookups are O(1), label lookups O(1), "who references X" and
+"what does X reference" O(log n). The parsed store's fields are pickled
+into the ddx3216_fw_analyze.py result cache as plain builtins (no class
+from this module, so any script sharing the cache can read the entry),
+keyed by the listing's content hash, so reloading an unchanged listing
+doesn't reparse it.
+
+The decompiler output appended after the listing (from the "====" line on)
+is not parsed.
+
+Usage:
+    python3 ddx3216_z80_listing.py [--listing FILE] [--no-cache] <address|label> [...]
+    python3 ddx3216_z80_listing.py --selftest
+"""
+
+import os
+import re
+import sys
+import bisect
+from array import array
+
+import ddx3216_cli as cli
+import ddx3216_fw_analyze as fwa
+
+# bump when the parsed store's layout or contents change, so stale cache entries are ignored
+LISTING_FORMAT_VERSION = 3
+ADDRESS_SPACE = 0x10000
+DEFAULT_LISTING = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "CPUIC16_FlashBINZ80.txt")
+
+DATA_MNEMONIC = "??"
+# Ghidra's data rows: "??" for a bare byte, "undefinedN" for an N-byte
+# datum it was told to type but not decode
+_DATA_MNEMONIC_RE = re.compile(r"^(?:\?\?|undefined\d*)$")
+
+# reference kinds as Ghidra prints them in XREF lists
+REF_KINDS = ("j", "c", "R", "W", "*")
+REF_ENTRY = "*"
+
+_INSN_RE = re.compile(r"^ {8}\w+:([0-9a-f]{4}) ([0-9a-f]{2}(?: [0-9a-f]{2})*)\s+(\S+)(?: +(.*?))?\s*$")
+_LABEL_RE = re.compile(r"^ {29}([A-Za-z_]\w*(?:\+\d+)?)(?: \(\w+:([0-9a-f]{4})\+(\d+)\))?(?:\s+(.*))?$")
+_CONTINUATION_RE = re.compile(r"^ {80,}(\S.*)$")
+_SIGNATURE_RE = re.compile(r"^ +\w+ (\w+)\(.*\)\s*$")
+_XREF_HEAD_RE = re.compile(r"XREF\[([\d,]+)\]:\s*")
+_REF_RE = re.compile(r"(?:(\S+?):([0-9a-f]{4})|Entry Point)\(([^)]*)\)")
+_OFFCUT_RE = re.compile(r"^(\w+)\+(\d+)$")
+
+
+# Two stacked-label blocks from the listing, for --selftest: 0x0062/0x0063
+# share one XREF[8,8] list, 0x8417/0x8418 an XREF[1,1] one.
+_STACKED_SAMPLE = (
+    '        ram:0061 00              NOP',
+    '                             LAB_ram_0062+1                                  XREF[8,8]:   FUN_ram_8080:7ff8(R),',
+    '                             LAB_ram_0062                                                 FUN_ram_8080:8173(R),',
+    '                                                                                          FUN_ram_8080:81c6(R),',
+    '                                                                                          FUN_ram_8080:8341(R),',
+    '                                                                                          FUN_ram_8080:8394(R),',
+    '                                                                                          FUN_ram_8080:850f(R),',
+    '                                                                                          FUN_ram_8080:8562(R),',
+    '                                                                                          FUN_ram_8080:86dd(R),',
+    '                                                                                          FUN_ram_8080:8006(R),',
+    '                                                                                          FUN_ram_8080:8181(R),',
+    '                                                                                          FUN_ram_8080:81d4(R),',
+    '                                                                                          FUN_ram_8080:834f(R),',
+    '                                                                                          FUN_ram_8080:83a2(R),',
+    '                                                                                          FUN_ram_8080:851d(R),',
+    '                                                                                          FUN_ram_8080:8570(R),',
+    '                                                                                          FUN_ram_8080:86eb(R)',
+    '        ram:0062 11 90 80        LD         DE,0x8090',
+    '        ram:8414 22 0d 80        LD         (LAB_ram_800c+1),HL',
+    '                             LAB_ram_8417+1                                  XREF[1,1]:   ram:83b5(j), NMI_ISR:00c8(W)',
+    '                             LAB_ram_8417',
+    '        ram:8417 3a 03 02        LD         A,(DAT_ram_0203)                                 = 19h',
+)
+
+
+class Z80Listing:
+    """Parsed listing. Build with parse() or load(); all fields are plain
+    arrays/dicts so the whole object pickles compactly."""
+
+    def __init__(self):
+        self.image = bytearray(ADDRESS_SPACE)
+        self.row_at = array("i", [-1]) * ADDRESS_SPACE
+        # one row per listed address
+        self.addr = array("H")
+        self.size = array("B")
+        self.mnemonic = array("H")
+        self.operand = array("I")
+        self.mnemonics = []
+        self.operands = [""]
+        self.comments = {}              # row -> trailing comment text
+
+        self.labels = {}                # name -> address
+        self.labels_at = {}             # address -> [names]
+        self.functions = {}             # name -> entry address
+        self.function_starts = []       # sorted entry addresses
+        self.function_names = []        # parallel to function_starts
+        self.entry_points = set()
+
+        # XREF edges sorted by (to, from); _by_from is a permutation of edge
+        # indices sorted by (from, to)
+        self.xref_to = array("H")
+        self.xref_from = array("H")
+        self.xref_kind = array("B")
+        self.ref_kinds = list(REF_KINDS)
+        self._by_from = array("I")
+        self._from_keys = array("H")
+
+    def __len__(self):
+        return len(self.addr)
+
+    def state(self) -> dict:
+        """The fields as a dict of builtins, for the result cache."""
+        return dict(vars(self))
+
+    @classmethod
+    def from_state(cls, state: dict) -> "Z80Listing":
+        listing = cls.__new__(cls)
+        listing.__dict__.update(state)
+        return listing
+
+    # -- building ---------------------------------------------------------
+
+    @classmethod
+    def parse(cls, lines):
+        """Builds the store from an iterable of listing lines (a file object
+        is fine -- nothing is held beyond the current line)."""
+        listing = cls()
+        mnemonic_ids = {}
+        operand_ids = {"": 0}
+        kind_ids = {k: i for i, k in enumerate(listing.ref_kinds)}
+        pending_labels = []             # [name, address or None, offset, entry point?] awaiting the next row
+        pending_refs = []               # [owning label, XREF counts, [(from, kind) or None]] likewise
+        edges = []
+        signatures = []
+        in_banner = False
+
+        def add_refs(text, group):
+            for m in _REF_RE.finditer(_XREF_HEAD_RE.sub("", text, 1)):
+                if m.group(2) is None:
+                    group[2].append(None)   # "Entry Point(*)"
+                    continue
+                kind = m.group(3)
+                if kind not in kind_ids:
+                    kind_ids[kind] = len(listing.ref_kinds)
+                    listing.ref_kinds.append(kind)
+                group[2].append((int(m.group(2), 16), kind_ids[kind]))
+
+        for line in lines:
+            if line.startswith("===="):
+                break
+
+            m = _INSN_RE.match(line)
+            if m:
+                address = int(m.group(1), 16)
+                raw = bytes.fromhex(m.group(2))
+                mnemonic = m.group(3)
+                rest = m.group(4) or ""
+                operand, _, comment = rest.partition("  ")
+                if mnemonic == DATA_MNEMONIC:
+                    operand = comment = ""   # just the byte again, and its char
+                row = len(listing.addr)
+                listing.addr.append(address)
+                listing.size.append(len(raw))
+                mid = mnemonic_ids.get(mnemonic)
+                if mid is None:
+                    mid = mnemonic_ids[mnemonic] = len(listing.mnemonics)
+                    listing.mnemonics.append(mnemonic)
+                listing.mnemonic.append(mid)
+                oid = operand_ids.get(operand)
+                if oid is None:
+                    oid = operand_ids[operand] = len(listing.operands)
+                    listing.operands.append(operand)
+                listing.operand.append(oid)
+                comment = comment.strip()
+                if comment:
+                    listing.comments[row] = comment
+                listing.row_at[address] = row
+                end = min(address + len(raw), ADDRESS_SPACE)
+                listing.image[address:end] = raw[:end - address]
+
+                targets = {}
+                for label in pending_labels:
+                    name, target, offset, _ = label
+                    if target is None:
+                        target = address + offset
+                    targets[name] = target
+                    listing.labels.setdefault(name, target)
+                    listing.labels_at.setdefault(target, []).append(name)
+                # "XREF[m,n]" heads one list for every label at the row: the
+                # first m refs are to the row's own address, the other n to
+                # its offcut label -- which Ghidra lists first
+                for owner, counts, refs in pending_refs:
+                    if len(counts) == 2:
+                        direct = [label for label in pending_labels if targets[label[0]] == address]
+                        offcut = [label for label in pending_labels if targets[label[0]] != address]
+                        split = [(direct[0] if direct else owner, refs[:counts[0]]),
+                                 (offcut[0] if offcut else owner, refs[counts[0]:])]
+                    else:
+                        split = [(owner, refs)]
+                    for label, label_refs in split:
+                        target = targets[label[0]]
+                        for ref in label_refs:
+                            if ref is None:
+                                label[3] = True
+                            else:
+                                edges.append((target, ref[0], ref[1]))
+                for name, target, offset, entry in pending_labels:
+                    if entry:
+                        listing.entry_points.add(targets[name])
+                pending_labels = []
+                pending_refs = []
+                continue
+
+            stripped = line.strip()
+            if stripped.startswith("*"):
+                in_banner = in_banner or "FUNCTION" in stripped
+                continue
+
+            if in_banner:
+                m = _SIGNATURE_RE.match(line)
+                if m and "<UNASSIGNED>" not in line:
+                    signatures.append(m.group(1))
+                    in_banner = False
+                continue
+
+            m = _LABEL_RE.match(line)
+            if m:
+                name, explicit, explicit_offset, rest = m.groups()
+                if explicit is not None:
+                    # "RST4 (ram:001f+1)": listed above 001f, lives at 0020
+                    target = int(explicit, 16) + int(explicit_offset)
+                    label = [name, target, 0, False]
+                else:
+                    # "LAB_ram_0184+1": listed above 0184, refers to 0185
+                    offcut = _OFFCUT_RE.match(name)
+                    label = [name, None, int(offcut.group(2)) if offcut else 0, False]
+                pending_labels.append(label)
+                if rest:
+                    head = _XREF_HEAD_RE.search(rest)
+                    if head or not pending_refs:
+                        counts = [int(n) for n in head.group(1).split(",")] if head else []
+                        pending_refs.append([label, counts, []])
+                    # a stacked label's line otherwise carries on the list above it
+                    add_refs(rest, pending_refs[-1])
+                continue
+
+            m = _CONTINUATION_RE.match(line)
+            if m and pending_refs:
+                add_refs(m.group(1), pending_refs[-1])
+
+        listing._finish(edges, signatures)
+        return listing
+
+    def _finish(self, edges, signatures):
+        edges.sort()
+        for to, source, kind in edges:
+            self.xref_to.append(to)
+            self.xref_from.append(source)
+            self.xref_kind.append(kind)
+        order = sorted(range(len(edges)), key=lambda i: (edges[i][1], edges[i][0]))
+        self._by_from = array("I", order)
+        self._from_keys = array("H", (edges[i][1] for i in order))
+
+        for name in signatures:
+            if name in self.labels:
+                self.functions[name] = self.labels[name]
+        for address, name in sorted((a, n) for n, a in self.functions.items()):
+            self.function_starts.append(address)
+            self.function_names.append(name)
+
+    # -- lookups ----------------------------------------------------------
+
+    def row(self, address: int):
+        """Row index listed at exactly `address`, or None."""
+        r = self.row_at[address]
+        return r if r >= 0 else None
+
+    def row_info(self, row: int):
+        """(address, bytes, mnemonic, operands, comment) for a row."""
+        address = self.addr[row]
+        size = self.size[row]
+        return (address, bytes(self.image[address:address + size]), self.mnemonics[self.mnemonic[row]],
+                self.operands[self.operand[row]], self.comments.get(row, ""))
+
+    def instruction_at(self, address: int):
+        """row_info() of the row starting at `address`, or None."""
+        r = self.row(address)
+        return None if r is None else self.row_info(r)
+
+    def containing_row(self, address: int):
+        """Row whose bytes cover `address` (for addresses inside a
+        multi-byte instruction), or None."""
+        for back in range(4):
+            r = self.row_at[address - back] if address - back >= 0 else -1
+            if r >= 0:
+                return r if back < self.size[r] else None
+        return None
+
+    def is_code(self, row: int) -> bool:
+        return not _DATA_MNEMONIC_RE.match(self.mnemonics[self.mnemonic[row]])
+
+    def address_of(self, label: str):
+        return self.labels.get(label)
+
+    def labels_for(self, address: int):
+        return self.labels_at.get(address, [])
+
+    def function_at(self, address: int):
+        """(name, entry) of the function whose entry is the closest one at
+        or below `address` -- the listing doesn't record function ends, so
+        this is an approximation -- or None."""
+        i = bisect.bisect_right(self.function_starts, address) - 1
+        if i < 0:
+            return None
+        return self.function_names[i], self.function_starts[i]
+
+    def xrefs_to(self, address: int):
+        """[(from, kind)] for every XREF listed against `address`."""
+        lo = bisect.bisect_left(self.xref_to, address)
+        hi = bisect.bisect_right(self.xref_to, address)
+        return [(self.xref_from[i], self.ref_kinds[self.xref_kind[i]]) for i in range(lo, hi)]
+
+    def xrefs_from(self, address: int):
+        """[(to, kind)] for every XREF whose source is `address`."""
+        lo = bisect.bisect_left(self._from_keys, address)
+        hi = bisect.bisect_right(self._from_keys, address)
+        return [(self.xref_to[self._by_from[i]], self.ref_kinds[self.xref_kind[self._by_from[i]]])
+                for i in range(lo, hi)]
+
+    def resolve(self, text: str):
+        """Address for a label name or a hex number (with or without 0x), or None."""
+        if text in self.labels:
+            return self.labels[text]
+        try:
+            return int(text, 0) if text.lower().startswith("0x") else int(text, 16)
+        except ValueError:
+            return None
+
+
+def load(path: str = DEFAULT_LISTING, cache: "fwa.ResultCache" = None) -> Z80Listing:
+    """Parses the listing at `path`, or returns the cached parse of the same
+    contents when `cache` holds one."""
+    key = None
+    if cache is not None:
+        with fwa.open_image(path) as data:
+            key = f"{LISTING_FORMAT_VERSION}-{fwa.content_hash(data)}"
+        state = cache.get_object("z80listing", key)
+        if isinstance(state, dict):
+            return Z80Listing.from_state(state)
+    with open(path, encoding="ascii", errors="replace") as f:
+        listing = Z80Listing.parse(f)
+    if cache is not None:
+        cache.put_object("z80listing", key, listing.state())
+    return listing
+
+
+def print_address(listing: Z80Listing, query: str):
+    address = listing.resolve(query)
+    if address is None or not 0 <= address < ADDRESS_SPACE:
+        print(f"\n=== {query}: not a label or address ===")
+        return
+    print(f"\n=== {query} = {address:#06x} ===")
+    labels = listing.labels_for(address)
+    if labels:
+        print(f"  labels: {', '.join(labels)}")
+    function = listing.function_at(address)
+    if function:
+        print(f"  in function: {function[0]} ({function[1]:#06x}, nearest entry below)")
+    row = listing.containing_row(address)
+    if row is not None:
+        start, raw, mnemonic, operands, comment = listing.row_info(row)
+        note = "" if start == address else f"  (inside the row at {start:#06x})"
+        print(f"  {start:#06x}  {raw.hex(' '):12} {mnemonic:10} {operands}  {comment}".rstrip() + note)
+    refs = listing.xrefs_to(address)
+    print(f"  referenced by ({len(refs)}):")
+    for source, kind in refs:
+        print(f"    {source:#06x}({kind})")
+    outgoing = listing.xrefs_from(address)
+    if outgoing:
+        print(f"  references ({len(outgoing)}):")
+        for target, kind in outgoing:
+            print(f"    {target:#06x}({kind})  {', '.join(listing.labels_for(target))}")
+
+
+def selftest() -> bool:
+    """Parses _STACKED_SAMPLE and checks that each stacked label got its
+    own share of the XREF list. Returns True if all checks passed."""
+    print("=== DDX3216 Z80 listing self-test ===")
+    listing = Z80Listing.parse(_STACKED_SAMPLE)
+    expected = [
+        (0x0062, "R", [0x7ff8, 0x8173, 0x81c6, 0x8341, 0x8394, 0x850f, 0x8562, 0x86dd]),
+        (0x0063, "R", [0x8006, 0x8181, 0x81d4, 0x834f, 0x83a2, 0x851d, 0x8570, 0x86eb]),
+        (0x8417, "j", [0x83b5]),
+        (0x8418, "W", [0x00c8]),
+    ]
+    ok = True
+    for address, kind, sources in expected:
+        refs = listing.xrefs_to(address)
+        good = refs == [(source, kind) for source in sorted(sources)]
+        print(f"  {', '.join(listing.labels_for(address)):28} {address:#06x}  "
+              f"{len(refs):2} refs  {'ok' if good else 'FAILED'}")
+        ok = ok and good
+    return ok
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    path = DEFAULT_LISTING
+    use_cache = True
+    queries = []
+    it = iter(args)
+    for a in it:
+        if a == "--listing":
+            path = cli.option_value(it, a, __doc__)
+        elif a == "--no-cache":
+            use_cache = False
+        elif a == "--selftest":
+            sys.exit(0 if selftest() else 1)
+        else:
+            queries.append(a)
+    if not queries:
+        print(__doc__)
+        sys.exit(1)
+    listing = load(path, fwa.ResultCache() if use_cache else None)
+    print(f"{path}: {len(listing)} rows, {len(listing.labels)} labels, "
+          f"{len(listing.functions)} functions, {len(listing.xref_to)} xrefs")
+    for q in queries:
+        print_address(listing, q)
@@ -17,9 +17,23 @@ import midi
 import utils
 import time
 
+# shared with FLStudioMidiScript/FLStudio_DDX3216 -- copy these next to this script
+import ddx3216_protocol as proto
+import ddx3216_meters
+import ddx3216_scheduler
+import ddx3216_profiler
+
 DDX3216CU_KnobOffOnT = [(midi.MIDI_CONTROLCHANGE + (1 << 6)) << 16, midi.MIDI_CONTROLCHANGE + ((0xB + (2 << 4) + (1 << 6)) << 16)]
 DDX3216CU_nFreeTracks = 64
 
+# meter output: METER_TARGET_AFTERTOUCH (CU-style) or METER_TARGET_SYSEX (DDX3216 function 0x04)
+DDX3216CU_MeterTarget = ddx3216_meters.METER_TARGET_AFTERTOUCH
+DDX3216CU_MeterDecay = 1     # meter steps dropped per idle tick
+DDX3216CU_MeterHold = 0      # idle ticks a peak is held before decaying
+DDX3216CU_MidiChannel = 2    # for the SysEx meter target; None for omni
+DDX3216CU_Profiler = True    # wrap the FL callbacks; hold Shift+Esc+Enter to toggle profiling (see ddx3216_profiler.py)
+DDX3216CU_ProfileCombo = ((midi.MIDI_NOTEON, 0x54), (midi.MIDI_NOTEON, 0x52), (midi.MIDI_NOTEON, 0x53))
+
 # Define MIDI message constants
 SYSEX_START = 0xF0
 SYSEX_END = 0xF7
@@ -126,64 +140,67 @@ class TDDX3216Col:
         self.SliderName = ""
         self.KnobName = ""
         self.LastValueIndex = 0
-        self.ZPeak = False
         self.Dirty = False
         self.KnobHeld = False
 
 class TDDX3216CU:
-    def __init__(self):
-        self.LastMsgLen =  0x37
-        self.TempMsgT = ["", ""]
-        self.LastTimeMsg = bytearray(10)
-        self.Shift = False
-        self.TempMsgDirty = False
-        self.JogSource = 0
-        self.TempMsgCount = 0
-        self.SliderHoldCount = 0
-        self.FirstTrack = 0
-        self.FirstTrackT = [0, 0]
-        self.ColT = [0 for x in range(9)]
-        for x in range(0, 9):
-            self.ColT[x] = TDDX3216Col()
-
-        self.FreeCtrlT = [0 for x in range(DDX3216CU_nFreeTracks - 1 + 2)]  # 64+1 sliders
-        self.Clicking = False
-        self.Scrub = False
-        self.Flip = False
-        self.MeterMode = 0
-        self.CurMeterMode = 0
-        self.Page = 0
-        self.SmoothSpeed = 0
-        self.MeterMax = 0
-        self.ActivityMax = 0
-
-        self.DDX3216CU_PageNameT = ('Panning (press to reset)', 
-                                    'Stereo separation (press to reset)',  
-                                    'Sends for selected track (press to enable)', 
-                                    'Effects for selected track (press to enable)', 
-                                    'EQ for selected track (press to reset)',  
-                                    'Lotsa free controls')
-        self.DDX3216CU_MeterModeNameT = ('Horizontal meters mode', 'Vertical meters mode', 'Disabled meters mode')
-        self.DDX3216CU_ExtenderPosT = ('left', 'right')
-
-        self.FreeEventID = 400
-        self.ArrowsStr = chr(0x7F) + chr(0x7E) + chr(0x32)
-        self.AlphaTrack_SliderMax = round(13072 * 16000 / 12800)
-        self.ExtenderPos = ExtenderLeft
-
-    def OnInit(self):
-        self.FirstTrackT[0] = 1
-        self.FirstTrack = 0
-        self.SmoothSpeed = 469
-        self.Clicking = True
-
-        device.setHasMeters()
-        self.LastTimeMsg = bytearray(10)
-
-        for m in range(len(self.FreeCtrlT)):
-            self.FreeCtrlT[m] = 8192  # default free faders to center
-        if device.isAssigned():
-            device.midiOutSysex(bytes([0xF0, 0x00, 0x00, 0x66, 0x14, 0x0C, 1, 0xF7]))
+	def __init__(self):
+		self.LastMsgLen =  0x37
+		self.TempMsgT = ["", ""]
+		self.LastTimeMsg = bytearray(10)
+		self.Shift = False
+		self.TempMsgDirty = False
+		self.JogSource = 0
+		self.TempMsgCount = 0
+		self.SliderHoldCount = 0
+		self.FirstTrack = 0
+		self.FirstTrackT = [0, 0]
+		self.ColT = [0 for x in range(9)]
+		for x in range(0, 9):
+			self.ColT[x] = TDDX3216Col()
+
+		self.FreeCtrlT = [0 for x in range(DDX3216CU_nFreeTracks - 1 + 2)]  # 64+1 sliders
+		self.Clicking = False
+		self.Scrub = False
+		self.Flip = False
+		self.MeterMode = 0
+		self.CurMeterMode = 0
+		self.Page = 0
+		self.SmoothSpeed = 0
+		self.MeterMax = 0
+		self.ActivityMax = 0
+		self.Meters = ddx3216_meters.MeterEngine(len(self.ColT) - 1, 0, DDX3216CU_MeterDecay, DDX3216CU_MeterHold)
+		# everything sent to the desk -- faders, LEDs, LCD, time display, meters -- shares the link through one byte-budgeted queue (drained in OnIdle)
+		self.Out = ddx3216_scheduler.OutputScheduler(device.midiOutSysex, device.midiOutMsg, device_byte = proto.device_byte_for_channel(DDX3216CU_MidiChannel))
+		self.LastNewMsg = {} # SendNewMsg index -> last message queued there
+
+		self.DDX3216CU_PageNameT = ('Panning (press to reset)', 
+									'Stereo separation (press to reset)',  
+									'Sends for selected track (press to enable)', 
+									'Effects for selected track (press to enable)', 
+									'EQ for selected track (press to reset)',  
+									'Lotsa free controls')
+		self.DDX3216CU_MeterModeNameT = ('Horizontal meters mode', 'Vertical meters mode', 'Disabled meters mode')
+		self.DDX3216CU_ExtenderPosT = ('left', 'right')
+
+		self.FreeEventID = 400
+		self.ArrowsStr = chr(0x7F) + chr(0x7E) + chr(0x32)
+		self.AlphaTrack_SliderMax = round(13072 * 16000 / 12800)
+		self.ExtenderPos = ExtenderLeft
+
+	def OnInit(self):
+		self.FirstTrackT[0] = 1
+		self.FirstTrack = 0
+		self.SmoothSpeed = 469
+		self.Clicking = True
+
+		device.setHasMeters()
+		self.LastTimeMsg = bytearray(10)
+
+		for m in range(len(self.FreeCtrlT)):
+			self.FreeCtrlT[m] = 8192  # default free faders to center
+		if device.isAssigned():
+			self.Out.queue_sysex(ddx3216_scheduler.PRIORITY_LED, 'mode', bytes([0xF0, 0x00, 0x00, 0x66, 0x14, 0x0C, 1, 0xF7]))
 
 
 		self.SetBackLight(2) # backlight timeout to 2 minutes
@@ -199,7 +216,7 @@ class TDDX3216CU:
 		if device.isAssigned():
 
 			for m in range(0, 8):
-				device.midiOutSysex(bytes([0xF0, 0x00, 0x00, 0x66, 0x14, 0x20, m, 0, 0xF7]))
+				self.Out.queue_sysex(ddx3216_scheduler.PRIORITY_LED, None, bytes([0xF0, 0x00, 0x00, 0x66, 0x14, 0x20, m, 0, 0xF7]))
 
 			if ui.isClosing():
 				self.SendMsg(ui.getProgTitle() + ' session closed at ' + time.ctime(time.time()), 0)
@@ -209,6 +226,7 @@ class TDDX3216CU:
 			self.SendMsg('', 1)
 			self.SendTimeMsg('')
 			self.SendAssignmentMsg('  ')
+			self.Out.flush_all()
 
 		print('OnDeInit ready')
 
@@ -588,7 +606,7 @@ class TDDX3216CU:
 								device.directFeedback(event)
 							if (event.data1 >= 0x4E) & (event.data2 >= int(event.data1 == 0x4E)):
 								if device.isAssigned():
-									device.midiOutMsg((0x4D << 8) + midi.TranzPort_OffOnT[False])
+									self.Out.queue_msg(ddx3216_scheduler.PRIORITY_LED, None, (0x4D << 8) + midi.TranzPort_OffOnT[False])
 							if transport.globalTransport(n, int(event.data2 > 0) * 2, event.pmeFlags) == midi.GT_Global:
 								t = -1
 								if n == midi.FPT_Punch:
@@ -639,10 +657,16 @@ class TDDX3216CU:
 			else:
 				event.handled = False
 
+	def SendNewMsg(self, Priority, Msg, Index):
+		# device.midiOutNewMsg, through the scheduler: only queued if Index last held a different message
+		if self.LastNewMsg.get(Index) != Msg:
+			self.LastNewMsg[Index] = Msg
+			self.Out.queue_msg(Priority, ('new', Index), Msg)
+
 	def SendMsg(self, Msg, Row = 0):
 		sysex = bytearray([0xF0, 0x00, 0x00, 0x66, 0x14, 0x12, (self.LastMsgLen + 1) * Row]) + bytearray(Msg.ljust(self.LastMsgLen + 1, ' '), 'utf-8')
 		sysex.append(0xF7)
-		device.midiOutSysex(bytes(sysex))
+		self.Out.queue_sysex(ddx3216_scheduler.PRIORITY_LCD, ('lcd', Row), sysex)
 
 	# update the CU time display
 	def SendTimeMsg(self, Msg):
@@ -655,7 +679,7 @@ class TDDX3216CU:
 			#send chars that have changed
 			for m in range(0, min(len(self.LastTimeMsg), len(TempMsg))):
 				if self.LastTimeMsg[m] != TempMsg[m]:
-					device.midiOutMsg(midi.MIDI_CONTROLCHANGE + ((0x49 - m) << 8) + ((TempMsg[m]) << 16))
+					self.Out.queue_msg(ddx3216_scheduler.PRIORITY_LCD, ('time', m), midi.MIDI_CONTROLCHANGE + ((0x49 - m) << 8) + ((TempMsg[m]) << 16))
 
 		self.LastTimeMsg = TempMsg
 
@@ -664,7 +688,7 @@ class TDDX3216CU:
 		s_ansi = Msg + chr(0) #AnsiString(Msg);
 		if device.isAssigned():
 			for m in range(1, 3):
-				device.midiOutMsg(midi.MIDI_CONTROLCHANGE + ((0x4C - m) << 8) + (ord(s_ansi[m]) << 16))
+				self.Out.queue_msg(ddx3216_scheduler.PRIORITY_LCD, ('assignment', m), midi.MIDI_CONTROLCHANGE + ((0x4C - m) << 8) + (ord(s_ansi[m]) << 16))
 
 	def UpdateTempMsg(self):
 		self.SendMsg(self.TempMsgT[int(self.TempMsgCount != 0)])
@@ -681,7 +705,7 @@ class TDDX3216CU:
 		SyncLEDMsg = [ midi.MIDI_NOTEON + (0x5E << 8), midi.MIDI_NOTEON + (0x5E << 8) + (0x7F << 16), midi.MIDI_NOTEON + (0x5E << 8) + (0x7F << 16)]
 
 		if device.isAssigned():
-			device.midiOutNewMsg(SyncLEDMsg[Value], 128)
+			self.SendNewMsg(ddx3216_scheduler.PRIORITY_LED, SyncLEDMsg[Value], 128)
 
 	def UpdateTextDisplay(self):
 
@@ -721,10 +745,10 @@ class TDDX3216CU:
 		if device.isAssigned():
 			#clear peak indicators
 			for m in range(0, len(self.ColT) - 1):
-				device.midiOutMsg(midi.MIDI_CHANAFTERTOUCH + (0xF << 8) + (m << 12))
+				self.Out.queue_msg(ddx3216_scheduler.PRIORITY_LED, None, midi.MIDI_CHANAFTERTOUCH + (0xF << 8) + (m << 12))
 			# disable all meters
 			for m in range (0, 8):
-				device.midiOutSysex(bytes([0xF0, 0x00, 0x00, 0x66, 0x14, 0x20, m, 0, 0xF7]))
+				self.Out.queue_sysex(ddx3216_scheduler.PRIORITY_LED, None, bytes([0xF0, 0x00, 0x00, 0x66, 0x14, 0x20, m, 0, 0xF7]))
 
 		# reset stuff
 		if self.CurMeterMode > 0:
@@ -734,6 +758,7 @@ class TDDX3216CU:
 
 		self.MeterMax = 0xD + int(self.CurMeterMode == 1) # $D for horizontal, $E for vertical meters
 		self.ActivityMax = 0xD - int(self.CurMeterMode == 1) * 6
+		self.Meters.set_max_level(self.MeterMax)
 
 		# meter split marks
 		if self.CurMeterMode == 0:
@@ -743,7 +768,7 @@ class TDDX3216CU:
 
 		if device.isAssigned():
 			# horizontal/vertical meter mode
-			device.midiOutSysex(bytes([0xF0, 0x00, 0x00, 0x66, 0x14, 0x21, int(self.CurMeterMode > 0), 0xF7]))
+			self.Out.queue_sysex(ddx3216_scheduler.PRIORITY_LED, None, bytes([0xF0, 0x00, 0x00, 0x66, 0x14, 0x21, int(self.CurMeterMode > 0), 0xF7]))
 
 			# enable all meters
 			if self.CurMeterMode == 2:
@@ -751,7 +776,7 @@ class TDDX3216CU:
 			else:
 				n = 1 + 2;
 			for m  in range(0, 8):
-				device.midiOutSysex(bytes([0xF0, 0x00, 0x00, 0x66, 0x14, 0x20, m, n, 0xF7]))
+				self.Out.queue_sysex(ddx3216_scheduler.PRIORITY_LED, None, bytes([0xF0, 0x00, 0x00, 0x66, 0x14, 0x20, m, n, 0xF7]))
 
 	def SetPage(self, Value):
 
@@ -791,7 +816,7 @@ class TDDX3216CU:
 		if self.Page !=  DDX3216CUPage_Free:
 			if device.isAssigned():
 				for m in range(0, len(self.ColT) - 1):
-					device.midiOutNewMsg(((0x18 + m) << 8) + midi.TranzPort_OffOnT[self.ColT[m].TrackNum == mixer.trackNumber()], self.ColT[m].LastValueIndex + 4)
+					self.SendNewMsg(ddx3216_scheduler.PRIORITY_LED, ((0x18 + m) << 8) + midi.TranzPort_OffOnT[self.ColT[m].TrackNum == mixer.trackNumber()], self.ColT[m].LastValueIndex + 4)
 
 			if self.Page in [DDX3216CUPage_Sends, DDX3216CUPage_FX]:
 				self.UpdateColT()
@@ -809,7 +834,7 @@ class TDDX3216CU:
 				baseID = midi.EncodeRemoteControlID(device.getPortNumber(), 0, self.ColT[Num].BaseEventID)
 				# slider
 				m = self.FreeCtrlT[self.ColT[Num].TrackNum]
-				device.midiOutNewMsg(midi.MIDI_PITCHBEND + Num + ((m & 0x7F) << 8) + ((m >> 7) << 16), self.ColT[Num].LastValueIndex + 5)
+				self.SendNewMsg(ddx3216_scheduler.PRIORITY_FADER, midi.MIDI_PITCHBEND + Num + ((m & 0x7F) << 8) + ((m >> 7) << 16), self.ColT[Num].LastValueIndex + 5)
 				if Num < 8:
 					# ring
 					d = mixer.remoteFindEventValue(baseID + int(self.ColT[Num].KnobHeld))
@@ -817,7 +842,7 @@ class TDDX3216CU:
 						m = 1 + round(d * 10)
 					else:
 						m = int(self.ColT[Num].KnobHeld) * (11 + (2 << 4))
-					device.midiOutNewMsg(midi.MIDI_CONTROLCHANGE + ((0x30 + Num) << 8) + (m << 16), self.ColT[Num].LastValueIndex)
+					self.SendNewMsg(ddx3216_scheduler.PRIORITY_LED, midi.MIDI_CONTROLCHANGE + ((0x30 + Num) << 8) + (m << 16), self.ColT[Num].LastValueIndex)
 					# buttons
 					for n in range(0, 4)            :
 						d = mixer.remoteFindEventValue(baseID + 3 + n)
@@ -826,7 +851,7 @@ class TDDX3216CU:
 						else:
 							b = False
 
-						device.midiOutNewMsg(((n * 8 + Num) << 8) + midi.TranzPort_OffOnT[b], self.ColT[Num].LastValueIndex + 1 + n)
+						self.SendNewMsg(ddx3216_scheduler.PRIORITY_LED, ((n * 8 + Num) << 8) + midi.TranzPort_OffOnT[b], self.ColT[Num].LastValueIndex + 1 + n)
 			else:
 				sv = mixer.getEventValue(self.ColT[Num].SliderEventID)
 
@@ -852,18 +877,18 @@ class TDDX3216CU:
 					else:
 						Data1 = 0
 
-					device.midiOutNewMsg(midi.MIDI_CONTROLCHANGE + ((0x30 + Num) << 8) + (data1 << 16), self.ColT[Num].LastValueIndex)
+					self.SendNewMsg(ddx3216_scheduler.PRIORITY_LED, midi.MIDI_CONTROLCHANGE + ((0x30 + Num) << 8) + (data1 << 16), self.ColT[Num].LastValueIndex)
 
 					# arm, solo, mute
-					device.midiOutNewMsg( ((0x00 + Num) << 8) + midi.TranzPort_OffOnBlinkT[int(mixer.isTrackArmed(self.ColT[Num].TrackNum)) * (1 + int(transport.isRecording()))], self.ColT[Num].LastValueIndex + 1)
-					device.midiOutNewMsg( ((0x08 + Num) << 8) + midi.TranzPort_OffOnT[mixer.isTrackSolo(self.ColT[Num].TrackNum)], self.ColT[Num].LastValueIndex + 2)
-					device.midiOutNewMsg( ((0x10 + Num) << 8) + midi.TranzPort_OffOnT[not mixer.isTrackEnabled(self.ColT[Num].TrackNum)], self.ColT[Num].LastValueIndex + 3)
+					self.SendNewMsg(ddx3216_scheduler.PRIORITY_LED, ((0x00 + Num) << 8) + midi.TranzPort_OffOnBlinkT[int(mixer.isTrackArmed(self.ColT[Num].TrackNum)) * (1 + int(transport.isRecording()))], self.ColT[Num].LastValueIndex + 1)
+					self.SendNewMsg(ddx3216_scheduler.PRIORITY_LED, ((0x08 + Num) << 8) + midi.TranzPort_OffOnT[mixer.isTrackSolo(self.ColT[Num].TrackNum)], self.ColT[Num].LastValueIndex + 2)
+					self.SendNewMsg(ddx3216_scheduler.PRIORITY_LED, ((0x10 + Num) << 8) + midi.TranzPort_OffOnT[not mixer.isTrackEnabled(self.ColT[Num].TrackNum)], self.ColT[Num].LastValueIndex + 3)
 
 				# slider
 				data1 = self.AlphaTrack_LevelToSlider(sv)
 				data2 = data1 & 127
 				data1 = data1 >> 7
-				device.midiOutNewMsg(midi.MIDI_PITCHBEND + Num + (data2 << 8) + (data1 << 16), self.ColT[Num].LastValueIndex + 5)
+				self.SendNewMsg(ddx3216_scheduler.PRIORITY_FADER, midi.MIDI_PITCHBEND + Num + (data2 << 8) + (data1 << 16), self.ColT[Num].LastValueIndex + 5)
 
 			Dirty = False
 
@@ -992,9 +1017,10 @@ class TDDX3216CU:
 
 			self.ColT[m].LastValueIndex = 48 + m * 6
 			self.ColT[m].Peak = 0
-			self.ColT[m].ZPeak = False
 			self.UpdateCol(m)
 
+		self.Meters.invalidate()
+
 	def SetKnobValue(self, Num, Value, Res = midi.EKRes):
 
 		if (self.ColT[Num].KnobEventID >= 0) & (self.ColT[Num].KnobMode < 4):
@@ -1039,20 +1065,21 @@ class TDDX3216CU:
 
 	def OnIdle(self):
 
-		# refresh meters
+		# refresh meters (only columns whose displayed level changed)
 		if device.isAssigned():
-			f = self.Page == DDX3216CUPage_Free
 			for m in range(0,  len(self.ColT) - 1):
-				self.ColT[m].Tag = utils.Limited(self.ColT[m].Peak, 0, self.MeterMax)
+				self.Meters.feed(m, self.ColT[m].Peak)
 				self.ColT[m].Peak = 0
-				if self.ColT[m].Tag == 0:
-					if self.ColT[m].ZPeak:
-						continue
-					else:
-						self.ColT[m].ZPeak = True
-				else:
-					self.ColT[m].ZPeak = f
-				device.midiOutMsg(midi.MIDI_CHANAFTERTOUCH + (self.ColT[m].Tag << 8) + (m << 12))
+			Changes = self.Meters.tick()
+			if DDX3216CU_MeterTarget == ddx3216_meters.METER_TARGET_SYSEX:
+				# whole frame, so a newer one can replace a still-queued one
+				msg = self.Meters.build_sysex(Changes, proto.device_byte_for_channel(DDX3216CU_MidiChannel), max(0, self.ColT[0].TrackNum - 1), True)
+				if msg:
+					self.Out.queue_sysex(ddx3216_scheduler.PRIORITY_METER, 'meters', msg)
+			else:
+				for m, Level in Changes:
+					self.ColT[m].Tag = Level
+					self.Out.queue_msg(ddx3216_scheduler.PRIORITY_METER, ('meter', m), midi.MIDI_CHANAFTERTOUCH + (Level << 8) + (m << 12))
 		# time display
 		if ui.getTimeDispMin():
 			# HHH.MM.SS.CC_
@@ -1082,30 +1109,32 @@ class TDDX3216CU:
 				if self.CurMeterMode == 0:
 					self.SendMsg(self.GetSplitMarks(), 1)
 
+		self.Out.tick()
+
 	def UpdateLEDs(self):
 
 		if device.isAssigned():
 			# stop
-			device.midiOutNewMsg((0x5D << 8) + midi.TranzPort_OffOnT[transport.isPlaying() == midi.PM_Stopped], 0)
+			self.SendNewMsg(ddx3216_scheduler.PRIORITY_LED, (0x5D << 8) + midi.TranzPort_OffOnT[transport.isPlaying() == midi.PM_Stopped], 0)
 			# loop
-			device.midiOutNewMsg((0x5A << 8) + midi.TranzPort_OffOnT[transport.getLoopMode() == midi.SM_Pat], 1)
+			self.SendNewMsg(ddx3216_scheduler.PRIORITY_LED, (0x5A << 8) + midi.TranzPort_OffOnT[transport.getLoopMode() == midi.SM_Pat], 1)
 			# record
 			r = transport.isRecording()
-			device.midiOutNewMsg((0x5F << 8) + midi.TranzPort_OffOnT[r], 2)
+			self.SendNewMsg(ddx3216_scheduler.PRIORITY_LED, (0x5F << 8) + midi.TranzPort_OffOnT[r], 2)
 			# SMPTE/BEATS
-			device.midiOutNewMsg((0x71 << 8) + midi.TranzPort_OffOnT[ui.getTimeDispMin()], 3)
-			device.midiOutNewMsg((0x72 << 8) + midi.TranzPort_OffOnT[not ui.getTimeDispMin()], 4)
+			self.SendNewMsg(ddx3216_scheduler.PRIORITY_LED, (0x71 << 8) + midi.TranzPort_OffOnT[ui.getTimeDispMin()], 3)
+			self.SendNewMsg(ddx3216_scheduler.PRIORITY_LED, (0x72 << 8) + midi.TranzPort_OffOnT[not ui.getTimeDispMin()], 4)
 			# self.Page
 			for m in range(0,  6):
-			  device.midiOutNewMsg(((0x28 + m) << 8) + midi.TranzPort_OffOnT[m == self.Page], 5 + m)
+			  self.SendNewMsg(ddx3216_scheduler.PRIORITY_LED, ((0x28 + m) << 8) + midi.TranzPort_OffOnT[m == self.Page], 5 + m)
 			# changed flag
-			device.midiOutNewMsg((0x50 << 8) + midi.TranzPort_OffOnT[general.getChangedFlag() > 0], 11)
+			self.SendNewMsg(ddx3216_scheduler.PRIORITY_LED, (0x50 << 8) + midi.TranzPort_OffOnT[general.getChangedFlag() > 0], 11)
 			# metronome
-			device.midiOutNewMsg((0x57 << 8) + midi.TranzPort_OffOnT[general.getUseMetronome()], 12)
+			self.SendNewMsg(ddx3216_scheduler.PRIORITY_LED, (0x57 << 8) + midi.TranzPort_OffOnT[general.getUseMetronome()], 12)
 			# rec precount
-			device.midiOutNewMsg((0x58 << 8) + midi.TranzPort_OffOnT[general.getPrecount()], 13)
+			self.SendNewMsg(ddx3216_scheduler.PRIORITY_LED, (0x58 << 8) + midi.TranzPort_OffOnT[general.getPrecount()], 13)
 			# self.Scrub
-			device.midiOutNewMsg((0x65 << 8) + midi.TranzPort_OffOnT[self.Scrub], 15)
+			self.SendNewMsg(ddx3216_scheduler.PRIORITY_LED, (0x65 << 8) + midi.TranzPort_OffOnT[self.Scrub], 15)
 			# use RUDE SOLO to show if any track is armed for recording
 			b = 0
 			for m in range(0,  mixer.trackCount()):
@@ -1113,16 +1142,16 @@ class TDDX3216CU:
 			    b = 1 + int(r)
 			    break
 
-			device.midiOutNewMsg((0x73 << 8) + midi.TranzPort_OffOnBlinkT[b], 16)
+			self.SendNewMsg(ddx3216_scheduler.PRIORITY_LED, (0x73 << 8) + midi.TranzPort_OffOnBlinkT[b], 16)
 			# smoothing
-			device.midiOutNewMsg((0x33 << 8) + midi.TranzPort_OffOnT[self.SmoothSpeed > 0], 17)
+			self.SendNewMsg(ddx3216_scheduler.PRIORITY_LED, (0x33 << 8) + midi.TranzPort_OffOnT[self.SmoothSpeed > 0], 17)
 			# self.Flip
-			device.midiOutNewMsg((0x32 << 8) + midi.TranzPort_OffOnT[self.Flip], 18)
+			self.SendNewMsg(ddx3216_scheduler.PRIORITY_LED, (0x32 << 8) + midi.TranzPort_OffOnT[self.Flip], 18)
 			# snap
-			device.midiOutNewMsg((0x56 << 8) + midi.TranzPort_OffOnT[ui.getSnapMode() !=  3], 19)
+			self.SendNewMsg(ddx3216_scheduler.PRIORITY_LED, (0x56 << 8) + midi.TranzPort_OffOnT[ui.getSnapMode() !=  3], 19)
 			# focused windows
-			device.midiOutNewMsg((0x4A << 8) + midi.TranzPort_OffOnT[ui.getFocused(midi.widBrowser)], 20)
-			device.midiOutNewMsg((0x4B << 8) + midi.TranzPort_OffOnT[ui.getFocused(midi.widChannelRack)], 21)
+			self.SendNewMsg(ddx3216_scheduler.PRIORITY_LED, (0x4A << 8) + midi.TranzPort_OffOnT[ui.getFocused(midi.widBrowser)], 20)
+			self.SendNewMsg(ddx3216_scheduler.PRIORITY_LED, (0x4B << 8) + midi.TranzPort_OffOnT[ui.getFocused(midi.widChannelRack)], 21)
 
 
 	def SetJogSource(self, Value):
@@ -1135,12 +1164,12 @@ class TDDX3216CU:
 	def UpdateClicking(self): # switch self.Clicking for transport buttons
 
 		if device.isAssigned():
-			device.midiOutSysex(bytes([0xF0, 0x00, 0x00, 0x66, 0x14, 0x0A, int(self.Clicking), 0xF7]))
+			self.Out.queue_sysex(ddx3216_scheduler.PRIORITY_LED, 'clicking', bytes([0xF0, 0x00, 0x00, 0x66, 0x14, 0x0A, int(self.Clicking), 0xF7]))
 
 	def SetBackLight(self, Minutes): # set backlight timeout (0 should switch off immediately, but doesn't really work well)
 
 		if device.isAssigned():
-			device.midiOutSysex(bytes([0xF0, 0x00, 0x00, 0x66, 0x14, 0x0B, Minutes, 0xF7]))
+			self.Out.queue_sysex(ddx3216_scheduler.PRIORITY_LED, 'backlight', bytes([0xF0, 0x00, 0x00, 0x66, 0x14, 0x0B, Minutes, 0xF7]))
 
 DDX3216CU = TDDX3216CU()
 
@@ -1174,6 +1203,14 @@ def OnIdle():
 def OnWaitingForInput():
 	DDX3216CU.OnWaitingForInput()
 
+DDX3216CU_ProfilerT = ddx3216_profiler.CallbackProfiler()
+
+def toggle_profiling():
+	return DDX3216CU_ProfilerT.toggle()
+
+def print_profile_report():
+	DDX3216CU_ProfilerT.print_report()
+
 
 
 
@@ -1207,23 +1244,5 @@ def OnInit():
 def OnDeInit():
     print("Behringer DDX3216 script terminated")
 
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+if DDX3216CU_Profiler:
+	DDX3216CU_ProfilerT.install(globals(), combo=ddx3216_profiler.ButtonCombo(DDX3216CU_ProfileCombo))
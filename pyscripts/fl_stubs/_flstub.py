@@ -0,0 +1,93 @@
+"""
+_flstub.py
+
+Shared state of the FL Studio API stubs in this directory: per-call counts
+and timings, the MIDI output the script produced, the mixer tracks it
+dirtied, and the harness clock. Only ddx3216_fl_harness.py (and other test
+drivers) use this module directly; the device scripts see plain `mixer`,
+`device`, ... modules.
+"""
+
+import sys
+import time
+
+# "module.function" -> [calls, seconds]
+STATS = {}
+
+now = 0.0                  # harness time in seconds, set by the driver per event
+dirty_tracks = []          # mixer tracks changed since the driver last looked
+output = {"sysex_frames": 0, "sysex_bytes": 0, "short_msgs": 0, "short_bytes": 0,
+          "new_msgs_sent": 0, "new_msgs_suppressed": 0}
+sinks = []                 # callables given every outgoing message as bytes
+
+
+def counted(module):
+    """Decorator: counts calls to, and time spent in, a stub function."""
+    def wrap(fn):
+        entry = STATS.setdefault(module + "." + fn.__name__, [0, 0.0])
+        clock = time.perf_counter
+
+        def stub(*args, **kwargs):
+            t0 = clock()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                entry[0] += 1
+                entry[1] += clock() - t0
+
+        stub.__name__ = fn.__name__
+        stub.__doc__ = fn.__doc__
+        stub.__wrapped__ = fn
+        return stub
+    return wrap
+
+
+def fallback(module, default=0):
+    """Module-level __getattr__ for API functions a stub doesn't model: each
+    becomes a counted no-op returning `default`, created on first use."""
+    def __getattr__(name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+
+        def noop(*args, **kwargs):
+            return default
+
+        noop.__name__ = name
+        fn = counted(module)(noop)
+        setattr(sys.modules[module], name, fn)
+        return fn
+    return __getattr__
+
+
+def mark_dirty(track):
+    if track not in dirty_tracks:
+        dirty_tracks.append(track)
+
+
+def take_dirty():
+    tracks = dirty_tracks[:]
+    del dirty_tracks[:]
+    return tracks
+
+
+def emit(data):
+    for sink in sinks:
+        sink(data)
+
+
+def reset():
+    """Zeroes counters and output totals; model state (mixer values and so
+    on) is kept."""
+    for entry in STATS.values():
+        entry[0] = 0
+        entry[1] = 0.0
+    for key in output:
+        output[key] = 0
+    del dirty_tracks[:]
+
+
+def call_rows():
+    """[(name, calls, seconds)] for every stub called, most calls first."""
+    rows = [(name, entry[0], entry[1]) for name, entry in STATS.items() if entry[0]]
+    rows.sort(key=lambda row: (-row[1], row[0]))
+    return rows
@@ -0,0 +1,6 @@
+"""arrangement.py -- stub of FL Studio's `arrangement` module; every call is a counted
+no-op."""
+
+import _flstub
+
+__getattr__ = _flstub.fallback("arrangement")
@@ -0,0 +1,21 @@
+"""channels.py -- stub of FL Studio's `channels` module."""
+
+import _flstub
+
+_count = _flstub.counted("channels")
+__getattr__ = _flstub.fallback("channels")
+
+
+@_count
+def channelNumber(canBeNone=False):
+    return 0
+
+
+@_count
+def getChannelName(index):
+    return "Channel %d" % (index + 1)
+
+
+@_count
+def incEventValue(eventId, step, res=1 / 24):
+    return step
@@ -0,0 +1,78 @@
+"""
+device.py -- stub of FL Studio's `device` module.
+
+Every outgoing message is counted (frames and wire bytes) and handed to
+the harness's sinks -- the desk emulator, a capture file. midiOutNewMsg
+keeps FL's "only send if this slot's message changed" behaviour, so the
+suppressed count shows how much it saves.
+"""
+
+import _flstub
+
+_count = _flstub.counted("device")
+__getattr__ = _flstub.fallback("device")
+
+_last_new_msg = {}
+
+
+def _short_bytes(msg):
+    status = msg & 0xFF
+    size = 2 if status & 0xF0 in (0xC0, 0xD0) else 3
+    return bytes((status, (msg >> 8) & 0x7F, (msg >> 16) & 0x7F))[:size]
+
+
+def _send_short(msg):
+    data = _short_bytes(msg)
+    _flstub.output["short_msgs"] += 1
+    _flstub.output["short_bytes"] += len(data)
+    _flstub.emit(data)
+
+
+@_count
+def isAssigned():
+    return True
+
+
+@_count
+def getPortNumber():
+    return 0
+
+
+@_count
+def midiOutSysex(message):
+    data = bytes(message)
+    _flstub.output["sysex_frames"] += 1
+    _flstub.output["sysex_bytes"] += len(data)
+    _flstub.emit(data)
+
+
+@_count
+def midiOutMsg(message, *args):
+    if args:        # midiOutMsg(control, channel, data1, data2)
+        message = args[0] + ((args[1] & 0x7F) << 8) + ((args[2] & 0x7F) << 16) + (message & 0xF0)
+    _send_short(message)
+
+
+@_count
+def midiOutNewMsg(message, tag):
+    if _last_new_msg.get(tag) == message:
+        _flstub.output["new_msgs_suppressed"] += 1
+        return
+    _last_new_msg[tag] = message
+    _flstub.output["new_msgs_sent"] += 1
+    _send_short(message)
+
+
+@_count
+def dispatchReceiverCount():
+    return 0
+
+
+@_count
+def processMIDICC(eventData):
+    eventData.handled = True
+
+
+@_count
+def hardwareRefreshMixerTrack(index):
+    _flstub.mark_dirty(index)
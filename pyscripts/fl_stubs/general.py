@@ -0,0 +1,26 @@
+"""general.py -- stub of FL Studio's `general` module."""
+
+import _flstub
+
+_count = _flstub.counted("general")
+__getattr__ = _flstub.fallback("general")
+
+
+@_count
+def getUndoLevelHint():
+    return "1/1"
+
+
+@_count
+def getChangedFlag():
+    return 0
+
+
+@_count
+def getPrecount():
+    return False
+
+
+@_count
+def getUseMetronome():
+    return False
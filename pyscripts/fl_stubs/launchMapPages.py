@@ -0,0 +1,6 @@
+"""launchMapPages.py -- stub of FL Studio's `launchMapPages` module; every call is a counted
+no-op."""
+
+import _flstub
+
+__getattr__ = _flstub.fallback("launchMapPages")
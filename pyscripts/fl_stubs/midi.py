@@ -0,0 +1,174 @@
+"""
+midi.py -- stub of FL Studio's `midi` constants module.
+
+Status bytes, bit flags and the lookup tuples the scripts index into keep
+FL's values; the REC_* event ids are placeholders (distinct, but not FL's
+numbers). Names not defined here resolve to distinct placeholder ints, so
+a script reaching for a constant the stub lacks still runs.
+"""
+
+import itertools
+
+MIDI_NOTEOFF = 0x80
+MIDI_NOTEON = 0x90
+MIDI_KEYAFTERTOUCH = 0xA0
+MIDI_CONTROLCHANGE = 0xB0
+MIDI_PROGRAMCHANGE = 0xC0
+MIDI_CHANAFTERTOUCH = 0xD0
+MIDI_PITCHBEND = 0xE0
+MIDI_SYSEX = 0xF0
+
+MaxInt = 2147483647
+FromMIDI_Max = 1073741824
+EKRes = 1 / 24
+
+# OnRefresh flags
+HW_Dirty_Mixer_Sel = 1
+HW_Dirty_Mixer_Display = 2
+HW_Dirty_Mixer_Controls = 4
+HW_Dirty_RemoteLinks = 16
+HW_Dirty_FocusedWindow = 32
+HW_Dirty_Performance = 64
+HW_Dirty_LEDs = 256
+HW_Dirty_RemoteLinkValues = 512
+
+# event.pmeFlags
+PME_LiveInput = 1
+PME_System = 2
+PME_System_Safe = 4
+PME_Preview = 8
+PME_FromHost = 16
+PME_FromMIDI = 32
+
+# REC_* event ids and flags (placeholders)
+REC_UpdateValue = 1
+REC_UpdateControl = 2
+REC_FromMIDI = 4
+REC_Controller = 8
+REC_MIDIController = 16
+REC_Global = 0x10000000
+REC_MainVol = REC_Global + 1
+REC_Tempo = REC_Global + 5
+REC_Mixer_Vol = 0
+REC_Mixer_Pan = 1
+REC_Mixer_SS = 2
+REC_Mixer_Send_First = 0x100
+REC_Mixer_EQ_Gain = 0x200
+REC_Mixer_EQ_Freq = 0x208
+REC_Mixer_EQ_Q = 0x210
+REC_Plug_MixLevel = 0x300
+REC_Plug_Mute = 0x301
+PME_RECFlagsT = (REC_UpdateValue | REC_UpdateControl | REC_FromMIDI,
+                 REC_UpdateValue | REC_UpdateControl | REC_FromMIDI | REC_Controller)
+
+# transport.globalTransport commands and results
+FPT_Jog = 0
+FPT_Jog2 = 1
+FPT_Strip = 2
+FPT_StripJog = 3
+FPT_StripHold = 4
+FPT_Previous = 5
+FPT_Next = 6
+FPT_MoveJog = 7
+FPT_Play = 10
+FPT_Stop = 11
+FPT_Record = 12
+FPT_Rewind = 13
+FPT_FastForward = 14
+FPT_Loop = 15
+FPT_Mute = 16
+FPT_Mode = 17
+FPT_Undo = 20
+FPT_UndoUp = 21
+FPT_UndoJog = 22
+FPT_Punch = 30
+FPT_PunchIn = 31
+FPT_PunchOut = 32
+FPT_AddMarker = 33
+FPT_AddAltMarker = 34
+FPT_MarkerJumpJog = 35
+FPT_MarkerSelJog = 36
+FPT_Up = 40
+FPT_Down = 41
+FPT_Left = 42
+FPT_Right = 43
+FPT_HZoomJog = 44
+FPT_VZoomJog = 45
+FPT_Snap = 48
+FPT_SnapMode = 49
+FPT_Cut = 50
+FPT_Copy = 51
+FPT_Paste = 52
+FPT_Insert = 53
+FPT_Delete = 54
+FPT_NextWindow = 58
+FPT_WindowJog = 59
+FPT_F1 = 60
+FPT_Enter = 80
+FPT_Escape = 81
+FPT_Yes = 82
+FPT_No = 83
+FPT_Menu = 90
+FPT_ItemMenu = 91
+FPT_Save = 92
+FPT_SaveNew = 93
+FPT_Metronome = 110
+FPT_WaitForInput = 111
+FPT_Overdub = 112
+FPT_LoopRecord = 113
+FPT_StepEdit = 114
+FPT_CountDown = 115
+
+GT_Cannot = -1
+GT_Menu = 1
+GT_Global = 2
+
+PM_Stopped = 0
+PM_Playing = 2
+SM_Pat = 0
+SM_Song = 1
+
+widMixer = 0
+widChannelRack = 1
+widPlaylist = 2
+widPianoRoll = 3
+widBrowser = 4
+
+curfxScrollToMakeVisible = 1
+curfxCancelSmoothing = 2
+curfxNoDeselectAll = 4
+curfxMinimalLatencyUpdate = 8
+
+fxSoloModeWithSourceTracks = 1
+fxSoloModeWithDestTracks = 2
+fxSoloToggle = -1
+
+ROUTE_ToThis = 1
+ROUTE_StartingFromThis = 2
+
+TrackNum_Master = 0
+PEAK_L = 0
+PEAK_R = 1
+PEAK_LR = -1
+PEAK_L_INV = -2
+PEAK_R_INV = -3
+PEAK_LR_INV = -4
+
+TranzPort_OffOnT = (0, 0x7F)
+TranzPort_OffOnBlinkT = (0, 0x7F, 1)
+
+
+def EncodeRemoteControlID(PortNum, ChanNum, CCNum):
+    return CCNum + (ChanNum << 16) + ((PortNum + 1) << 22)
+
+
+_placeholders = {}
+_next_placeholder = itertools.count(0x7F000000)
+
+
+def __getattr__(name):
+    if name.startswith("__"):
+        raise AttributeError(name)
+    if name not in _placeholders:
+        _placeholders[name] = next(_next_placeholder)
+    return _placeholders[name]
@@ -0,0 +1,204 @@
+"""
+mixer.py -- stub of FL Studio's `mixer` module.
+
+Tracks keep volume/pan/mute/solo/arm state; any change marks the track
+dirty, and the harness turns that into OnDirtyMixerTrack/OnRefresh calls
+the way FL does. Peaks follow a slow per-track sine of the harness clock so
+meter code always has something moving to send.
+"""
+
+import math
+
+import _flstub
+import midi
+
+_count = _flstub.counted("mixer")
+__getattr__ = _flstub.fallback("mixer")
+
+TRACK_COUNT = 127
+DEFAULT_VOLUME = 0.8
+
+_volume = [DEFAULT_VOLUME] * TRACK_COUNT
+_pan = [0.0] * TRACK_COUNT
+_stereo_sep = [0.0] * TRACK_COUNT
+_muted = [False] * TRACK_COUNT
+_solo = [False] * TRACK_COUNT
+_armed = [False] * TRACK_COUNT
+_enabled = [True] * TRACK_COUNT
+_events = {}
+_selected = [1]
+
+
+def _name(index):
+    return "Master" if index == 0 else "Insert %d" % index
+
+
+def _set(values, index, value):
+    if 0 <= index < TRACK_COUNT and values[index] != value:
+        values[index] = value
+        _flstub.mark_dirty(index)
+
+
+@_count
+def trackCount():
+    return TRACK_COUNT
+
+
+@_count
+def trackNumber(*args):
+    return _selected[0]
+
+
+@_count
+def setTrackNumber(index, flags=0):
+    _selected[0] = index
+
+
+@_count
+def getTrackName(index, maxLen=0):
+    name = _name(index)
+    return name[:maxLen] if maxLen else name
+
+
+@_count
+def getTrackVolume(index, mode=0):
+    return _volume[index]
+
+
+@_count
+def setTrackVolume(index, volume, pickupMode=0):
+    _set(_volume, index, max(0.0, min(1.0, volume)))
+
+
+@_count
+def getTrackPan(index):
+    return _pan[index]
+
+
+@_count
+def setTrackPan(index, pan, pickupMode=0):
+    _set(_pan, index, max(-1.0, min(1.0, pan)))
+
+
+@_count
+def getTrackStereoSep(index):
+    return _stereo_sep[index]
+
+
+@_count
+def isTrackMuted(index):
+    return _muted[index]
+
+
+@_count
+def muteTrack(index, value=-1):
+    _set(_muted, index, not _muted[index] if value == -1 else bool(value))
+
+
+@_count
+def setTrackMuted(index, value):
+    _set(_muted, index, bool(value))
+
+
+@_count
+def isTrackSolo(index):
+    return _solo[index]
+
+
+@_count
+def soloTrack(index, value=-1, mode=0):
+    _set(_solo, index, not _solo[index] if value == -1 else bool(value))
+
+
+@_count
+def isTrackArmed(index):
+    return _armed[index]
+
+
+@_count
+def armTrack(index):
+    _set(_armed, index, not _armed[index])
+
+
+@_count
+def isTrackEnabled(index):
+    return _enabled[index]
+
+
+@_count
+def enableTrack(index):
+    _set(_enabled, index, not _enabled[index])
+
+
+@_count
+def getTrackPeaks(index, mode):
+    level = 0.5 + 0.5 * math.sin(_flstub.now * 2.0 * math.pi * 0.5 + index)
+    if mode in (midi.PEAK_L_INV, midi.PEAK_R_INV, midi.PEAK_LR_INV):
+        return 1.0 - level
+    return level
+
+
+@_count
+def getTrackRecordingFileName(index):
+    return ""
+
+
+@_count
+def getTrackPluginId(index, plugIndex):
+    return (index << 6) + plugIndex
+
+
+@_count
+def isTrackPluginValid(index, plugIndex):
+    return False
+
+
+@_count
+def isTrackAutomationEnabled(index, plugIndex):
+    return False
+
+
+@_count
+def getRouteSendActive(index, destIndex):
+    return False
+
+
+@_count
+def setRouteTo(index, destIndex, value, updateUI=False):
+    return 0
+
+
+@_count
+def getEventValue(index, value=0, smoothTarget=True):
+    return _events.get(index, 0)
+
+
+@_count
+def automateEvent(index, value, flags, speed=0, isIncrement=0, res=midi.EKRes):
+    _events[index] = value
+    return value
+
+
+@_count
+def getAutoSmoothEventValue(index, locked=1):
+    return _events.get(index, 0)
+
+
+@_count
+def remoteFindEventValue(index, flags=0):
+    return -1.0
+
+
+@_count
+def getEventIDName(index, shortName=0):
+    return "Event %d" % index
+
+
+@_count
+def getEventIDValueString(index, value):
+    return str(value)
+
+
+@_count
+def getCurrentTempo(asInt=0):
+    return 140000 if asInt else 140.0
@@ -0,0 +1,16 @@
+"""patterns.py -- stub of FL Studio's `patterns` module."""
+
+import _flstub
+
+_count = _flstub.counted("patterns")
+__getattr__ = _flstub.fallback("patterns")
+
+
+@_count
+def patternNumber():
+    return 1
+
+
+@_count
+def getPatternName(index):
+    return "Pattern %d" % index
@@ -0,0 +1,22 @@
+"""playlist.py -- stub of FL Studio's `playlist` module (song position
+1:1:0)."""
+
+import _flstub
+
+_count = _flstub.counted("playlist")
+__getattr__ = _flstub.fallback("playlist")
+
+
+@_count
+def getVisTimeBar():
+    return 1
+
+
+@_count
+def getVisTimeStep():
+    return 1
+
+
+@_count
+def getVisTimeTick():
+    return 0
@@ -0,0 +1,6 @@
+"""plugins.py -- stub of FL Studio's `plugins` module; every call is a counted
+no-op."""
+
+import _flstub
+
+__getattr__ = _flstub.fallback("plugins")
@@ -0,0 +1,28 @@
+"""transport.py -- stub of FL Studio's `transport` module (stopped, not
+recording; every globalTransport command is reported as handled)."""
+
+import _flstub
+import midi
+
+_count = _flstub.counted("transport")
+__getattr__ = _flstub.fallback("transport")
+
+
+@_count
+def globalTransport(command, value, pmeflags=midi.PME_System, flags=0):
+    return midi.GT_Global
+
+
+@_count
+def isPlaying():
+    return midi.PM_Stopped
+
+
+@_count
+def isRecording():
+    return False
+
+
+@_count
+def getLoopMode():
+    return midi.SM_Pat
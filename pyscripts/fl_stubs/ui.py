@@ -0,0 +1,68 @@
+"""ui.py -- stub of FL Studio's `ui` module."""
+
+import _flstub
+
+_count = _flstub.counted("ui")
+__getattr__ = _flstub.fallback("ui")
+
+_time_disp_min = [False]
+
+
+@_count
+def getProgTitle():
+    return "FL Studio"
+
+
+@_count
+def getVersion(mode=0):
+    return "21.0.3"
+
+
+@_count
+def getHintMsg():
+    return ""
+
+
+@_count
+def GetHintMsg():
+    return ""
+
+
+@_count
+def getHintValue(value, max):
+    return "%d%%" % round(value * 100 / max) if max else ""
+
+
+@_count
+def getFocused(index):
+    return False
+
+
+@_count
+def getFocusedFormCaption():
+    return ""
+
+
+@_count
+def getSnapMode():
+    return 3
+
+
+@_count
+def getTimeDispMin():
+    return _time_disp_min[0]
+
+
+@_count
+def setTimeDispMin():
+    _time_disp_min[0] = not _time_disp_min[0]
+
+
+@_count
+def isClosing():
+    return False
+
+
+@_count
+def isInPopupMenu():
+    return False
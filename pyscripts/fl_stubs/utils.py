@@ -0,0 +1,34 @@
+"""utils.py -- the helpers from FL Studio's `utils` module that the device
+scripts use. FL ships these as plain Python, so they are reimplemented, not
+counted."""
+
+
+def Zeros(value, nChars, c='0'):
+    if value < 0:
+        digits = str(-value)
+        return '-' + c * (nChars - len(digits)) + digits
+    digits = str(value)
+    return c * (nChars - len(digits)) + digits
+
+
+def Zeros_Strict(value, nChars, c='0'):
+    return Zeros(value, nChars, c)[-nChars:] if nChars else ''
+
+
+def SignOf(value):
+    if value < 0:
+        return -1
+    return 0 if value == 0 else 1
+
+
+def DivModU(a, b):
+    return a // b, a % b
+
+
+def SwapInt(a, b):
+    return b, a
+
+
+def KnobAccelToRes2(value):
+    n = abs(value)
+    return n ** 0.75 if n > 1 else 1